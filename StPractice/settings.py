@@ -109,6 +109,15 @@ SOCIAL_AUTH_VK_OAUTH2_KEY = os.getenv('SOCIAL_AUTH_VK_OAUTH2_KEY')
 SOCIAL_AUTH_VK_OAUTH2_SECRET = os.getenv('SOCIAL_AUTH_VK_OAUTH2_SECRET')
 
 SOCIAL_AUTH_TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Клиент Telegram (crm/telegram.py): адрес API (заменяется на заглушку в тестах), пул соединений
+# и лимиты отправки — сообщений в секунду всего, в один чат и в одну группу
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_TIMEOUT = 10
+TELEGRAM_MAX_CONNECTIONS = 20
+TELEGRAM_MAX_RETRIES = 3
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_GROUP_RATE = 20 / 60
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 SOCIAL_AUTH_URL_NAMESPACE = 'social'  # Соответствует namespace в urls.py
 from datetime import timedelta
@@ -202,5 +211,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = "/api/profile/"
 
+# Время жизни закэшированной карточки мероприятия (ключ кэша включает версию мероприятия)
+EVENT_DETAIL_CACHE_TIMEOUT = 60 * 60
+
+# Очередь фоновых задач (crm/jobs.py): блокировка задачи воркером и задержки повторов, в секундах
+JOB_LEASE_TIMEOUT = 5 * 60
+JOB_RETRY_BASE_DELAY = 30
+JOB_RETRY_MAX_DELAY = 60 * 60
+# Предельное время выполнения одной задачи, сек
+JOB_TIMEOUT = 2 * 60
+
+# Сводки уведомлений (crm/notifications.py): окно накопления сообщений в чат, сек, и размер сводки
+NOTIFICATION_DIGEST_WINDOW = 60
+NOTIFICATION_DIGEST_MAX_MESSAGES = 50
+
+# Время жизни скомпилированного плана статуса в памяти процесса, сек (crm/automation.py)
+AUTOMATION_PLAN_TTL = 5 * 60
+# Сколько независимых шагов цепочки статуса выполняются одновременно
+AUTOMATION_MAX_PARALLEL = 10
+# Бюджет цепочки автоматических переводов (move_status), начатой одним изменением статуса:
+# число переходов и время от начала, сек. Превысившая бюджет цепочка прерывается
+AUTOMATION_MAX_HOPS = 20
+AUTOMATION_MAX_CHAIN_SECONDS = 10 * 60
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Загрузка вложений комментариев частями (plan/attachments.py): каталог незавершенных загрузок
+# внутри MEDIA_ROOT, предельный размер файла и одной части, байт
+COMMENT_UPLOAD_DIR = 'uploads'
+COMMENT_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+COMMENT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Размер миниатюр изображений-вложений, пикселей
+COMMENT_THUMBNAIL_SIZE = (320, 320)
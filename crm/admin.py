@@ -17,6 +17,11 @@ admin.site.register(Application)
 admin.site.register(Robot)
 admin.site.register(Trigger)
 admin.site.register(FunctionOrder)
+admin.site.register(Job)
+admin.site.register(PendingNotification)
+admin.site.register(ScheduledTrigger)
+admin.site.register(TriggerAction)
+admin.site.register(AutomationRun)
 # admin.site.register(Test)
 # admin.site.register(Question)
 # admin.site.register(Answer)
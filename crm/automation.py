@@ -0,0 +1,442 @@
+import contextvars
+import datetime
+import json
+import operator
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from operator import attrgetter
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Prefetch, Q
+from django.utils import timezone
+
+from .models import Application, AutomationPlansVersion, FunctionOrder, Status, TriggerAction
+
+# Поколение планов, прочитанное в начале задачи или пачки (plans_scope): дальше планы
+# сверяются с ним без запросов к БД
+current_plans_generation = contextvars.ContextVar('plans_generation', default=None)
+
+# Оператор сравнения -> (функция для Python, lookup для ORM)
+COMPARISON_OPERATORS = {
+    '>': (operator.gt, 'gt'),
+    '<': (operator.lt, 'lt'),
+    '>=': (operator.ge, 'gte'),
+    '<=': (operator.le, 'lte'),
+    '==': (operator.eq, 'exact'),
+    '!=': (operator.ne, 'exact'),
+}
+TIME_INTERVALS = ('weeks', 'days', 'hours', 'minutes', 'seconds')
+APPLICATION_FIELDS = {field.attname for field in Application._meta.concrete_fields} | {
+    field.name for field in Application._meta.concrete_fields
+}
+# Условие, которому не удовлетворяет ни одна заявка
+NOTHING = Q(pk__in=[])
+
+
+class PlanConfigError(Exception):
+    """Некорректная конфигурация функции статуса"""
+
+
+@dataclass(frozen=True)
+class PlanStep:
+    """
+    Скомпилированная функция статуса: проверенная конфигурация и готовый обработчик.
+    Для робота action — тип действия, для триггера — тип условия и check(заявка) -> bool.
+    condition() — то же условие как Q-выражение для проверки множества заявок одним запросом
+    (None — только проверка в Python); у триггера по времени due(заявка) — момент срабатывания
+    (для планировщика crm/scheduler.py).
+    """
+    function_id: int
+    position: int
+    type_function: str
+    action: str
+    config: MappingProxyType
+    check: object = None
+    condition: object = None
+    due: object = None
+    # Действия триггера и граница графа: индексы шагов, после которых выполняется этот,
+    # и признак шага, меняющего статус (он упорядочивает соседние шаги)
+    actions: tuple = ()
+    depends_on: tuple = ()
+    barrier: bool = False
+    error: str = ''
+
+
+@dataclass(frozen=True)
+class StatusPlan:
+    """Цепочка функций статуса в рамках мероприятия в порядке позиций"""
+    event_id: int
+    status_id: int
+    steps: tuple
+    generation: int
+    compiled_at: float
+
+
+def get_function_config(function_order):
+    """Конфигурация функции: JSONField уже содержит dict, старые записи могут хранить строку"""
+    config = function_order.config
+    if isinstance(config, str):
+        config = json.loads(config)
+    return config or {}
+
+
+def require(config, *keys):
+    missing = [key for key in keys if config.get(key) in (None, '')]
+    if missing:
+        raise PlanConfigError(f"Не заданы параметры: {', '.join(missing)}")
+
+
+def compile_move_status(config):
+    require(config, 'target_status')
+    status_id = Status.objects.filter(name=config['target_status']).values_list('id', flat=True).first()
+    if status_id is None:
+        raise PlanConfigError(f"Статус {config['target_status']} не найден")
+    return {'target_status_id': status_id}
+
+
+def compile_notification(config):
+    require(config, 'chat_id', 'bot_token')
+    return {}
+
+
+def compile_time_trigger(config):
+    require(config, 'interval', 'value')
+    if config['interval'] not in TIME_INTERVALS:
+        raise PlanConfigError(f"Неизвестный интервал: {config['interval']}")
+    delta = datetime.timedelta(**{config['interval']: config['value']})
+    field = config.get('field', 'date_sub')
+    if field not in APPLICATION_FIELDS:
+        raise PlanConfigError(f"Неизвестное поле заявки: {field}")
+    get_value = attrgetter(field)
+
+    def due(application):
+        value = get_value(application)
+        return None if value is None else value + delta
+
+    def check(application):
+        due_at = due(application)
+        return due_at is not None and timezone.now() > due_at
+
+    def condition():
+        return Q(**{f'{field}__lt': timezone.now() - delta})
+    return {'check': check, 'condition': condition, 'due': due}
+
+
+def compile_status_trigger(config):
+    require(config, 'status')
+    name = config['status']
+    return {
+        'check': lambda application: application.status.name == name,
+        'condition': lambda: Q(status__name=name),
+    }
+
+
+def application_field_value(field, value):
+    """Значение из конфигурации, приведенное к типу поля заявки (как его сравнит база данных)"""
+    if value is None:
+        return None
+    try:
+        value = field.to_python(value)
+    except ValidationError as e:
+        raise PlanConfigError(f"Некорректное значение для поля {field.name}: {value}") from e
+    if isinstance(value, datetime.datetime) and settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def compile_field_trigger(config):
+    require(config, 'field', 'operator')
+    if config['field'] not in APPLICATION_FIELDS:
+        raise PlanConfigError(f"Неизвестное поле заявки: {config['field']}")
+    if config['operator'] not in COMPARISON_OPERATORS:
+        raise PlanConfigError(f"Неизвестный оператор: {config['operator']}")
+    field = Application._meta.get_field(config['field'])
+    # Внешние ключи сравниваются по id, как в базе данных
+    get_value, name = attrgetter(field.attname), field.attname
+    compare, lookup = COMPARISON_OPERATORS[config['operator']]
+    value = application_field_value(field, config.get('value'))
+
+    if lookup == 'exact':
+        negate = config['operator'] == '!='
+        condition = Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        return {
+            'check': lambda application: compare(get_value(application), value),
+            'condition': lambda: ~condition if negate else condition,
+        }
+
+    # Упорядочивающее сравнение с NULL в SQL ложно, в Python ведет себя так же
+    condition = NOTHING if value is None else Q(**{f'{name}__{lookup}': value})
+
+    def check(application):
+        current = get_value(application)
+        return current is not None and value is not None and compare(current, value)
+    return {'check': check, 'condition': lambda: condition}
+
+
+ROBOT_COMPILERS = {
+    'move_status': compile_move_status,
+    'notification': compile_notification,
+}
+TRIGGER_COMPILERS = {
+    'time_expiration': compile_time_trigger,
+    'status_check': compile_status_trigger,
+    'field_comparison': compile_field_trigger,
+}
+
+
+def compile_step(source, type_function, action, actions=()):
+    """
+    Компиляция функции статуса или действия триггера (source — FunctionOrder или TriggerAction);
+    ошибка конфигурации сохраняется в шаге и сообщается при выполнении.
+    """
+    step = dict(function_id=source.pk, position=source.position, type_function=type_function, action=action,
+                actions=actions, barrier=action == 'move_status' or any(node.barrier for node in actions))
+    try:
+        config = get_function_config(source)
+        if type_function == 'robot':
+            compiler = ROBOT_COMPILERS.get(action)
+            if compiler is None:
+                raise PlanConfigError(f"Неизвестный тип действия: {action}")
+            config = {**config, **compiler(config)}
+        else:
+            compiler = TRIGGER_COMPILERS.get(action)
+            if compiler is None:
+                raise PlanConfigError(f"Неизвестный тип условия: {action}")
+            step.update(compiler(config))
+    except (PlanConfigError, ValueError, TypeError) as e:
+        return PlanStep(config=MappingProxyType({}), error=str(e), **step)
+    return PlanStep(config=MappingProxyType(config), **step)
+
+
+def link_steps(steps, explicit=None):
+    """
+    Зависимости шагов графа: явные (индексы предыдущих шагов) и порядок вокруг барьеров —
+    шаг с move_status выполняется после всех предыдущих, следующие ждут его завершения.
+    Остальные шаги независимы и выполняются параллельно.
+    """
+    linked = []
+    last_barrier = None
+    for index, step in enumerate(steps):
+        depends_on = set(explicit[index]) if explicit else set()
+        if step.barrier:
+            depends_on.update(range(index))
+            last_barrier = index
+        elif last_barrier is not None:
+            depends_on.add(last_barrier)
+        linked.append(replace(step, depends_on=tuple(sorted(depends_on))))
+    return tuple(linked)
+
+
+def compile_trigger_actions(function_order):
+    """Действия триггера; зависимость допускается только от действия с меньшей позицией"""
+    actions = [action for action in function_order.actions.all() if action.robot.status]
+    indexes = {action.pk: index for index, action in enumerate(actions)}
+    steps, explicit = [], []
+    for index, action in enumerate(actions):
+        step = compile_step(action, 'robot', action.robot.type_action)
+        depends_on = set()
+        for dependency in action.depends_on.all():
+            if dependency.pk not in indexes:
+                # Действие отключенного робота или другого триггера
+                continue
+            if indexes[dependency.pk] >= index:
+                step = replace(step, error=f"Зависимость от следующего действия #{dependency.position}")
+                continue
+            depends_on.add(indexes[dependency.pk])
+        steps.append(step)
+        explicit.append(depends_on)
+    return link_steps(steps, explicit)
+
+
+def compile_status_plan(status_id, event_id, generation=0):
+    """Цепочка функций статуса мероприятия; неактивные роботы и триггеры пропускаются"""
+    functions = FunctionOrder.objects.filter(
+        status_order__status_id=status_id,
+        status_order__event_id=event_id,
+    ).order_by('position').select_related('robot', 'trigger').prefetch_related(
+        Prefetch('actions', queryset=TriggerAction.objects.select_related('robot').prefetch_related('depends_on')
+                 .order_by('position'))
+    )
+    steps = []
+    for function_order in functions:
+        if function_order.type_function == 'robot':
+            if function_order.robot is None or not function_order.robot.status:
+                continue
+            steps.append(compile_step(function_order, 'robot', function_order.robot.type_action))
+        else:
+            if function_order.trigger is None or not function_order.trigger.status:
+                continue
+            steps.append(compile_step(function_order, 'trigger', function_order.trigger.type_condition,
+                                      compile_trigger_actions(function_order)))
+    return StatusPlan(event_id=event_id, status_id=status_id, steps=link_steps(steps), generation=generation,
+                      compiled_at=time.monotonic())
+
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+def read_plans_generation():
+    return AutomationPlansVersion.objects.filter(pk=1).values_list('generation', flat=True).first() or 0
+
+
+def plans_generation():
+    """Поколение планов: прочитанное в текущем plans_scope, вне его — из БД"""
+    generation = current_plans_generation.get()
+    return read_plans_generation() if generation is None else generation
+
+
+@contextmanager
+def plans_scope(generation=None):
+    """
+    Поколение планов читается один раз на задачу или пачку заявок. В async-коде поколение
+    передается прочитанным заранее (sync_to_async(read_plans_generation)). Вложенная область
+    без явного поколения использует внешнее.
+    """
+    if generation is None and current_plans_generation.get() is not None:
+        yield
+        return
+    token = current_plans_generation.set(read_plans_generation() if generation is None else generation)
+    try:
+        yield
+    finally:
+        current_plans_generation.reset(token)
+
+
+def get_status_plan(status_id, event_id):
+    """
+    План статуса из памяти процесса. План перестраивается, если сменилось поколение планов в БД
+    (изменение функций статусов в любом процессе) или истек AUTOMATION_PLAN_TTL.
+    """
+    generation = plans_generation()
+    plan = _plans.get((event_id, status_id))
+    if (plan is None or plan.generation != generation
+            or time.monotonic() - plan.compiled_at > settings.AUTOMATION_PLAN_TTL):
+        plan = compile_status_plan(status_id, event_id, generation)
+        with _plans_lock:
+            _plans[(event_id, status_id)] = plan
+    return plan
+
+
+def forget_plans(event_id):
+    """Убирает из памяти процесса планы мероприятия, не меняя поколение в БД (копии мероприятий симуляции)"""
+    with _plans_lock:
+        for key in [key for key in _plans if key[0] == event_id]:
+            del _plans[key]
+
+
+def bump_plans_generation():
+    if not AutomationPlansVersion.objects.filter(pk=1).update(generation=F('generation') + 1):
+        AutomationPlansVersion.objects.get_or_create(pk=1, defaults={'generation': 1})
+
+
+def invalidate_plans():
+    """
+    Сбрасывает планы статусов. Поколение в БД меняется в транзакции изменения: другие процессы
+    видят новое поколение только вместе с сохраненными данными и не компилируют план по старым.
+    """
+    with _plans_lock:
+        _plans.clear()
+    bump_plans_generation()
+
+
+def evaluate_trigger(step, queryset):
+    """
+    Id заявок из queryset, удовлетворяющих условию шага-триггера: одним запросом,
+    если условие выражается в ORM, иначе проверкой каждой заявки в Python.
+    """
+    if step.condition is not None:
+        return set(queryset.filter(step.condition()).values_list('pk', flat=True))
+    return {application.pk for application in queryset.select_related('status') if step.check(application)}
+
+
+def evaluate_event_trigger(step, event_id, status_id=None):
+    """Проверка триггера по всем заявкам мероприятия (или одного его статуса)"""
+    queryset = Application.objects.filter(event_id=event_id)
+    if status_id is not None:
+        queryset = queryset.filter(status_id=status_id)
+    return evaluate_trigger(step, queryset)
+
+
+# Триггеры, действия которых выполняются сразу при входе в статус (триггеры по времени отложены)
+IMMEDIATE_TRIGGERS = ('status_check', 'field_comparison')
+
+
+def status_ids_by_name(names):
+    """Id статусов по названию; при совпадении названий берется первый, как при компиляции плана"""
+    ids = {}
+    for status_id, name in Status.objects.filter(name__in=names).order_by('pk').values_list('id', 'name'):
+        ids.setdefault(name, status_id)
+    return ids
+
+
+def status_transitions(event_id, exclude_function=None, exclude_action=None):
+    """
+    Немедленные переходы move_status мероприятия: {статус: {целевые статусы}} —
+    роботы статусов и действия триггеров, срабатывающих при входе в статус.
+    """
+    robots = FunctionOrder.objects.filter(
+        status_order__event_id=event_id, type_function='robot',
+        robot__type_action='move_status', robot__status=True,
+    ).exclude(pk=exclude_function).values_list('status_order__status_id', 'config')
+    actions = TriggerAction.objects.filter(
+        function_order__status_order__event_id=event_id, function_order__type_function='trigger',
+        function_order__trigger__type_condition__in=IMMEDIATE_TRIGGERS, function_order__trigger__status=True,
+        robot__type_action='move_status', robot__status=True,
+    ).exclude(pk=exclude_action).values_list('function_order__status_order__status_id', 'config')
+
+    rows = []
+    for status_id, config in [*robots, *actions]:
+        if isinstance(config, str):
+            config = json.loads(config)
+        if isinstance(config, dict) and config.get('target_status'):
+            rows.append((status_id, config['target_status']))
+    ids = status_ids_by_name({name for _, name in rows})
+
+    transitions = {}
+    for status_id, name in rows:
+        if name in ids:
+            transitions.setdefault(status_id, set()).add(ids[name])
+    return transitions
+
+
+def find_status_cycle(event_id, status_id, target_status, exclude_function=None, exclude_action=None):
+    """
+    Цикл, который замкнет новый переход status_id -> target_status (название статуса):
+    список id статусов от status_id до него же или None.
+    """
+    target_id = status_ids_by_name([target_status]).get(target_status)
+    if target_id is None:
+        return None
+    transitions = status_transitions(event_id, exclude_function, exclude_action)
+    parents = {target_id: None}
+    queue = [target_id]
+    while queue:
+        current = queue.pop(0)
+        if current == status_id:
+            path = []
+            while current is not None:
+                path.append(current)
+                current = parents[current]
+            return [status_id, *reversed(path)]
+        for following in transitions.get(current, ()):
+            if following not in parents:
+                parents[following] = current
+                queue.append(following)
+    return None
+
+
+def move_status_cycle_error(status_order, config, exclude_function=None, exclude_action=None):
+    """Текст ошибки, если переход move_status из статуса status_order замыкает цикл статусов"""
+    if not status_order or not isinstance(config, dict) or not config.get('target_status'):
+        return None
+    cycle = find_status_cycle(status_order.event_id, status_order.status_id, config['target_status'],
+                              exclude_function, exclude_action)
+    if cycle is None:
+        return None
+    names = Status.objects.in_bulk(set(cycle))
+    return "Цикл переходов статусов: " + " → ".join(names[status_id].name for status_id in cycle)
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Event, new_version
+
+# Блокировки для схлопывания одновременных промахов по одному ключу
+_rebuild_locks = weakref.WeakValueDictionary()
+_rebuild_locks_guard = threading.Lock()
+
+
+def bump_event_version(*event_ids):
+    """Сбрасывает кэш мероприятий, выдавая им новую версию и отметку времени изменения"""
+    event_ids = [event_id for event_id in event_ids if event_id]
+    if event_ids:
+        Event.objects.filter(pk__in=event_ids).update(version=new_version(), updated_at=timezone.now())
+
+
+def bump_events_version(queryset):
+    """Сбрасывает кэш всех мероприятий из queryset"""
+    Event.objects.filter(pk__in=queryset.values('pk')).update(version=new_version(), updated_at=timezone.now())
+
+
+def _get_rebuild_lock(key):
+    with _rebuild_locks_guard:
+        lock = _rebuild_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _rebuild_locks[key] = lock
+        return lock
+
+
+def event_detail_cache_key(event_id, version, query_params):
+    """Ключ кэша: мероприятие, его версия и параметры запроса (fields/omit)"""
+    params = '&'.join(f'{key}={",".join(query_params.getlist(key))}' for key in sorted(query_params))
+    digest = hashlib.md5(params.encode()).hexdigest()
+    return f'crm:event:{event_id}:{version}:{digest}'
+
+
+def cached_event_detail(event_id, query_params, build):
+    """
+    Возвращает сериализованное мероприятие из кэша или строит его функцией build().
+
+    Версия читается одним запросом по первичному ключу; пока она не изменилась,
+    сериализатор не запускается. Одновременные промахи по одному ключу ждут
+    единственной перестройки.
+    """
+    version = Event.objects.filter(pk=event_id).values_list('version', flat=True).first()
+    if version is None:
+        # Мероприятия нет — build() вернет обычный 404
+        return build()
+
+    key = event_detail_cache_key(event_id, version, query_params)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    with _get_rebuild_lock(key):
+        data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data, settings.EVENT_DETAIL_CACHE_TIMEOUT)
+    return data
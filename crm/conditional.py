@@ -0,0 +1,62 @@
+import hashlib
+
+from django.db.models import Count, Max, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы (ETag / Last-Modified) для generic-представлений.
+
+    Перед сериализацией выполняется один агрегирующий запрос без соединений: количество
+    записей и максимум по полям conditional_markers основной таблицы, а для моделей
+    вложенных объектов conditional_models — последняя отметка updated_at всей таблицы
+    (чтение конца индекса). Изменение любой записи такой модели меняет ETag всех ответов
+    с ней — ответ пересылается чаще, но без соединений по каждой строке выборки.
+    Если клиент прислал совпадающий If-None-Match или If-Modified-Since, возвращается 304
+    без запуска сериализатора.
+
+    Last-Modified отдается только для одной записи: удаление записи из списка (или ее выход
+    из фильтра) не меняет наибольшую отметку времени, это видно только по числу записей в ETag.
+    """
+    # Поля основной таблицы с отметкой времени изменения записи
+    conditional_markers = ('updated_at',)
+    # Модели вложенных в ответ объектов с индексированным полем updated_at
+    conditional_models = ()
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_change_marker(request)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_change_marker(self, request):
+        """ETag и время последнего изменения для текущего запроса"""
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        detail = lookup_url_kwarg in self.kwargs
+        if detail:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+        aggregates = {f'marker_{i}': Max(field) for i, field in enumerate(self.conditional_markers)}
+        aggregates.update({
+            f'model_{i}': Max(Subquery(model.objects.order_by('-updated_at').values('updated_at')[:1]))
+            for i, model in enumerate(self.conditional_models)
+        })
+        markers = queryset.order_by().aggregate(total=Count('pk'), **aggregates)
+        timestamps = [markers[key] for key in aggregates if markers[key] is not None]
+        last_modified = int(max(timestamps).timestamp()) if detail and timestamps else None
+
+        # ETag зависит от представления: адреса с параметрами (фильтры, поля, курсор) и формата ответа
+        accepted = getattr(request, 'accepted_media_type', '')
+        source = '|'.join([request.get_full_path(), accepted, str(markers['total'])] +
+                          [str(markers[key]) for key in aggregates])
+        etag = quote_etag(hashlib.sha1(source.encode()).hexdigest())
+        return etag, last_modified
@@ -0,0 +1,68 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Application
+
+# Колонки выгрузки: заголовок -> путь в ORM (связи разворачиваются JOIN'ами в одном запросе)
+APPLICATION_EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('date_sub', 'date_sub'),
+    ('date_end', 'date_end'),
+    ('status', 'status__name'),
+    ('is_approved', 'is_approved'),
+    ('is_link', 'is_link'),
+    ('user_id', 'user_id'),
+    ('surname', 'user__surname'),
+    ('name', 'user__name'),
+    ('patronymic', 'user__patronymic'),
+    ('email', 'user__email'),
+    ('telegram', 'user__telegram'),
+    ('vk', 'user__vk'),
+    ('university', 'user__university'),
+    ('course', 'user__course'),
+    ('direction', 'direction__name'),
+    ('specialization', 'specialization__name'),
+    ('message', 'message'),
+    ('comment', 'comment'),
+)
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи в файл"""
+
+    def write(self, value):
+        return value
+
+
+def iter_application_rows(event_id, chunk_size=2000):
+    """
+    Построчный обход заявок мероприятия порциями по первичному ключу.
+
+    Каждая порция — отдельный запрос WHERE id > <последний id> LIMIT chunk_size,
+    поэтому в памяти одновременно не больше chunk_size строк независимо от СУБД
+    (mysqlclient не умеет серверные курсоры и iterator() загрузил бы все строки).
+    """
+    paths = [path for _, path in APPLICATION_EXPORT_COLUMNS]
+    queryset = Application.objects.filter(event_id=event_id).order_by('id').values_list(*paths)
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+
+def stream_applications_csv(event_id):
+    writer = csv.writer(Echo())
+    yield writer.writerow([header for header, _ in APPLICATION_EXPORT_COLUMNS])
+    for row in iter_application_rows(event_id):
+        yield writer.writerow(row)
+
+
+def stream_applications_ndjson(event_id):
+    headers = [header for header, _ in APPLICATION_EXPORT_COLUMNS]
+    for row in iter_application_rows(event_id):
+        yield json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
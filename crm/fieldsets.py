@@ -0,0 +1,118 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import permissions
+from rest_framework.exceptions import ValidationError
+
+
+def parse_fields_param(value):
+    """Разбор значения вида "a,b,c" в список имен полей"""
+    if not value:
+        return []
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    Сериализатор с поддержкой разреженных наборов полей.
+
+    GET ?fields=name,start — вернуть только перечисленные поля
+    GET ?omit=applications — вернуть все поля, кроме перечисленных
+
+    Набор полей влияет не только на JSON, но и на SQL: setup_eager_loading()
+    подгружает только связи выбранных полей и откладывает (defer) лишние колонки.
+    """
+    # Поле сериализатора -> пути для select_related
+    select_related_fields = {}
+    # Поле сериализатора -> lookups для prefetch_related (строка, Prefetch или функция, возвращающая Prefetch)
+    prefetch_related_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+        requested = self.get_requested_fields(request)
+        if requested is None:
+            return
+        for name in list(self.fields):
+            if name not in requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """Набор полей, запрошенных клиентом, или None, если ограничений нет"""
+        fields = parse_fields_param(request.query_params.get('fields'))
+        omit = parse_fields_param(request.query_params.get('omit'))
+        if not fields and not omit:
+            return None
+
+        available = list(cls().fields)
+        unknown = [name for name in fields + omit if name not in available]
+        if unknown:
+            raise ValidationError({'fields': f"Неизвестные поля: {', '.join(unknown)}"})
+
+        selected = fields or available
+        return [name for name in selected if name not in omit]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None):
+        """
+        Подготовка queryset под выбранный набор полей: select_related/prefetch_related
+        только для запрошенных связей и only() по нужным колонкам.
+        """
+        serializer_fields = cls().fields
+        if fields is None:
+            fields = list(serializer_fields)
+
+        select_related = []
+        prefetch_related = []
+        for name in fields:
+            select_related.extend(cls.select_related_fields.get(name, []))
+            for lookup in cls.prefetch_related_fields.get(name, []):
+                prefetch_related.append(lookup() if callable(lookup) else lookup)
+
+        if select_related:
+            queryset = queryset.select_related(*dict.fromkeys(select_related))
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*dict.fromkeys(prefetch_related))
+
+        columns = cls._get_required_columns(queryset.model, [serializer_fields[name] for name in fields])
+        if columns is not None:
+            columns.update(path.split('__')[0] for path in select_related)
+            queryset = queryset.only(*columns)
+        return queryset
+
+    @staticmethod
+    def _get_required_columns(model, fields):
+        """
+        Колонки модели, необходимые выбранным полям сериализатора.
+        Возвращает None, если набор колонок определить нельзя (например, для SerializerMethodField).
+        """
+        columns = {model._meta.pk.name}
+        for field in fields:
+            if field.source == '*':
+                return None
+            root = field.source.split('.')[0]
+            try:
+                model_field = model._meta.get_field(root)
+            except FieldDoesNotExist:
+                if hasattr(model, root):
+                    # property или метод модели может обращаться к любым колонкам
+                    return None
+                continue
+            if model_field.concrete and not model_field.many_to_many:
+                columns.add(model_field.name)
+        return columns
+
+
+class SparseFieldsViewMixin:
+    """Представление, строящее queryset под набор полей из ?fields= / ?omit="""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, SparseFieldsMixin):
+            return queryset
+        fields = None
+        if self.request.method in permissions.SAFE_METHODS:
+            fields = serializer_class.get_requested_fields(self.request)
+        return serializer_class.setup_eager_loading(queryset, fields)
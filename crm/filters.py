@@ -0,0 +1,74 @@
+import datetime
+
+from django.utils import timezone
+from django_filters import rest_framework as filters
+
+
+def day_start(value):
+    """Начало дня в текущем часовом поясе"""
+    return timezone.make_aware(datetime.datetime.combine(value, datetime.time.min))
+
+
+class DayStartFilter(filters.DateFilter):
+    """
+    Фильтр DateTimeField по дате: значение >= начала дня.
+    Сравнение идет с самой колонкой (без __date), поэтому используется индекс.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('lookup_expr', 'gte')
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value:
+            value = day_start(value)
+        return super().filter(qs, value)
+
+
+class DayEndFilter(filters.DateFilter):
+    """Фильтр DateTimeField по дате включительно: значение < начала следующего дня"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('lookup_expr', 'lt')
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value:
+            value = day_start(value + datetime.timedelta(days=1))
+        return super().filter(qs, value)
+
+
+class DayFilter(filters.DateFilter):
+    """Фильтр DateTimeField по конкретному дню как диапазон [начало дня, начало следующего дня)"""
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        return self.get_method(qs)(**{
+            f'{self.field_name}__gte': day_start(value),
+            f'{self.field_name}__lt': day_start(value + datetime.timedelta(days=1)),
+        })
+
+
+class IndexedBooleanFilter(filters.BooleanFilter):
+    """
+    Булев фильтр, пригодный для составного индекса.
+    Django сравнивает булево поле с True как голую колонку (WHERE is_link),
+    что не используется как равенство по префиксу индекса; IN (1) — используется.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('lookup_expr', 'in')
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value is None:
+            return qs
+        return super().filter(qs, [value])
+
+
+def filter_by_id_or_name(queryset, field_name, value):
+    """Фильтр по внешнему ключу: число — первичный ключ, иначе название без учета регистра"""
+    if value.isdigit():
+        return queryset.filter(**{field_name: value})
+    return queryset.filter(**{f'{field_name}__name__iexact': value})
@@ -0,0 +1,138 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .models import Application, FunnelCounter, Status, Status_order
+
+
+def funnel_key(event_id, status_id, direction_id, specialization_id):
+    """Ключ счетчика воронки; заявки без мероприятия в воронке не учитываются"""
+    if not event_id:
+        return None
+    return event_id, status_id, direction_id or 0, specialization_id or 0
+
+
+def application_funnel_key(application):
+    return funnel_key(application.event_id, application.status_id,
+                      application.direction_id, application.specialization_id)
+
+
+def change_funnel_counters(deltas):
+    """
+    Применяет изменения счетчиков {ключ: приращение}.
+    Вызывается внутри транзакции изменения заявок.
+    """
+    for key, delta in deltas.items():
+        if key is None or not delta:
+            continue
+        event_id, status_id, direction_key, specialization_key = key
+        lookup = dict(event_id=event_id, status_id=status_id,
+                      direction_key=direction_key, specialization_key=specialization_key)
+        if FunnelCounter.objects.filter(**lookup).update(count=F('count') + delta) or delta < 0:
+            # Отрицательное приращение без счетчика (например, при каскадном удалении мероприятия)
+            # не создает запись; расхождения исправляет rebuild_funnel
+            continue
+        try:
+            with transaction.atomic():
+                FunnelCounter.objects.create(count=delta, **lookup)
+        except IntegrityError:
+            # Счетчик параллельно создан другой транзакцией
+            FunnelCounter.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def collect_funnel(event_id=None):
+    """Фактические значения воронки, посчитанные по заявкам: {ключ: количество}"""
+    queryset = Application.objects.filter(event__isnull=False)
+    if event_id is not None:
+        queryset = queryset.filter(event_id=event_id)
+    rows = queryset.values('event_id', 'status_id', 'direction_id', 'specialization_id').annotate(
+        total=Count('id')
+    ).order_by()
+    return {
+        funnel_key(row['event_id'], row['status_id'], row['direction_id'], row['specialization_id']): row['total']
+        for row in rows
+    }
+
+
+def stored_funnel(event_id=None):
+    """Значения воронки из таблицы счетчиков (нулевые счетчики не учитываются)"""
+    queryset = FunnelCounter.objects.exclude(count=0)
+    if event_id is not None:
+        queryset = queryset.filter(event_id=event_id)
+    return {
+        (counter.event_id, counter.status_id, counter.direction_key, counter.specialization_key): counter.count
+        for counter in queryset
+    }
+
+
+def rebuild_funnel(event_id=None):
+    """Полный пересчет счетчиков воронки по заявкам"""
+    with transaction.atomic():
+        counters = FunnelCounter.objects.all()
+        if event_id is not None:
+            counters = counters.filter(event_id=event_id)
+        counters.delete()
+        FunnelCounter.objects.bulk_create([
+            FunnelCounter(event_id=key[0], status_id=key[1], direction_key=key[2], specialization_key=key[3],
+                          count=total)
+            for key, total in collect_funnel(event_id).items()
+        ], batch_size=1000)
+
+
+def verify_funnel(event_id=None):
+    """Расхождения между счетчиками и заявками: {ключ: (в счетчиках, фактически)}"""
+    expected = collect_funnel(event_id)
+    stored = stored_funnel(event_id)
+    return {
+        key: (stored.get(key, 0), expected.get(key, 0))
+        for key in expected.keys() | stored.keys()
+        if stored.get(key, 0) != expected.get(key, 0)
+    }
+
+
+def status_change_deltas(applications, new_status_id):
+    """Изменения счетчиков при переводе заявок (в старом состоянии) в новый статус"""
+    deltas = Counter()
+    for application in applications:
+        key = application_funnel_key(application)
+        if key is None or application.status_id == new_status_id:
+            continue
+        deltas[key] -= 1
+        deltas[(key[0], new_status_id, key[2], key[3])] += 1
+    return deltas
+
+
+def event_funnel(event_id):
+    """Воронка мероприятия: статусы в порядке Status_order с разрезами по направлениям и специализациям"""
+    counters = FunnelCounter.objects.filter(event_id=event_id).exclude(count=0)
+    steps = {}
+    for counter in counters:
+        step = steps.setdefault(counter.status_id, {
+            'count': 0, 'by_direction': Counter(), 'by_specialization': Counter()
+        })
+        step['count'] += counter.count
+        step['by_direction'][counter.direction_key or None] += counter.count
+        step['by_specialization'][counter.specialization_key or None] += counter.count
+
+    orders = {
+        order.status_id: order.number
+        for order in Status_order.objects.filter(event_id=event_id).order_by('-number')
+    }
+    statuses = Status.objects.in_bulk(orders.keys() | steps.keys())
+    result = []
+    for status_id, status in statuses.items():
+        step = steps.get(status_id, {'count': 0, 'by_direction': {}, 'by_specialization': {}})
+        result.append({
+            'status': status_id,
+            'name': status.name,
+            'number': orders.get(status_id),
+            'count': step['count'],
+            'by_direction': [{'direction': key, 'count': value} for key, value in step['by_direction'].items()],
+            'by_specialization': [
+                {'specialization': key, 'count': value} for key, value in step['by_specialization'].items()
+            ],
+        })
+    # Шаги воронки по номеру, статусы вне Status_order — в конце
+    result.sort(key=lambda step: (step['number'] is None, step['number'] or 0, step['status']))
+    return result
@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import datetime
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+# Обработчики задач по типу: async-функция, принимающая payload
+JOB_HANDLERS = {
+    'status_functions': 'crm.robots_triggers.run_status_functions_job',
+    'notification_digest': 'crm.notifications.run_notification_digest_job',
+    'time_trigger': 'crm.robots_triggers.run_time_trigger_job',
+    'reschedule_triggers': 'crm.robots_triggers.reschedule_triggers_job',
+    'rebalance_task_ranks': 'plan.ranking.rebalance_task_ranks_job',
+    'comment_attachment': 'plan.attachments.process_comment_attachment_job',
+}
+
+
+# Задача, которую выполняет текущий обработчик (для ключей идемпотентности порождаемых записей)
+current_job = contextvars.ContextVar('current_job', default=None)
+
+# Id задач, поставленных внутри job_scope (симуляция)
+current_job_scope = contextvars.ContextVar('job_scope', default=None)
+
+
+class JobError(Exception):
+    """Ошибка выполнения задачи, после которой задача повторяется"""
+
+
+class JobAbort(JobError):
+    """Ошибка, после которой задача не повторяется и сразу помечается ошибочной"""
+
+
+def enqueue_job(kind, payload, run_at=None, key=''):
+    """
+    Ставит задачу в очередь. Вызывается внутри транзакции изменения данных:
+    задача становится видна воркерам только вместе с этими изменениями.
+
+    Если задан key и задача с таким ключом еще ожидает выполнения, новая не создается —
+    возвращается ожидающая. Обработчик такой задачи должен быть идемпотентным: при гонке
+    двух транзакций может появиться вторая задача с тем же ключом.
+    Внутри job_scope ожидающие задачи ищутся только среди поставленных в нем.
+    """
+    scope = current_job_scope.get()
+    if key:
+        pending = Job.objects.filter(key=key, status=Job.PENDING)
+        if scope is not None:
+            pending = pending.filter(pk__in=list(scope))
+        job = pending.order_by('run_at').first()
+        if job is not None:
+            return job
+    job = Job.objects.create(kind=kind, key=key, payload=payload, run_at=run_at or timezone.now())
+    if scope is not None:
+        scope.add(job.pk)
+    return job
+
+
+@contextmanager
+def job_scope():
+    """
+    Собирает id задач, поставленных внутри, в том числе обработчиками этих задач.
+    Воркер, запущенный с job_ids=scope, выполняет только их и не забирает чужие задачи очереди.
+    """
+    job_ids = set()
+    token = current_job_scope.set(job_ids)
+    try:
+        yield job_ids
+    finally:
+        current_job_scope.reset(token)
+
+
+def hurry_job(job):
+    """Переносит ожидающую задачу на текущий момент"""
+    Job.objects.filter(pk=job.pk, status=Job.PENDING).update(run_at=timezone.now())
+
+
+def retry_delay(attempts):
+    """Задержка перед повтором: экспоненциальный рост от базовой задержки с ограничением сверху"""
+    delay = settings.JOB_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0)
+    return datetime.timedelta(seconds=min(delay, settings.JOB_RETRY_MAX_DELAY))
+
+
+def claim_jobs(worker, limit, job_ids=None):
+    """
+    Забирает до limit готовых задач: ожидающие, у которых наступило run_at, и выполняющиеся
+    с истекшей блокировкой (воркер упал). Заблокированные другими воркерами строки пропускаются.
+    job_ids ограничивает выборку перечисленными задачами (задачи job_scope симуляции).
+    """
+    now = timezone.now()
+    ready = Q(status=Job.PENDING, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+    if job_ids is not None:
+        ready &= Q(pk__in=list(job_ids))
+    with transaction.atomic():
+        jobs = list(Job.objects.select_for_update(skip_locked=True).filter(ready).order_by('run_at')[:limit])
+        if not jobs:
+            return []
+        locked_until = now + datetime.timedelta(seconds=settings.JOB_LEASE_TIMEOUT)
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.RUNNING, locked_by=worker, locked_until=locked_until, started_at=now,
+            attempts=F('attempts') + 1,
+        )
+    for job in jobs:
+        job.status, job.locked_by, job.locked_until, job.started_at = Job.RUNNING, worker, locked_until, now
+        job.attempts += 1
+    return jobs
+
+
+def complete_job(job):
+    # Условие на воркера: задачу с истекшей блокировкой мог забрать другой воркер
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status=Job.DONE, finished_at=timezone.now(), locked_until=None, last_error=''
+    )
+
+
+def fail_job(job, error, final=False):
+    """Возвращает задачу в очередь с задержкой или помечает ее ошибочной после последней попытки"""
+    now = timezone.now()
+    if final or job.attempts >= job.max_attempts:
+        changes = dict(status=Job.FAILED, finished_at=now)
+    else:
+        changes = dict(status=Job.PENDING, run_at=now + retry_delay(job.attempts))
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(locked_until=None, last_error=error, **changes)
+
+
+async def run_job(job):
+    """Выполняет задачу и фиксирует результат; возвращает True при успехе"""
+    try:
+        handler = import_string(JOB_HANDLERS[job.kind])
+    except KeyError:
+        await sync_to_async(fail_job)(job, f"Неизвестный тип задачи: {job.kind}")
+        return False
+
+    current_job.set(job)
+    try:
+        # Ограничение времени: зависший обработчик не занимает место воркера бесконечно
+        await asyncio.wait_for(handler(job.payload), settings.JOB_TIMEOUT)
+    except JobAbort as e:
+        await sync_to_async(fail_job)(job, str(e), final=True)
+        return False
+    except asyncio.TimeoutError:
+        await sync_to_async(fail_job)(job, f"Превышено время выполнения задачи ({settings.JOB_TIMEOUT} с)")
+        return False
+    except JobError as e:
+        await sync_to_async(fail_job)(job, str(e))
+        return False
+    except Exception as e:
+        await sync_to_async(fail_job)(job, f"{type(e).__name__}: {e}")
+        return False
+    await sync_to_async(complete_job)(job)
+    return True
+
+
+def refresh_connections():
+    """Закрывает устаревшие соединения между задачами; внутри транзакции (симуляция) соединение сохраняется"""
+    if not transaction.get_connection().in_atomic_block:
+        close_old_connections()
+
+
+async def work(worker, concurrency=10, poll_interval=1.0, once=False, job_ids=None):
+    """
+    Цикл воркера: держит до concurrency задач выполняющимися одновременно,
+    добирая новые по мере освобождения мест. При once=True завершается, когда очередь пуста.
+    """
+    running = set()
+    while True:
+        free = concurrency - len(running)
+        if free > 0:
+            await sync_to_async(refresh_connections)()
+            for job in await sync_to_async(claim_jobs)(worker, free, job_ids):
+                running.add(asyncio.ensure_future(run_job(job)))
+
+        if not running:
+            if once:
+                return
+            await asyncio.sleep(poll_interval)
+            continue
+        _, running = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+
+
+def run_pending_jobs(worker='inline', concurrency=10):
+    """Синхронно выполняет все готовые задачи, включая порожденные ими"""
+    async_to_sync(work)(worker, concurrency=concurrency, once=True)
+
+
+def job_stats(window=datetime.timedelta(minutes=15)):
+    """
+    Глубина очереди по состояниям и задержки задач, завершенных за последнее окно:
+    ожидание — от готовности (run_at) до начала выполнения, выполнение — до завершения.
+    """
+    now = timezone.now()
+    depth = dict(Job.objects.values_list('status').annotate(total=Count('id')).order_by())
+    oldest = Job.objects.filter(status=Job.PENDING, run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+
+    finished = Job.objects.filter(status=Job.DONE, finished_at__gte=now - window).values_list(
+        'run_at', 'started_at', 'finished_at'
+    )
+    waits, durations = [], []
+    for run_at, started_at, finished_at in finished.iterator():
+        waits.append(max((started_at - run_at).total_seconds(), 0))
+        durations.append((finished_at - started_at).total_seconds())
+
+    def summary(values):
+        if not values:
+            return {'avg': None, 'p95': None, 'max': None}
+        values.sort()
+        return {
+            'avg': round(sum(values) / len(values), 3),
+            'p95': round(values[min(int(len(values) * 0.95), len(values) - 1)], 3),
+            'max': round(values[-1], 3),
+        }
+
+    return {
+        'depth': {status: depth.get(status, 0) for status, _ in Job.STATUS_CHOICES},
+        'ready': Job.objects.filter(status=Job.PENDING, run_at__lte=now).count(),
+        'oldest_ready_age': round((now - oldest).total_seconds(), 3) if oldest else None,
+        'window_seconds': int(window.total_seconds()),
+        'completed': len(durations),
+        'wait': summary(waits),
+        'duration': summary(durations),
+    }
+
+
+def purge_jobs(older_than):
+    """Удаляет выполненные задачи, завершенные раньше older_than"""
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=older_than).delete()
+    return deleted
@@ -0,0 +1,150 @@
+import contextvars
+import datetime
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Case, Count, F, Max, Sum, Value, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import AutomationRun
+
+# Журнал задачи, в которую пишутся выполненные шаги цепочек статусов
+current_journal = contextvars.ContextVar('automation_journal', default=None)
+
+# Наибольшее окно статистики журнала, ч
+JOURNAL_STATS_MAX_HOURS = 24 * 365
+
+
+class RunJournal:
+    """Буфер записей журнала автоматизации одной задачи; сохраняется одним bulk_create"""
+
+    def __init__(self):
+        self.entries = []
+
+    def record(self, function_order_id, step, applications, duration, error='', trigger_action_id=None):
+        """Одна запись на выполнение шага (по мероприятиям пачки) с числом обработанных заявок"""
+        for event_id, count in Counter(application.event_id for application in applications).items():
+            self.entries.append(AutomationRun(
+                function_order_id=function_order_id, trigger_action_id=trigger_action_id,
+                applications=count, event_id=event_id,
+                type_function=step.type_function, action=step.action or '', duration=duration,
+                outcome=AutomationRun.ERROR if error else AutomationRun.SUCCESS, error=error,
+            ))
+
+    def flush(self):
+        entries, self.entries = self.entries, []
+        AutomationRun.objects.bulk_create(entries, batch_size=1000)
+
+
+def record_step(step, applications, duration, error='', parent=None):
+    """
+    Запись выполнения шага для пачки заявок в журнал текущей задачи (вне задачи не пишется).
+    parent — шаг-триггер, действием которого выполнен шаг.
+    """
+    journal = current_journal.get()
+    if journal is None:
+        return
+    if parent is None:
+        journal.record(step.function_id, step, applications, duration, error)
+    else:
+        journal.record(parent.function_id, step, applications, duration, error, trigger_action_id=step.function_id)
+
+
+@asynccontextmanager
+async def journal_scope():
+    """Журнал на время задачи: записи сохраняются при ее завершении, в том числе с ошибкой"""
+    journal = RunJournal()
+    token = current_journal.set(journal)
+    try:
+        yield journal
+    finally:
+        current_journal.reset(token)
+        await sync_to_async(journal.flush)()
+
+
+# Перцентили длительности в отчетах, в процентах
+PERCENTILES = (('p50', 50), ('p95', 95), ('p99', 99))
+
+# Счетчики группы шагов: оконные агрегаты по строкам группы
+GROUP_COLUMNS = ('group_runs', 'group_failures', 'group_applications', 'group_max')
+
+
+def percentile_index(count, percent):
+    """Номер (с нуля) значения перцентиля среди count упорядоченных значений (ближайший ранг)"""
+    return count * percent // 100
+
+
+def step_stats(runs, *fields):
+    """
+    Число выполнений шагов, доля ошибок и перцентили длительности по группам fields одним запросом:
+    строки группы нумеруются ROW_NUMBER() по возрастанию длительности, счетчики группы считаются
+    оконными агрегатами, а из БД выбираются только строки на позициях перцентилей.
+    Отбор по номеру — оберткой над запросом ORM, как в plan/board.py.
+    """
+    partition = [F(field) for field in fields]
+    ranked = runs.order_by().annotate(
+        duration_row=Window(RowNumber(), partition_by=partition, order_by=F('duration').asc()),
+        group_runs=Window(Count('pk'), partition_by=partition),
+        group_failures=Window(Sum(Case(When(outcome=AutomationRun.ERROR, then=Value(1)), default=Value(0))),
+                              partition_by=partition),
+        group_applications=Window(Sum('applications'), partition_by=partition),
+        group_max=Window(Max('duration'), partition_by=partition),
+    ).values(*fields, 'duration', 'duration_row', *GROUP_COLUMNS)
+    sql, params = ranked.query.sql_with_params()
+
+    connection = connections[runs.db]
+    columns = ', '.join(f'ranked.{connection.ops.quote_name(name)}'
+                        for name in (*fields, 'duration', 'duration_row', *GROUP_COLUMNS))
+    # Номер строки перцентиля — percentile_index + 1, условие в целых числах
+    positions = ' OR '.join(
+        f'((ranked.duration_row - 1) * 100 <= ranked.group_runs * {percent} '
+        f'AND ranked.group_runs * {percent} < ranked.duration_row * 100)'
+        for _, percent in PERCENTILES
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {columns} FROM ({sql}) ranked WHERE {positions}', params)
+        rows = cursor.fetchall()
+
+    groups = {}
+    for row in rows:
+        key = row[:len(fields)]
+        duration, position, count, failures, applications, longest = row[len(fields):]
+        group = groups.setdefault(key, {
+            **dict(zip(fields, key)),
+            'runs': count,
+            'applications': int(applications),
+            'failures': int(failures),
+            'failure_rate': round(int(failures) / count, 4),
+            'max': round(longest, 4),
+        })
+        for name, percent in PERCENTILES:
+            if position - 1 == percentile_index(count, percent):
+                group[name] = round(duration, 4)
+    return list(groups.values())
+
+
+def journal_stats(window=datetime.timedelta(hours=24), event_id=None):
+    """
+    Задержки (p50/p95/p99) и доля ошибок шагов автоматизации за окно:
+    по типу действия (роботы) или условия (триггеры) и по мероприятию.
+    Группы упорядочены по убыванию p95 — самые медленные автоматизации первыми.
+    """
+    runs = AutomationRun.objects.filter(created_at__gte=timezone.now() - window)
+    if event_id is not None:
+        runs = runs.filter(event_id=event_id)
+
+    events = [{'event': row.pop('event_id'), **row} for row in step_stats(runs, 'event_id')]
+    return {
+        'window_seconds': int(window.total_seconds()),
+        'actions': sorted(step_stats(runs, 'type_function', 'action'), key=lambda row: row['p95'], reverse=True),
+        'events': sorted(events, key=lambda row: row['p95'], reverse=True),
+    }
+
+
+def purge_journal(older_than):
+    """Удаляет записи журнала старше older_than"""
+    deleted, _ = AutomationRun.objects.filter(created_at__lt=older_than).delete()
+    return deleted
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.funnel import rebuild_funnel, verify_funnel
+
+
+class Command(BaseCommand):
+    help = "Пересчет счетчиков воронки заявок и проверка их соответствия заявкам"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, help="Пересчитать только указанное мероприятие")
+        parser.add_argument('--check', action='store_true', help="Только проверить счетчики, не пересчитывая")
+
+    def handle(self, *args, **options):
+        event_id = options['event']
+        if not options['check']:
+            rebuild_funnel(event_id)
+            self.stdout.write("Счетчики воронки пересчитаны")
+
+        mismatches = verify_funnel(event_id)
+        for (event, status, direction, specialization), (stored, actual) in sorted(mismatches.items()):
+            self.stderr.write(
+                f"Мероприятие {event}, статус {status}, направление {direction or '-'}, "
+                f"специализация {specialization or '-'}: в счетчике {stored}, заявок {actual}"
+            )
+        if mismatches:
+            raise CommandError(f"Расхождений в счетчиках воронки: {len(mismatches)}")
+        self.stdout.write(self.style.SUCCESS("Счетчики воронки совпадают с заявками"))
@@ -0,0 +1,54 @@
+import asyncio
+import datetime
+import json
+import os
+import socket
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm.jobs import job_stats, purge_jobs, work
+from crm.journal import purge_journal
+from crm.notifications import purge_notifications
+from crm.telegram import get_telegram_client
+from plan.attachments import purge_uploads
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновой очереди задач (роботы и триггеры статусов)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=10, help="Число одновременно выполняемых задач")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Пауза опроса пустой очереди, сек")
+        parser.add_argument('--once', action='store_true', help="Выполнить готовые задачи и завершиться")
+        parser.add_argument('--stats', action='store_true', help="Вывести глубину очереди и задержки задач")
+        parser.add_argument('--purge-days', type=int,
+                            help="Удалить выполненные задачи, журнал автоматизации, отправленные уведомления "
+                                 "и заброшенные загрузки вложений старше указанного числа дней")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(job_stats(), ensure_ascii=False, indent=2))
+            return
+        if options['purge_days'] is not None:
+            older_than = timezone.now() - datetime.timedelta(days=options['purge_days'])
+            self.stdout.write(f"Удалено задач: {purge_jobs(older_than)}")
+            self.stdout.write(f"Удалено записей журнала: {purge_journal(older_than)}")
+            self.stdout.write(f"Удалено уведомлений: {purge_notifications(older_than)}")
+            self.stdout.write(f"Удалено загрузок вложений: {purge_uploads(older_than)}")
+            return
+
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Воркер {worker} запущен")
+        try:
+            asyncio.run(self.run_worker(worker, options))
+        except KeyboardInterrupt:
+            # Задачи, прерванные остановкой, вернутся в очередь по истечении блокировки
+            self.stdout.write("Воркер остановлен")
+
+    async def run_worker(self, worker, options):
+        try:
+            await work(worker, options['concurrency'], options['poll_interval'], options['once'])
+        finally:
+            # Соединения общего клиента Telegram живут на протяжении работы воркера
+            await get_telegram_client().aclose()
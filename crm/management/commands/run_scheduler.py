@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from crm.scheduler import dispatch_due_triggers, next_due_at
+
+
+class Command(BaseCommand):
+    help = "Планировщик триггеров по времени: передает наступившие сроки в очередь задач"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help="Строк расписания за один проход")
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help="Максимальная пауза между проверками, сек (новые строки могут иметь ранний срок)")
+        parser.add_argument('--once', action='store_true', help="Обработать наступившие сроки и завершиться")
+
+    def handle(self, *args, **options):
+        batch, poll_interval = options['batch'], options['poll_interval']
+        try:
+            while True:
+                close_old_connections()
+                dispatched = dispatch_due_triggers(batch)
+                if dispatched:
+                    self.stdout.write(f"Передано в очередь сроков: {dispatched}")
+                if dispatched == batch:
+                    continue
+                if options['once']:
+                    return
+                # Сон до ближайшего срока, но не дольше интервала опроса
+                next_due = next_due_at()
+                delay = poll_interval if next_due is None else (next_due - timezone.now()).total_seconds()
+                time.sleep(min(max(delay, 0), poll_interval))
+        except KeyboardInterrupt:
+            self.stdout.write("Планировщик остановлен")
@@ -0,0 +1,87 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from crm.models import Event, Status, Status_order
+from crm.simulator import locks_whole_database, simulate, use_database
+
+
+class Command(BaseCommand):
+    help = ("Прогон цепочек функций статусов мероприятия на синтетических заявках без сохранения изменений: "
+            "пропускная способность, задержки этапов, запросы к БД на заявку и длина цепочек переводов")
+
+    def add_arguments(self, parser):
+        parser.add_argument('event', type=int, help="Мероприятие")
+        parser.add_argument('--status', help="Статус входа (id или название); по умолчанию первый статус мероприятия")
+        parser.add_argument('--applications', type=int, default=1000, help="Число синтетических заявок")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пачки массового перевода")
+        parser.add_argument('--concurrency', type=int, default=10, help="Число одновременно выполняемых задач")
+        parser.add_argument('--repeat', type=int, default=3, help="Число прогонов; в отчете медианный")
+        parser.add_argument('--no-time-triggers', action='store_true',
+                            help="Не выполнять триггеры по времени досрочно")
+        parser.add_argument('--rate-limits', action='store_true',
+                            help="Соблюдать ограничения скорости Telegram (по умолчанию сняты)")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help="Псевдоним БД из DATABASES для прогона — копия рабочей БД. Прогон идет одной "
+                                 "откатываемой транзакцией; на SQLite она блокирует запись во всю БД, поэтому "
+                                 "рабочая БД SQLite не принимается")
+        parser.add_argument('--json', action='store_true', help="Вывести отчет в JSON")
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in settings.DATABASES:
+            raise CommandError(f"БД {alias} не описана в DATABASES")
+        if min(options['applications'], options['batch_size'], options['repeat'], options['concurrency']) < 1:
+            raise CommandError("Число заявок, размер пачки, число прогонов и задач должны быть положительными")
+        if alias == DEFAULT_DB_ALIAS and locks_whole_database(alias):
+            raise CommandError("Прогон на рабочей БД SQLite заблокирует запись в нее до конца прогона: "
+                               "укажите копию БД в --database")
+
+        with use_database(alias):
+            event = Event.objects.filter(pk=options['event']).first()
+            if event is None:
+                raise CommandError(f"Мероприятие {options['event']} не найдено")
+            status = self.get_status(event, options['status'])
+            report = simulate(
+                event, status, options['applications'], batch_size=options['batch_size'],
+                concurrency=options['concurrency'], repeat=options['repeat'],
+                time_triggers=not options['no_time_triggers'], rate_limits=options['rate_limits'],
+            )
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            self.write_report(report)
+
+    def get_status(self, event, value):
+        if value is None:
+            order = Status_order.objects.filter(event=event).select_related('status').order_by('number').first()
+            if order is None:
+                raise CommandError("У мероприятия нет статусов")
+            return order.status
+        status = Status.objects.filter(pk=value).first() if value.isdigit() else None
+        status = status or Status.objects.filter(name=value).first()
+        if status is None:
+            raise CommandError(f"Статус {value} не найден")
+        return status
+
+    def write_report(self, report):
+        self.stdout.write(f"Мероприятие {report['event']}, статус входа «{report['status']}», "
+                          f"заявок: {report['applications']}")
+        self.stdout.write(f"Пропускная способность: {report['throughput']} заявок/с "
+                          f"(прогоны: {', '.join(map(str, report['throughput_runs']))})")
+        self.stdout.write(f"Запросов к БД: {report['queries']}, на заявку: {report['queries_per_application']}")
+        stages = ", ".join(f"{stage} {seconds}" for stage, seconds in report['stages'].items())
+        self.stdout.write(f"Этапы, с: {stages}")
+        for kind, summary in report['jobs'].items():
+            self.stdout.write(f"  задачи {kind}: {summary['count']} (ошибок {summary['failed']}), "
+                              f"p50 {summary['p50']} p95 {summary['p95']} p99 {summary['p99']}")
+        for step in report['steps']:
+            self.stdout.write(f"  {step['type_function']} {step['action']}: {step['runs']} "
+                              f"на {step['applications']} заявок (ошибок {step['failure_rate']:.1%}), "
+                              f"p50 {step['p50']} p95 {step['p95']} p99 {step['p99']}")
+        chains = report['chains']
+        self.stdout.write(f"Цепочек переводов: {chains['count']}, переходов в среднем {chains['avg_hops']}, "
+                          f"максимум {chains['max_hops']}, прервано {chains['aborted']}")
+        self.stdout.write(f"Запросов к Telegram: {report['telegram_requests']}")
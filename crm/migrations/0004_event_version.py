@@ -0,0 +1,17 @@
+import crm.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_remove_functionorder_name_functionorder_status_order_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='version',
+            field=models.CharField(default=crm.models.new_version, editable=False, max_length=32, verbose_name='Версия данных'),
+        ),
+    ]
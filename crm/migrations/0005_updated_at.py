@@ -0,0 +1,48 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0004_event_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='direction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='specialization',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='status_order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunnelCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction_key', models.BigIntegerField(default=0, verbose_name='Направление')),
+                ('specialization_key', models.BigIntegerField(default=0, verbose_name='Специализация')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество заявок')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='funnel_counters', to='crm.event')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm.status')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='funnelcounter',
+            constraint=models.UniqueConstraint(fields=('event', 'status', 'direction_key', 'specialization_key'), name='unique_funnel_counter'),
+        ),
+    ]
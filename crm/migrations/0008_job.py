@@ -0,0 +1,36 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_application_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, verbose_name='Тип задачи')),
+                ('payload', models.JSONField(default=dict, verbose_name='Параметры')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Состояние')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('max_attempts', models.PositiveIntegerField(default=5, verbose_name='Максимум попыток')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Выполнить не раньше')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Заблокирована до')),
+                ('locked_by', models.CharField(blank=True, default='', max_length=100, verbose_name='Воркер')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало выполнения')),
+                ('finished_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Окончание выполнения')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+                    models.Index(fields=['status', 'locked_until'], name='job_status_locked_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='key',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='Ключ'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['key', 'status'], name='job_key_status_idx'),
+        ),
+        migrations.CreateModel(
+            name='PendingNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bot_token', models.CharField(max_length=100, verbose_name='Токен бота')),
+                ('chat_id', models.CharField(max_length=100, verbose_name='Чат')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('parse_mode', models.CharField(default='HTML', max_length=20, verbose_name='Режим разметки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bot_token', 'chat_id'], name='notification_chat_idx')],
+            },
+        ),
+    ]
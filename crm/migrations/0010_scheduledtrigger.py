@@ -0,0 +1,25 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_job_key_pendingnotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledTrigger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_at', models.DateTimeField(db_index=True, verbose_name='Время срабатывания')),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_triggers', to='crm.application')),
+                ('function_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled', to='crm.functionorder')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='scheduledtrigger',
+            constraint=models.UniqueConstraint(fields=('application', 'function_order'), name='unique_scheduled_trigger'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_scheduledtrigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TriggerAction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='Позиция')),
+                ('config', models.JSONField(default=dict, verbose_name='Конфигурация параметров')),
+                ('depends_on', models.ManyToManyField(blank=True, related_name='dependents', to='crm.triggeraction', verbose_name='Выполняется после')),
+                ('function_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actions', to='crm.functionorder')),
+                ('robot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm.robot')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='triggeraction',
+            constraint=models.UniqueConstraint(fields=('function_order', 'position'), name='unique_trigger_action_position'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_triggeraction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutomationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('function_order_id', models.BigIntegerField(verbose_name='Функция статуса')),
+                ('trigger_action_id', models.BigIntegerField(blank=True, null=True, verbose_name='Действие триггера')),
+                ('application_id', models.BigIntegerField(verbose_name='Заявка')),
+                ('event_id', models.BigIntegerField(blank=True, null=True, verbose_name='Мероприятие')),
+                ('type_function', models.CharField(max_length=10, verbose_name='Тип функции')),
+                ('action', models.CharField(max_length=100, verbose_name='Тип действия или условия')),
+                ('duration', models.FloatField(verbose_name='Длительность, сек')),
+                ('outcome', models.CharField(choices=[('success', 'Успешно'), ('error', 'Ошибка')], max_length=10, verbose_name='Результат')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата выполнения')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event_id', 'created_at'], name='automation_run_event_idx')],
+            },
+        ),
+    ]
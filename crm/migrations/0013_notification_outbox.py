@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0012_automationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingnotification',
+            name='key',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True, verbose_name='Ключ идемпотентности'),
+        ),
+        migrations.AddField(
+            model_name='pendingnotification',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки'),
+        ),
+        migrations.RemoveIndex(
+            model_name='pendingnotification',
+            name='notification_chat_idx',
+        ),
+        migrations.AddIndex(
+            model_name='pendingnotification',
+            index=models.Index(fields=['bot_token', 'chat_id', 'sent_at'], name='notification_outbox_idx'),
+        ),
+    ]
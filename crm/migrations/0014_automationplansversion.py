@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    AutomationPlansVersion = apps.get_model('crm', 'AutomationPlansVersion')
+    AutomationPlansVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutomationPlansVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.PositiveBigIntegerField(default=0, verbose_name='Поколение планов')),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
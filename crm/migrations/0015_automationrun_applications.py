@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0014_automationplansversion'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='automationrun',
+            name='application_id',
+        ),
+        migrations.AddField(
+            model_name='automationrun',
+            name='applications',
+            field=models.PositiveIntegerField(default=1, verbose_name='Заявок'),
+        ),
+        migrations.AddIndex(
+            model_name='automationrun',
+            index=models.Index(fields=['type_function', 'action', 'created_at'], name='automation_run_action_idx'),
+        ),
+    ]
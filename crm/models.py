@@ -1,13 +1,16 @@
 import json
+import uuid
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 
 
 class Specialization(models.Model):
     name = models.CharField(verbose_name="Название", max_length=100)
     description = models.TextField(verbose_name="Описание", max_length=10000, null=True, blank=True)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.name}'
@@ -24,6 +27,7 @@ class Profile(models.Model):
     university = models.CharField(verbose_name="Название университета", max_length=100, null=True, blank=True)
     vk = models.CharField(verbose_name="Ссылка VK", max_length=100, null=True, blank=True)
     job = models.CharField(verbose_name="Место работы", max_length=100, null=True, blank=True)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.surname} {self.name} {self.patronymic}'
@@ -58,6 +62,10 @@ class Role(models.Model):
         return f'{self.name}'
 
 
+def new_version():
+    return uuid.uuid4().hex
+
+
 class Event(models.Model):
     STAGES = (
         ("Редактирование", "Редактирование"),
@@ -74,6 +82,9 @@ class Event(models.Model):
     start = models.DateField(verbose_name="Дата начала")
     end = models.DateField(verbose_name="Дата окончания")
     end_app = models.DateField(verbose_name="Дата окончания приема заявок")
+    # Меняется при любом изменении мероприятия или связанных с ним объектов (см. crm/signals.py)
+    version = models.CharField(verbose_name="Версия данных", max_length=32, default=new_version, editable=False)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.name}'
@@ -99,6 +110,7 @@ class Status(models.Model):
     name = models.CharField(verbose_name="Название", max_length=100)
     description = models.TextField(verbose_name="Описание", max_length=10000, null=True, blank=True)
     is_positive = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.name}'
@@ -108,6 +120,7 @@ class Status_order(models.Model):
     number = models.IntegerField(default=1, verbose_name="Позиция")
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
     status = models.ForeignKey(Status, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.number}'
@@ -117,6 +130,7 @@ class Direction(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='directions')
     name = models.CharField(verbose_name="Название направления", max_length=100)
     description = models.TextField(verbose_name="Описание", max_length=10000, null=True, blank=True)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.name}'
@@ -137,9 +151,216 @@ class Application(models.Model):
     date_sub = models.DateTimeField(verbose_name="Дата подачи", auto_now=True)
     date_end = models.DateTimeField(verbose_name="Дата изменения", null=True, blank=True)
 
+    class Meta:
+        # Индексы под комбинации ApplicationFilter (проверяются планами запросов в crm/tests.py)
+        indexes = [
+            models.Index(fields=['event', 'status'], name='app_event_status_idx'),
+            models.Index(fields=['event', 'is_approved'], name='app_event_approved_idx'),
+            models.Index(fields=['event', 'is_link'], name='app_event_link_idx'),
+            models.Index(fields=['event', 'date_sub'], name='app_event_date_idx'),
+            models.Index(fields=['project', 'status'], name='app_project_status_idx'),
+            models.Index(fields=['team', 'status'], name='app_team_status_idx'),
+            models.Index(fields=['specialization', 'status'], name='app_spec_status_idx'),
+            models.Index(fields=['is_approved', 'date_sub'], name='app_approved_date_idx'),
+            models.Index(fields=['is_link', 'date_sub'], name='app_link_date_idx'),
+            models.Index(fields=['date_sub'], name='app_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.user}'
 
+    def save(self, *args, **kwargs):
+        # Сигналы (счетчики воронки, версия мероприятия) выполняются в одной транзакции с сохранением
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class FunnelCounter(models.Model):
+    """
+    Количество заявок мероприятия в статусе в разрезе направления и специализации.
+    Поддерживается сигналами заявок (crm/funnel.py), пересчитывается командой rebuild_funnel.
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='funnel_counters')
+    status = models.ForeignKey(Status, on_delete=models.CASCADE)
+    # 0 — заявка без направления/специализации (NULL не участвует в уникальном ограничении)
+    direction_key = models.BigIntegerField(verbose_name="Направление", default=0)
+    specialization_key = models.BigIntegerField(verbose_name="Специализация", default=0)
+    count = models.IntegerField(verbose_name="Количество заявок", default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['event', 'status', 'direction_key', 'specialization_key'],
+                name='unique_funnel_counter'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.event_id}/{self.status_id}: {self.count}'
+
+
+class Job(models.Model):
+    """
+    Фоновая задача очереди (crm/jobs.py). Задачи забираются воркером
+    (команда run_jobs) с блокировкой строк и повторяются с увеличивающейся задержкой.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField(verbose_name="Тип задачи", max_length=50)
+    # Ключ для схлопывания: пока задача с ключом ожидает, новая не создается
+    key = models.CharField(verbose_name="Ключ", max_length=200, blank=True, default='')
+    payload = models.JSONField(verbose_name="Параметры", default=dict)
+    status = models.CharField(verbose_name="Состояние", max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(verbose_name="Попыток", default=0)
+    max_attempts = models.PositiveIntegerField(verbose_name="Максимум попыток", default=5)
+    run_at = models.DateTimeField(verbose_name="Выполнить не раньше", default=timezone.now)
+    locked_until = models.DateTimeField(verbose_name="Заблокирована до", null=True, blank=True)
+    locked_by = models.CharField(verbose_name="Воркер", max_length=100, blank=True, default='')
+    last_error = models.TextField(verbose_name="Последняя ошибка", blank=True, default='')
+    created_at = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name="Начало выполнения", null=True, blank=True)
+    finished_at = models.DateTimeField(verbose_name="Окончание выполнения", null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+            models.Index(fields=['status', 'locked_until'], name='job_status_locked_idx'),
+            models.Index(fields=['key', 'status'], name='job_key_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+
+class PendingNotification(models.Model):
+    """
+    Исходящее уведомление (outbox, crm/notifications.py): пишется в транзакции вместе
+    с изменениями данных и отправляется задачей очереди в составе сводки по чату.
+    Отправленные строки помечаются sent_at и хранят ключ идемпотентности до очистки.
+    """
+    bot_token = models.CharField(verbose_name="Токен бота", max_length=100)
+    chat_id = models.CharField(verbose_name="Чат", max_length=100)
+    text = models.TextField(verbose_name="Текст")
+    parse_mode = models.CharField(verbose_name="Режим разметки", max_length=20, default='HTML')
+    # Повтор задачи с тем же ключом не ставит уведомление второй раз
+    key = models.CharField(verbose_name="Ключ идемпотентности", max_length=100, null=True, blank=True, unique=True)
+    created_at = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name="Дата отправки", null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bot_token', 'chat_id', 'sent_at'], name='notification_outbox_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.chat_id}: {self.text[:50]}'
+
+
+class TriggerAction(models.Model):
+    """
+    Действие триггера в цепочке статуса: робот, выполняемый для заявок, удовлетворивших условию.
+    Действия без взаимных зависимостей выполняются параллельно; move_status выполняется
+    после всех предыдущих действий и до всех последующих.
+    """
+    function_order = models.ForeignKey('FunctionOrder', on_delete=models.CASCADE, related_name='actions')
+    position = models.PositiveIntegerField(verbose_name="Позиция")
+    robot = models.ForeignKey('Robot', on_delete=models.CASCADE)
+    config = models.JSONField(verbose_name="Конфигурация параметров", default=dict)
+    depends_on = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='dependents',
+                                        verbose_name="Выполняется после")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['function_order', 'position'], name='unique_trigger_action_position')
+        ]
+
+    def __str__(self):
+        return f'{self.function_order_id}: {self.robot} #{self.position}'
+
+    def clean(self):
+        # Действие move_status триггера, срабатывающего при входе в статус, не должно замыкать цикл статусов
+        from .automation import IMMEDIATE_TRIGGERS, move_status_cycle_error
+        trigger = self.function_order.trigger
+        if (self.robot.type_action == 'move_status' and trigger is not None
+                and trigger.type_condition in IMMEDIATE_TRIGGERS):
+            error = move_status_cycle_error(self.function_order.status_order, self.config, exclude_action=self.pk)
+            if error:
+                raise ValidationError(error)
+
+
+class AutomationPlansVersion(models.Model):
+    """
+    Поколение планов статусов (crm/automation.py) — единственная строка. Увеличивается в транзакции
+    изменения функций статусов, поэтому все процессы видят новое поколение вместе с изменениями.
+    """
+    generation = models.PositiveBigIntegerField(verbose_name="Поколение планов", default=0)
+
+    def __str__(self):
+        return f'Поколение планов {self.generation}'
+
+
+class AutomationRun(models.Model):
+    """
+    Запись журнала автоматизации (crm/journal.py): одно выполнение шага цепочки статуса
+    для пачки заявок мероприятия; длительность относится ко всей пачке. Журнал только
+    дополняется и пишется пачками в конце задачи, поэтому ссылки хранятся идентификаторами,
+    без внешних ключей.
+    """
+    SUCCESS = 'success'
+    ERROR = 'error'
+    OUTCOME_CHOICES = [
+        (SUCCESS, 'Успешно'),
+        (ERROR, 'Ошибка'),
+    ]
+
+    function_order_id = models.BigIntegerField(verbose_name="Функция статуса")
+    # Действие триггера, если шаг выполнен как действие триггера function_order_id
+    trigger_action_id = models.BigIntegerField(verbose_name="Действие триггера", null=True, blank=True)
+    applications = models.PositiveIntegerField(verbose_name="Заявок", default=1)
+    event_id = models.BigIntegerField(verbose_name="Мероприятие", null=True, blank=True)
+    type_function = models.CharField(verbose_name="Тип функции", max_length=10)
+    action = models.CharField(verbose_name="Тип действия или условия", max_length=100)
+    duration = models.FloatField(verbose_name="Длительность, сек")
+    outcome = models.CharField(verbose_name="Результат", max_length=10, choices=OUTCOME_CHOICES)
+    error = models.TextField(verbose_name="Ошибка", blank=True, default='')
+    created_at = models.DateTimeField(verbose_name="Дата выполнения", auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['event_id', 'created_at'], name='automation_run_event_idx'),
+            models.Index(fields=['type_function', 'action', 'created_at'], name='automation_run_action_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.action} #{self.function_order_id} ({self.applications}): {self.outcome}'
+
+
+class ScheduledTrigger(models.Model):
+    """
+    Момент срабатывания триггера по времени для заявки (crm/scheduler.py).
+    Планировщик читает только строки с наступившим due_at.
+    """
+    application = models.ForeignKey(Application, on_delete=models.CASCADE, related_name='scheduled_triggers')
+    function_order = models.ForeignKey('FunctionOrder', on_delete=models.CASCADE, related_name='scheduled')
+    due_at = models.DateTimeField(verbose_name="Время срабатывания", db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['application', 'function_order'], name='unique_scheduled_trigger')
+        ]
+
+    def __str__(self):
+        return f'{self.application_id}/{self.function_order_id}: {self.due_at}'
+
 
 class Test(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
@@ -235,9 +456,13 @@ class FunctionOrder(models.Model):
 
         # Валидация параметров конфигурации
         try:
-            if self.type_function == 'robot':
-                self._validate_robot_config()
-            else:
-                self._validate_trigger_config()
+            config = json.loads(self.config) if isinstance(self.config, str) else self.config
         except json.JSONDecodeError:
             raise ValidationError('Некорректный JSON в конфигурации')
+
+        # Немедленные переходы move_status не должны замыкаться в цикл статусов
+        if self.type_function == 'robot' and self.robot.type_action == 'move_status':
+            from .automation import move_status_cycle_error
+            error = move_status_cycle_error(self.status_order, config, exclude_function=self.pk)
+            if error:
+                raise ValidationError(error)
@@ -0,0 +1,151 @@
+import datetime
+import hashlib
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import JobError, enqueue_job, hurry_job
+from .models import PendingNotification
+from .telegram import TelegramError, get_telegram_client
+
+# Максимальная длина сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def digest_key(bot_token, chat_id):
+    """Ключ задачи отправки сводки чата (токен бота в ключ попадает только хэшем)"""
+    return f"notification_digest:{hashlib.md5(bot_token.encode()).hexdigest()}:{chat_id}"
+
+
+def notification_key(*parts):
+    """Ключ идемпотентности уведомления из частей, однозначно задающих его источник"""
+    return hashlib.md5(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def queue_notification(chat_id, text, bot_token, parse_mode='HTML', window=None, key=None):
+    """
+    Записывает уведомление в outbox — в текущей транзакции, без обращения к сети.
+    Сводка чата отправляется одной задачей очереди через window секунд после первого
+    сообщения или сразу при накоплении NOTIFICATION_DIGEST_MAX_MESSAGES сообщений.
+
+    Если уведомление с ключом key уже записано (повтор задачи), новое не создается
+    и возвращается None.
+    """
+    window = settings.NOTIFICATION_DIGEST_WINDOW if window is None else window
+    chat_id = str(chat_id)
+    with transaction.atomic():
+        if key and PendingNotification.objects.filter(key=key).exists():
+            return None
+        notification = PendingNotification.objects.create(bot_token=bot_token, chat_id=chat_id, text=text,
+                                                          parse_mode=parse_mode, key=key)
+        job = enqueue_job(
+            'notification_digest', digest_payload(notification),
+            run_at=timezone.now() + datetime.timedelta(seconds=window), key=digest_key(bot_token, chat_id),
+        )
+        pending = unsent(bot_token, chat_id).count()
+        if window == 0 or pending >= settings.NOTIFICATION_DIGEST_MAX_MESSAGES:
+            hurry_job(job)
+    return job
+
+
+def digest_payload(notification):
+    """
+    Параметры задачи сводки. Токен бота в payload (и в админку задач) не попадает:
+    задача ссылается на строку outbox, из которой он читается при выполнении.
+    """
+    return {'chat_id': notification.chat_id, 'notification': notification.pk}
+
+
+def digest_token(payload):
+    """Токен бота сводки по строке outbox из payload (задачи, поставленные до этого, хранят сам токен)"""
+    if 'bot_token' in payload:
+        return payload['bot_token']
+    return PendingNotification.objects.filter(pk=payload['notification']).values_list('bot_token', flat=True).first()
+
+
+def unsent(bot_token, chat_id):
+    return PendingNotification.objects.filter(bot_token=bot_token, chat_id=chat_id, sent_at__isnull=True)
+
+
+def truncate_text(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Текст, обрезанный до limit символов"""
+    return text if len(text) <= limit else f"{text[:limit - 1]}…"
+
+
+def build_digest(notifications, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Сводка из уведомлений: одинаковые схлопываются с числом повторов, порядок сохраняется.
+    Возвращает текст и уведомления, вошедшие в него: не поместившиеся в лимит длины
+    остаются неотправленными и уходят следующей сводкой. Текст длиннее лимита обрезается.
+    """
+    if len(notifications) == 1:
+        return truncate_text(notifications[0].text, limit), notifications
+
+    groups = {}
+    for notification in notifications:
+        groups.setdefault(notification.text, []).append(notification)
+    # Запас под заголовок, число повторов и строку о не вошедших сообщениях
+    budget = limit - 80
+    parts, included, length = [], [], 0
+    for text, group in groups.items():
+        text = truncate_text(text, budget)
+        part = text if len(group) == 1 else f"{text}\n(×{len(group)})"
+        if parts and length + len(part) + 2 > budget:
+            break
+        parts.append(part)
+        included.extend(group)
+        length += len(part) + 2
+
+    digest = "\n\n".join([f"Уведомлений: {len(included)}", *parts])
+    if len(included) < len(notifications):
+        digest = f"{digest}\n\n… и еще {len(notifications) - len(included)} следующим сообщением"
+    return digest, included
+
+
+def load_digest(bot_token, chat_id):
+    """Сообщения очередной сводки: первые по времени с одинаковым режимом разметки"""
+    notifications = list(unsent(bot_token, chat_id).order_by('pk')[:settings.NOTIFICATION_DIGEST_MAX_MESSAGES])
+    if notifications:
+        parse_mode = notifications[0].parse_mode
+        notifications = [notification for notification in notifications if notification.parse_mode == parse_mode]
+    return notifications
+
+
+def finish_digest(bot_token, chat_id, notifications):
+    """Помечает отправленными вошедшие в сводку сообщения; оставшиеся отправляются следующей сводкой без ожидания"""
+    with transaction.atomic():
+        PendingNotification.objects.filter(pk__in=[notification.pk for notification in notifications]).update(
+            sent_at=timezone.now()
+        )
+        pending = unsent(bot_token, chat_id).order_by('pk').first()
+        if pending is not None:
+            hurry_job(enqueue_job('notification_digest', digest_payload(pending), key=digest_key(bot_token, chat_id)))
+
+
+async def run_notification_digest_job(payload):
+    """Задача очереди: отправка накопленной сводки уведомлений в чат"""
+    chat_id = payload['chat_id']
+    bot_token = await sync_to_async(digest_token)(payload)
+    if bot_token is None:
+        # Строка outbox удалена вместе с отправленными
+        return
+    notifications = await sync_to_async(load_digest)(bot_token, chat_id)
+    if not notifications:
+        # Сводку уже отправила параллельная задача с тем же ключом
+        return
+
+    text, included = build_digest(notifications)
+    try:
+        await get_telegram_client().asend_message(chat_id, text, notifications[0].parse_mode, bot_token=bot_token)
+    except TelegramError as e:
+        raise JobError(f"Ошибка отправки сводки: {e}")
+    await sync_to_async(finish_digest)(bot_token, chat_id, included)
+
+
+def purge_notifications(older_than):
+    """Удаляет отправленные уведомления (вместе с их ключами идемпотентности) старше older_than"""
+    deleted, _ = PendingNotification.objects.filter(sent_at__lt=older_than).delete()
+    return deleted
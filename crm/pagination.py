@@ -0,0 +1,102 @@
+from django.db import connections
+from rest_framework import pagination
+from rest_framework.response import Response
+
+
+def estimate_count(queryset, limit=10000):
+    """
+    Дешевая оценка количества строк.
+
+    Для запроса без фильтров берется статистика таблицы из СУБД (MySQL: information_schema,
+    SQLite: sqlite_stat1 после ANALYZE). Для отфильтрованного запроса считается не больше limit строк,
+    поэтому стоимость не зависит от размера таблицы.
+    Возвращает пару (количество, точное ли значение).
+    """
+    if not queryset.query.where:
+        estimated = _table_rows_estimate(queryset)
+        if estimated is not None:
+            return estimated, False
+    count = queryset.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, False
+    return count, True
+
+
+def _table_rows_estimate(queryset):
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [table]
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return int(str(row[0]).split()[0])
+
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Keyset (cursor) пагинация по индексированному первичному ключу.
+
+    Страница выбирается условием WHERE pk > <курсор> вместо OFFSET, поэтому 500-я страница
+    стоит столько же, сколько первая. COUNT(*) не выполняется, количество можно запросить явно:
+    ?count=exact — точное значение, ?count=estimate — оценка (см. estimate_count).
+
+    Включается явно: ?pagination=keyset для первой страницы, дальше — по ссылкам next/previous
+    с параметром cursor. Без них пагинация выполняется старым способом (legacy_pagination_class),
+    чтобы ответ для существующих клиентов не менялся ни на первой, ни на следующих страницах.
+    """
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'count'
+    mode_query_param = 'pagination'
+    legacy_pagination_class = pagination.LimitOffsetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.legacy = None
+        if not self.is_keyset_request(request):
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.count, self.count_exact = None, None
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode == 'exact':
+            self.count, self.count_exact = queryset.count(), True
+        elif count_mode == 'estimate':
+            self.count, self.count_exact = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        # Явный порядок запроса (например, ?ordering=rank у задач) сохраняется и в keyset-режиме
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return super().get_ordering(request, queryset, view)
+
+    def is_keyset_request(self, request):
+        return (self.cursor_query_param in request.query_params
+                or request.query_params.get(self.mode_query_param) == 'keyset')
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        body = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            body['count'] = self.count
+            body['count_exact'] = self.count_exact
+        return Response(body)
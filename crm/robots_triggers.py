@@ -1,37 +1,168 @@
 # Импорт необходимых модулей
-import httpx  # Асинхронный HTTP-клиент
+import asyncio  # Параллельное выполнение шагов плана
+import contextvars  # Цепочка переводов, в рамках которой выполняется задача
+import time  # Время цепочки переводов и длительность шагов
+from django.conf import settings  # Настройки автоматизации
 from django.db import transaction  # Для работы с транзакциями БД
 from asgiref.sync import sync_to_async  # Преобразование синхронных методов в асинхронные
 from django.utils import timezone  # Работа с датой и временем
-from .models import Application, Status, FunctionOrder  # Импорт моделей приложения
-import json  # Работа с JSON-файлами
+from .cache import bump_event_version  # Сброс кэша мероприятий после массового update()
+from .funnel import change_funnel_counters, status_change_deltas  # Счетчики воронки
+from .jobs import JobAbort, JobError, current_job, enqueue_job  # Фоновая очередь задач
+from .notifications import notification_key, queue_notification  # Outbox и сводки уведомлений
+from .journal import journal_scope, record_step  # Журнал выполнения автоматизации
+from .automation import get_status_plan, plans_scope, read_plans_generation  # Скомпилированные планы статусов
+from .models import Application, FunctionOrder, Status  # Импорт моделей приложения
+from .scheduler import reschedule_status, schedule_applications  # Расписание триггеров по времени
 
 # Асинхронные обертки для ORM-запросов
 async_get = sync_to_async(Application.objects.get, thread_sensitive=True)  # Асинхронное получение объекта
 async_save = sync_to_async(Application.save, thread_sensitive=True)  # Асинхронное сохранение объекта
 
+# Цепочка автоматических переводов, в рамках которой выполняется текущая задача функций статуса
+current_chain = contextvars.ContextVar('automation_chain', default=None)
+
+
+def next_hop(chain):
+    """Следующий переход цепочки; без цепочки (перевод пользователем или по времени) начинается новая"""
+    if chain is None:
+        return {'hops': 0, 'started': time.time()}
+    return {'hops': chain['hops'] + 1, 'started': chain['started']}
+
+
+def check_chain_budget(chain):
+    """Прерывает цепочку, превысившую AUTOMATION_MAX_HOPS переходов или AUTOMATION_MAX_CHAIN_SECONDS"""
+    if chain['hops'] > settings.AUTOMATION_MAX_HOPS:
+        raise JobAbort(f"Цепочка переводов прервана: {chain['hops']} переходов подряд, "
+                       f"лимит {settings.AUTOMATION_MAX_HOPS}")
+    elapsed = time.time() - chain['started']
+    if elapsed > settings.AUTOMATION_MAX_CHAIN_SECONDS:
+        raise JobAbort(f"Цепочка переводов прервана: выполняется {int(elapsed)} с, "
+                       f"лимит {settings.AUTOMATION_MAX_CHAIN_SECONDS} с")
+
+
+def step_limiter():
+    """Общее на задачу ограничение числа одновременно выполняемых роботов (AUTOMATION_MAX_PARALLEL)"""
+    return asyncio.Semaphore(settings.AUTOMATION_MAX_PARALLEL)
+
+
+def update_applications_status(application_ids, new_status, chain=None):
+    """
+    Перевод заявок в новый статус одним UPDATE в транзакции.
+    В той же транзакции ставится задача на выполнение цепочки функций нового статуса;
+    chain — цепочка переводов роботов, продолжением которой является этот перевод.
+    Возвращает список заявок (с подгруженным статусом), которые были изменены.
+    """
+    with transaction.atomic():
+        applications = list(
+            # Блокируются только строки заявок, общие строки статусов из соединения не блокируются
+            Application.objects.select_for_update(of=('self',)).filter(pk__in=application_ids)
+            .select_related('status')
+        )
+        now = timezone.now()
+        Application.objects.filter(pk__in=[application.pk for application in applications]).update(
+            status=new_status, date_sub=now
+        )
+        # update() не отправляет сигналы, поэтому кэш, счетчики воронки и расписание обновляются явно
+        bump_event_version(*{application.event_id for application in applications})
+        change_funnel_counters(status_change_deltas(applications, new_status.pk))
+        for application in applications:
+            application.status, application.date_sub = new_status, now
+        schedule_applications(applications)
+        if applications:
+            enqueue_job('status_functions', {
+                'applications': [application.pk for application in applications],
+                'status': new_status.pk,
+                'chain': next_hop(chain),
+            })
+    return applications
+
+
+async def bulk_move_applications_status(application_ids, new_status, chain=None):
+    """
+    Массовый перевод заявок в новый статус. Цепочка функций статуса выполняется
+    воркером очереди (команда run_jobs) один раз на пачку заявок каждого мероприятия.
+
+    Возвращает словарь {id заявки: {"success": bool, "errors": [...]}}.
+    """
+    results = {application_id: {"success": False, "errors": []} for application_id in application_ids}
+    applications = await sync_to_async(update_applications_status)(application_ids, new_status, chain)
+
+    for application_id in set(application_ids) - {application.pk for application in applications}:
+        results[application_id]["errors"].append("Заявка не найдена")
+    for application in applications:
+        results[application.pk]["success"] = True
+    return results
+
+
+async def run_status_functions_job(payload):
+    """
+    Задача очереди: цепочка функций статуса для заявок, переведенных в него.
+    Переводы роботами продолжают цепочку переводов задачи; цепочка, превысившая бюджет
+    (например, роботы двух статусов переводят заявки друг в друга), прерывается без повторов.
+    """
+    chain = payload.get('chain') or next_hop(None)
+    check_chain_budget(chain)
+    current_chain.set(chain)
+    applications = await sync_to_async(list)(
+        Application.objects.filter(pk__in=payload['applications']).select_related('status')
+    )
+    # Заявки, успевшие уйти из статуса, цепочкой этого статуса не обрабатываются
+    applications = [application for application in applications if application.status_id == payload['status']]
+    generation = await sync_to_async(read_plans_generation)()
+    with plans_scope(generation):
+        async with journal_scope():
+            errors = await process_status_functions_batch(applications, step_limiter())
+    if errors:
+        raise JobError("; ".join(message for _, message in errors))
+
+
+async def run_time_trigger_job(payload):
+    """Задача очереди: триггер по времени для заявок, у которых наступил срок (crm/scheduler.py)"""
+    function = await sync_to_async(
+        FunctionOrder.objects.select_related('status_order').filter(pk=payload['function']).first
+    )()
+    if function is None or function.status_order is None:
+        return
+    event_id, status_id = function.status_order.event_id, function.status_order.status_id
+    generation = await sync_to_async(read_plans_generation)()
+    with plans_scope(generation):
+        plan = await sync_to_async(get_status_plan)(status_id, event_id)
+    step = next((step for step in plan.steps if step.function_id == function.pk), None)
+    if step is None:
+        # Триггер отключен или удален из цепочки статуса
+        return
+    # Заявки, успевшие уйти из статуса или переставшие удовлетворять условию, отсеиваются запросом
+    applications = await sync_to_async(list)(
+        Application.objects.filter(pk__in=payload['applications'], event_id=event_id, status_id=status_id)
+        .filter(step.condition()).select_related('status')
+    )
+    async with journal_scope():
+        errors = await check_trigger_batch(step, applications, limiter=step_limiter())
+    if errors:
+        raise JobError("; ".join(message for _, message in errors))
+
+
+async def reschedule_triggers_job(payload):
+    """Задача очереди: пересчет расписания триггеров по времени для статуса мероприятия"""
+    await sync_to_async(reschedule_status)(payload['event'], payload['status'])
+
 
 async def move_application_status(application_id: int, new_status_name: str):
     """Асинхронно изменяет статус заявки и запускает связанные действия"""
     try:
-        # Атомарная транзакция для обеспечения целостности данных
-        async with transaction.atomic():
-            # Получение объекта заявки
-            application = await async_get(id=application_id)
-            # Получение нового статуса
-            new_status = await sync_to_async(Status.objects.get)(name=new_status_name)
-
-            # Обновление статуса заявки
-            application.status = new_status
-            await async_save(application)
-
-            # Запуск обработки связанных функций
-            await process_status_functions(application)
-            return True, "Статус успешно изменен"
+        # Получение нового статуса
+        new_status = await sync_to_async(Status.objects.filter(name=new_status_name).first)()
+        if new_status is None:
+            # Обработка отсутствия статуса
+            return False, f"Статус {new_status_name} не найден"
+
+        results = await bulk_move_applications_status([application_id], new_status)
+        errors = results[application_id]["errors"]
+        if errors:
+            return False, "; ".join(errors)
+        return True, "Статус успешно изменен"
 
-    except Status.DoesNotExist:
-        # Обработка отсутствия статуса
-        return False, f"Статус {new_status_name} не найден"
     except Exception as e:
         # Общая обработка ошибок
         return False, f"Ошибка: {str(e)}"
@@ -39,29 +170,37 @@ async def move_application_status(application_id: int, new_status_name: str):
 
 async def send_telegram_notification(application_id: int, config: dict):
     """Асинхронная отправка сообщения через Telegram Bot API"""
+    application = await sync_to_async(Application.objects.select_related('status').get)(id=application_id)
+    return await send_telegram_notification_batch([application], config)
+
+
+async def send_telegram_notification_batch(applications, config: dict):
+    """
+    Одно сообщение на пачку заявок: шаблон форматируется статусом,
+    при нескольких заявках добавляется их количество.
+
+    Сообщение записывается в outbox и уходит в сводке чата через config['digest_window'] секунд
+    (по умолчанию NOTIFICATION_DIGEST_WINDOW; при 0 — ближайшей задачей отправки).
+    Ключ идемпотентности строится из задачи очереди, поэтому повтор задачи не дублирует сообщение.
+    """
     try:
-        # Создание асинхронного HTTP-клиента
-        async with httpx.AsyncClient() as client:
-            # Получение объекта заявки
-            application = await async_get(id=application_id)
-            # Формирование сообщения из шаблона
-            message = config.get('message', 'Статус изменен: {status}').format(
-                status=application.status.name
-            )
-
-            # Отправка запроса к Telegram API
-            url = f"https://api.telegram.org/bot{config['bot_token']}/sendMessage"
-            response = await client.post(
-                url,
-                json={
-                    "chat_id": config['chat_id'],
-                    "text": message,
-                    "parse_mode": "HTML"
-                }
-            )
-            # Проверка статуса ответа
-            response.raise_for_status()
-            return True, "Уведомление отправлено"
+        # Формирование сообщения из шаблона
+        message = config.get('message', 'Статус изменен: {status}').format(
+            status=applications[0].status.name
+        )
+        if len(applications) > 1:
+            message = f"{message}\nЗаявок: {len(applications)}"
+
+        job = current_job.get()
+        key = None
+        if job is not None:
+            key = notification_key(job.pk, config['chat_id'], message,
+                                   *sorted(application.pk for application in applications))
+        # Сообщения в чат за окно объединяются в одну сводку
+        await sync_to_async(queue_notification)(
+            config['chat_id'], message, config['bot_token'], window=config.get('digest_window'), key=key
+        )
+        return True, "Уведомление добавлено в сводку"
 
     except Exception as e:
         # Обработка ошибок отправки
@@ -70,97 +209,116 @@ async def send_telegram_notification(application_id: int, config: dict):
 
 async def process_status_functions(application):
     """Обработка цепочки функций, связанных с текущим статусом"""
-    # Получение списка функций, отсортированных по позиции
-    functions = await sync_to_async(list)(
-        FunctionOrder.objects.filter(
-            status_order__status=application.status
-        ).order_by('position').select_related('robot', 'trigger')
-    )
+    return await process_status_functions_batch([application])
+
+
+async def process_status_functions_batch(applications, limiter=None):
+    """
+    Обработка цепочки функций для пачки заявок, находящихся в одном статусе.
+
+    План статуса берется скомпилированным (crm/automation.py), каждый робот выполняется
+    один раз на всю пачку. limiter (step_limiter) — общее ограничение параллельности
+    для всех групп и вложенных действий триггеров. Возвращает список ошибок вида (id заявок, сообщение).
+    """
+    limiter = limiter or step_limiter()
+    errors = []
+    by_event = {}
+    for application in applications:
+        by_event.setdefault((application.event_id, application.status_id), []).append(application)
+
+    for (event_id, status_id), group in by_event.items():
+        plan = await sync_to_async(get_status_plan)(status_id, event_id)
+        errors.extend(await run_steps(plan.steps, group, limiter=limiter))
+    return errors
+
 
-    # Последовательное выполнение функций
-    for function in functions:
-        if function.type_function == "robot":
-            await execute_robot(function, application)
-        elif function.type_function == "trigger":
-            await check_trigger(function, application)
+async def run_steps(steps, applications, parent=None, limiter=None):
+    """
+    Выполнение шагов плана как графа зависимостей (PlanStep.depends_on): независимые шаги
+    идут параллельно, поэтому время выполнения определяется самой длинной цепочкой
+    зависимостей, а не суммой шагов. Ошибка шага не отменяет зависящие от него шаги.
+    Возвращает список ошибок.
 
+    limiter (step_limiter) передается во вложенные действия триггеров, поэтому одновременно
+    во всем графе задачи выполняется не более AUTOMATION_MAX_PARALLEL роботов. Место занимает
+    только робот: триггер, ожидающий свои действия, места не держит и не блокирует их.
 
-async def execute_robot(function_order, application):
+    Роботы записываются в журнал автоматизации; parent — триггер, действиями которого являются шаги.
+    """
+    limiter = limiter or step_limiter()
+    application_ids = [application.pk for application in applications]
+    errors = []
+
+    async def run(step, dependencies):
+        await asyncio.gather(*dependencies)
+        if step.type_function == "robot":
+            async with limiter:
+                started = time.perf_counter()
+                result, message = await execute_robot_batch(step, applications)
+            record_step(step, applications, time.perf_counter() - started, '' if result else message, parent)
+            if not result:
+                errors.append((application_ids, message))
+        elif step.type_function == "trigger":
+            errors.extend(await check_trigger_batch(step, applications, limiter=limiter))
+
+    tasks = []
+    for step in steps:
+        tasks.append(asyncio.ensure_future(run(step, [tasks[index] for index in step.depends_on])))
+    await asyncio.gather(*tasks)
+    return errors
+
+
+async def execute_robot(step, application):
     """Выполнение действия, связанного с роботом"""
-    try:
-        # Загрузка конфигурации из JSON
-        config = json.loads(function_order.config)
+    return await execute_robot_batch(step, [application])
+
 
+async def execute_robot_batch(step, applications):
+    """Выполнение шага-робота плана для пачки заявок"""
+    if step.error:
+        return False, f"Ошибка конфигурации: {step.error}"
+    try:
         # Определение типа действия робота
-        if function_order.robot.action_type == "move_status":
+        if step.action == "move_status":
             # Вызов функции изменения статуса
-            result, message = await move_application_status(
-                application.id,
-                config['target_status']
-            )
-        elif function_order.robot.action_type == "notification":
+            new_status = await sync_to_async(Status.objects.get)(pk=step.config['target_status_id'])
+            await bulk_move_applications_status([application.pk for application in applications], new_status,
+                                                current_chain.get())
+            return True, "Статус успешно изменен"
+        elif step.action == "notification":
             # Вызов функции отправки уведомления
-            result, message = await send_telegram_notification(
-                application.id,
-                config
-            )
+            return await send_telegram_notification_batch(applications, step.config)
+        return False, f"Неизвестный тип действия: {step.action}"
 
     except Exception as e:
         # Обработка ошибок выполнения
-        result, message = False, f"Ошибка выполнения: {str(e)}"
+        return False, f"Ошибка выполнения: {str(e)}"
 
 
-async def check_trigger(function_order, application):
+async def check_trigger(step, application):
     """Проверка условий триггера"""
-    try:
-        # Загрузка конфигурации триггера
-        config = json.loads(function_order.config)
+    return await check_trigger_batch(step, [application])
 
-        # Определение обработчика для типа триггера
-        handler = {
-            "time_expiration": check_time_trigger,
-            "status_check": check_status_trigger,
-            "field_comparison": check_field_trigger
-        }.get(function_order.trigger.trigger_type)
 
-        # Проверка условия триггера
-        condition_met, _ = await handler(application, config)
-
-        if condition_met:
-            # Запуск связанных действий при выполнении условия
-            for action in await sync_to_async(list)(function_order.trigger.actions.all()):
-                await execute_robot(action, application)
+async def check_trigger_batch(step, applications, limiter=None):
+    """
+    Проверка условия шага-триггера для каждой заявки пачки и запуск графа его действий
+    для подошедших заявок. Возвращает ошибки действий.
 
+    Проверка условия записывается в журнал автоматизации, в том числе с ошибкой.
+    """
+    if step.error:
+        record_step(step, applications, 0.0, f"Ошибка конфигурации: {step.error}")
+        return []
+    started = time.perf_counter()
+    try:
+        matched = [application for application in applications if step.check(application)]
     except Exception as e:
-        # Подавление ошибок проверки триггера
-        pass
-
-
-async def check_time_trigger(application, config):
-    """Проверка временного условия"""
-    # Расчет временного интервала
-    delta = timezone.timedelta(**{config['interval']: config['value']})
-    # Получение значения поля из заявки
-    target_field = getattr(application, config.get('field', 'updated_at'))
-    # Проверка истечения времени
-    return timezone.now() > target_field + delta
-
-
-async def check_status_trigger(application, config):
-    """Проверка текущего статуса"""
-    return application.status.name == config['status']
-
-
-async def check_field_trigger(application, config):
-    """Сравнение значения поля заявки"""
-    # Получение значения поля
-    field_value = getattr(application, config['field'])
-    # Определение оператора сравнения
-    operator = {
-        '>': lambda a, b: a > b,
-        '<': lambda a, b: a < b,
-        '==': lambda a, b: a == b,
-        '!=': lambda a, b: a != b
-    }[config['operator']]
-    # Выполнение сравнения
-    return operator(field_value, config['value'])
+        # Ошибка проверки условия не останавливает цепочку статуса
+        record_step(step, applications, time.perf_counter() - started, f"Ошибка проверки условия: {e}")
+        return []
+    record_step(step, applications, time.perf_counter() - started)
+    if not matched:
+        return []
+    # Запуск связанных действий при выполнении условия
+    return await run_steps(step.actions, matched, parent=step, limiter=limiter)
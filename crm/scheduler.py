@@ -0,0 +1,76 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .automation import get_status_plan, plans_scope
+from .jobs import enqueue_job
+from .models import Application, ScheduledTrigger
+
+
+def schedule_applications(applications):
+    """
+    Пересчитывает моменты срабатывания триггеров по времени для заявок в их текущем состоянии:
+    строки для прежнего статуса удаляются, для триггеров текущего статуса создаются заново.
+    """
+    ScheduledTrigger.objects.filter(application_id__in=[application.pk for application in applications]).delete()
+    rows = []
+    with plans_scope():
+        for application in applications:
+            if not application.event_id or not application.status_id:
+                continue
+            for step in get_status_plan(application.status_id, application.event_id).steps:
+                if step.due is None or step.error:
+                    continue
+                due_at = step.due(application)
+                if due_at is not None:
+                    rows.append(ScheduledTrigger(application_id=application.pk, function_order_id=step.function_id,
+                                                 due_at=due_at))
+    ScheduledTrigger.objects.bulk_create(rows, batch_size=1000)
+
+
+def reschedule_status(event_id, status_id, chunk_size=1000):
+    """Пересчет расписания всех заявок статуса мероприятия (после изменения его триггеров)"""
+    queryset = Application.objects.filter(event_id=event_id, status_id=status_id).order_by('pk')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_id)[:chunk_size])
+        with transaction.atomic():
+            schedule_applications(chunk)
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1].pk
+
+
+def enqueue_reschedule(event_id, status_id):
+    """Задача пересчета расписания статуса; повторные изменения до ее выполнения схлопываются"""
+    if event_id and status_id:
+        enqueue_job('reschedule_triggers', {'event': event_id, 'status': status_id},
+                    key=f'reschedule_triggers:{event_id}:{status_id}')
+
+
+def dispatch_due_triggers(limit=1000):
+    """
+    Забирает наступившие строки расписания (по индексу due_at) и ставит по задаче
+    на каждую функцию статуса. Возвращает число обработанных строк.
+    """
+    with transaction.atomic():
+        due = list(
+            ScheduledTrigger.objects.select_for_update(skip_locked=True)
+            .filter(due_at__lte=timezone.now()).order_by('due_at')
+            .values_list('pk', 'function_order_id', 'application_id')[:limit]
+        )
+        if not due:
+            return 0
+        ScheduledTrigger.objects.filter(pk__in=[pk for pk, _, _ in due]).delete()
+        by_function = defaultdict(list)
+        for _, function_id, application_id in due:
+            by_function[function_id].append(application_id)
+        for function_id, application_ids in by_function.items():
+            enqueue_job('time_trigger', {'function': function_id, 'applications': application_ids})
+    return len(due)
+
+
+def next_due_at():
+    return ScheduledTrigger.objects.aggregate(next_due=Min('due_at'))['next_due']
@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from .models import *
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
+from .fieldsets import SparseFieldsMixin
+from .automation import move_status_cycle_error
 
 
 class TelegramMessageSerializer(serializers.Serializer):
@@ -34,9 +37,10 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'email']
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # user = UserSerializer(read_only=True)
-    user_id = serializers.IntegerField(source='user.id', read_only=True)
+    # user_id хранится в самом профиле (primary key), обращение к user.id дергает auth_user
+    user_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Profile
@@ -71,22 +75,22 @@ class RoleSerializer(serializers.ModelSerializer):
 #         model = Efficiency
 #         fields = '__all__'
 
-class SpecializationSerializer(serializers.ModelSerializer):
+class SpecializationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Specialization
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
-class Status_AppSerializer(serializers.ModelSerializer):
+class Status_AppSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Status
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
 class SupervisorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Profile
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
 class ApplicationCreateSerializer(serializers.ModelSerializer):
@@ -99,25 +103,36 @@ class ApplicationCreateSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class DirectionSerializer(serializers.ModelSerializer):
+class DirectionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Direction
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
 class EventAppSerializer(serializers.ModelSerializer):
     class Meta:
         model = Event
-        fields = '__all__'
+        exclude = ['version', 'updated_at']
 
 
-class ApplicationSerializer(serializers.ModelSerializer):
+class ApplicationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = ProfileSerializer(read_only=True)
     event = EventAppSerializer(read_only=True)
     direction = DirectionSerializer(read_only=True)
     specialization = SpecializationSerializer(read_only=True)
     status = Status_AppSerializer(read_only=True)
 
+    select_related_fields = {
+        'user': ['user'],
+        'event': ['event'],
+        'direction': ['direction'],
+        'specialization': ['specialization'],
+        'status': ['status'],
+    }
+    prefetch_related_fields = {
+        'event': ['event__specializations'],
+    }
+
     class Meta:
         model = Application
         fields = "__all__"
@@ -136,6 +151,13 @@ class ApplicationUpdateSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ApplicationBulkStatusSerializer(serializers.Serializer):
+    applications = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=5000
+    )
+    status = serializers.PrimaryKeyRelatedField(queryset=Status.objects.all())
+
+
 class TestSerializer(serializers.ModelSerializer):
     class Meta:
         model = Test
@@ -160,7 +182,7 @@ class TrueAnswerSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     creator = ProfileSerializer(read_only=True)
 
     specializationsSet = SpecializationSerializer(read_only=True, many=True, source="specializations")
@@ -169,6 +191,18 @@ class EventSerializer(serializers.ModelSerializer):
     applications = ApplicationSerializer(read_only=True, many=True)
     event_id = serializers.IntegerField(read_only=True, source="id")
 
+    prefetch_related_fields = {
+        'specializations': ['specializations'],
+        'specializationsSet': ['specializations'],
+        'directions': ['directions'],
+        'applications': [
+            lambda: Prefetch(
+                'applications',
+                queryset=ApplicationSerializer.setup_eager_loading(Application.objects.all())
+            ),
+        ],
+    }
+
     class Meta:
         model = Event
         fields = ["creator",
@@ -193,19 +227,19 @@ class EventCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Event
-        fields = '__all__'
+        exclude = ['version', 'updated_at']
 
 
 class StatusSerializer(serializers.ModelSerializer):
     class Meta:
         model = Status
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
 class StatusOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Status_order
-        fields = '__all__'
+        exclude = ['updated_at']
         extra_kwargs = {
             'number': {'min_value': 1}
         }
@@ -274,6 +308,14 @@ class FunctionOrderSerializer(serializers.ModelSerializer):
         ).exclude(pk=self.instance.pk if self.instance else None).exists():
             raise serializers.ValidationError("Позиция с таким номером уже существует в этом статус-заказе")
 
+        # Немедленные переходы move_status не должны замыкаться в цикл статусов
+        robot = data.get('robot')
+        if data.get('type_function') == 'robot' and robot and robot.type_action == 'move_status':
+            error = move_status_cycle_error(data['status_order'], data.get('config'),
+                                            exclude_function=self.instance.pk if self.instance else None)
+            if error:
+                raise serializers.ValidationError({'config': error})
+
         return data
 
     def create(self, validated_data):
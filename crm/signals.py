@@ -1,7 +1,16 @@
-from django.db.models.signals import post_save
+from collections import Counter
+
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from plan.models import Profile
+from .automation import invalidate_plans
+from .cache import bump_event_version, bump_events_version
+from .funnel import application_funnel_key, change_funnel_counters, funnel_key
+from .scheduler import enqueue_reschedule, schedule_applications
+from .models import (Application, Direction, Event, FunctionOrder, Robot, Specialization, Status, Status_order,
+                     Trigger, TriggerAction)
 
 
 @receiver(post_save, sender=User)
@@ -13,3 +22,130 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+
+# Инвалидация кэша мероприятий (crm/cache.py)
+
+@receiver(post_save, sender=Event)
+def bump_event_on_change(sender, instance, **kwargs):
+    bump_event_version(instance.pk)
+
+
+@receiver(post_save, sender=Direction)
+@receiver(post_delete, sender=Direction)
+@receiver(post_save, sender=Status_order)
+@receiver(post_delete, sender=Status_order)
+def bump_event_on_related_change(sender, instance, **kwargs):
+    bump_event_version(instance.event_id)
+
+
+@receiver(pre_save, sender=Application)
+def remember_application_state(sender, instance, **kwargs):
+    # Состояние заявки в БД до сохранения: нужно для переноса между мероприятиями и счетчиков воронки
+    instance._previous_state = None
+    if instance.pk:
+        instance._previous_state = Application.objects.filter(pk=instance.pk).values(
+            'event_id', 'status_id', 'direction_id', 'specialization_id'
+        ).first()
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+def bump_event_on_application_change(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_state', None) or {}
+    bump_event_version(instance.event_id, previous.get('event_id'))
+
+
+# Счетчики воронки (crm/funnel.py)
+
+@receiver(post_save, sender=Application)
+def update_funnel_on_save(sender, instance, **kwargs):
+    deltas = Counter({application_funnel_key(instance): 1})
+    previous = getattr(instance, '_previous_state', None)
+    if previous:
+        deltas[funnel_key(**previous)] -= 1
+    change_funnel_counters(deltas)
+
+
+@receiver(post_delete, sender=Application)
+def update_funnel_on_delete(sender, instance, **kwargs):
+    change_funnel_counters({application_funnel_key(instance): -1})
+
+
+@receiver(m2m_changed, sender=Event.specializations.through)
+def bump_event_on_specializations_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_event_version(instance.pk)
+    elif pk_set:
+        bump_event_version(*pk_set)
+    else:
+        bump_events_version(Event.objects.filter(specializations=instance))
+
+
+@receiver(post_save, sender=Specialization)
+def bump_events_on_specialization_change(sender, instance, **kwargs):
+    bump_events_version(Event.objects.filter(
+        Q(specializations=instance) | Q(applications__specialization=instance)
+    ))
+
+
+@receiver(post_save, sender=Status)
+def bump_events_on_status_change(sender, instance, **kwargs):
+    bump_events_version(Event.objects.filter(applications__status=instance))
+
+
+@receiver(post_save, sender=Profile)
+def bump_events_on_profile_change(sender, instance, created, **kwargs):
+    if not created:
+        bump_events_version(Event.objects.filter(applications__user=instance))
+
+
+@receiver(post_save, sender=FunctionOrder)
+@receiver(post_delete, sender=FunctionOrder)
+@receiver(post_save, sender=Robot)
+@receiver(post_delete, sender=Robot)
+@receiver(post_save, sender=Trigger)
+@receiver(post_delete, sender=Trigger)
+@receiver(post_save, sender=Status_order)
+@receiver(post_delete, sender=Status_order)
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+@receiver(post_save, sender=TriggerAction)
+@receiver(post_delete, sender=TriggerAction)
+@receiver(m2m_changed, sender=TriggerAction.depends_on.through)
+def invalidate_plans_on_change(sender, **kwargs):
+    # Статус входит в план через целевой статус робота move_status
+    invalidate_plans()
+
+
+@receiver(post_save, sender=Application)
+def schedule_application_triggers(sender, instance, **kwargs):
+    schedule_applications([instance])
+
+
+@receiver(post_save, sender=FunctionOrder)
+def reschedule_on_function_change(sender, instance, created, **kwargs):
+    # Новый робот расписание не меняет; при удалении функции строки расписания удаляются каскадно
+    if created and instance.type_function != 'trigger':
+        return
+    if instance.status_order_id:
+        status_order = instance.status_order
+        enqueue_reschedule(status_order.event_id, status_order.status_id)
+
+
+@receiver(post_save, sender=Trigger)
+def reschedule_on_trigger_change(sender, instance, created, **kwargs):
+    if created:
+        return
+    for event_id, status_id in Status_order.objects.filter(functions__trigger=instance).values_list(
+        'event_id', 'status_id'
+    ).distinct():
+        enqueue_reschedule(event_id, status_id)
+
+
+@receiver(post_save, sender=Status_order)
+def reschedule_on_status_order_change(sender, instance, created, **kwargs):
+    if not created:
+        enqueue_reschedule(instance.event_id, instance.status_id)
@@ -0,0 +1,288 @@
+import json
+import statistics
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.utils import timezone
+
+from . import telegram
+from .automation import forget_plans
+from .jobs import enqueue_job, job_scope, work
+from .journal import PERCENTILES, percentile_index, step_stats
+from .models import (Application, AutomationRun, Event, FunctionOrder, Job, Profile, ScheduledTrigger,
+                     Status_order, TriggerAction)
+from .robots_triggers import update_applications_status
+
+
+class StubTelegramHandler(BaseHTTPRequestHandler):
+    """Локальная заглушка Telegram Bot API: на любой метод отвечает успехом"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'ok': True, 'result': {'message_id': 1}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.requests += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def stub_telegram(rate_limits=True):
+    """
+    Подменяет общий клиент Telegram клиентом заглушки на время симуляции.
+    Без rate_limits ограничения скорости Telegram снимаются.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTelegramHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    rates = {} if rate_limits else dict(global_rate=10 ** 9, chat_rate=10 ** 9, group_rate=10 ** 9)
+    previous = telegram._client
+    telegram._client = telegram.TelegramClient(base_url=f'http://127.0.0.1:{server.server_port}', **rates)
+    try:
+        yield server
+    finally:
+        telegram._client = previous
+        server.shutdown()
+        server.server_close()
+
+
+def locks_whole_database(alias):
+    """Транзакция прогона блокирует запись во всю БД alias (SQLite), а не только в свои строки"""
+    return connections[alias].vendor == 'sqlite'
+
+
+@contextmanager
+def use_database(alias):
+    """
+    Направляет все запросы процесса в БД alias (копию рабочей) на время прогона: соединение
+    default переключается на ее параметры, как это делает тестовый раннер Django. Код автоматизации
+    и очереди работает с соединением default и не требует указания БД в каждом запросе.
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        yield
+        return
+    default = connections[DEFAULT_DB_ALIAS]
+    previous = default.settings_dict
+    default.close()
+    default.settings_dict = connections[alias].settings_dict
+    try:
+        yield
+    finally:
+        default.close()
+        default.settings_dict = previous
+
+
+@contextmanager
+def count_queries():
+    """Счетчик запросов к БД (без ограничения размера журнала запросов Django)"""
+    counter = {'queries': 0}
+
+    def wrapper(execute, sql, params, many, context):
+        counter['queries'] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield counter
+
+
+def drain(job_ids, concurrency):
+    """Выполняет задачи, поставленные симуляцией (job_scope), включая порожденные ими"""
+    async def run():
+        try:
+            await work('simulator', concurrency=concurrency, once=True, job_ids=job_ids)
+        finally:
+            await telegram.get_telegram_client().aclose()
+
+    async_to_sync(run)()
+
+
+def fire_time_triggers(application_ids, job_ids, concurrency):
+    """Срабатывание триггеров по времени симулируемых заявок без ожидания сроков"""
+    by_function = defaultdict(list)
+    rows = ScheduledTrigger.objects.filter(application_id__in=application_ids)
+    for function_id, application_id in rows.values_list('function_order_id', 'application_id'):
+        by_function[function_id].append(application_id)
+    rows.delete()
+    for function_id, ids in by_function.items():
+        enqueue_job('time_trigger', {'function': function_id, 'applications': ids})
+    drain(job_ids, concurrency)
+    return bool(by_function)
+
+
+def sandbox_event(event):
+    """
+    Копия мероприятия с порядком статусов, функциями статусов и действиями триггеров.
+    Заявки симуляции создаются в копии: версия мероприятия и счетчики воронки меняются
+    в строках копии, строки исходного мероприятия не блокируются. Функции копируются
+    bulk_create без сигналов — поколение планов в БД не меняется.
+    """
+    sandbox = Event.objects.create(name=event.name, description=event.description, stage=event.stage,
+                                   start=event.start, end=event.end, end_app=event.end_app)
+    orders = list(Status_order.objects.filter(event=event))
+    copies = Status_order.objects.bulk_create(
+        [Status_order(event=sandbox, status_id=order.status_id, number=order.number) for order in orders]
+    )
+    order_map = {order.pk: copy.pk for order, copy in zip(orders, copies)}
+
+    functions = list(FunctionOrder.objects.filter(status_order__event=event))
+    copies = FunctionOrder.objects.bulk_create([
+        FunctionOrder(status_order_id=order_map[function.status_order_id], position=function.position,
+                      type_function=function.type_function, robot_id=function.robot_id,
+                      trigger_id=function.trigger_id, config=function.config)
+        for function in functions
+    ])
+    function_map = {function.pk: copy.pk for function, copy in zip(functions, copies)}
+
+    actions = list(TriggerAction.objects.filter(function_order__status_order__event=event))
+    copies = TriggerAction.objects.bulk_create([
+        TriggerAction(function_order_id=function_map[action.function_order_id], position=action.position,
+                      robot_id=action.robot_id, config=action.config)
+        for action in actions
+    ])
+    action_map = {action.pk: copy.pk for action, copy in zip(actions, copies)}
+    Dependency = TriggerAction.depends_on.through
+    Dependency.objects.bulk_create([
+        Dependency(from_triggeraction_id=action_map[from_id], to_triggeraction_id=action_map[to_id])
+        for from_id, to_id in Dependency.objects.filter(from_triggeraction_id__in=action_map)
+        .values_list('from_triggeraction_id', 'to_triggeraction_id')
+    ])
+    return sandbox
+
+
+def duration_summary(values):
+    summary = {'count': len(values)}
+    values = sorted(values)
+    for name, percent in PERCENTILES:
+        summary[name] = round(values[percentile_index(len(values), percent)], 4) if values else None
+    return summary
+
+
+def simulate_once(event, status, count, batch_size, concurrency, time_triggers):
+    """
+    Один прогон: count синтетических заявок копии мероприятия переводятся в status пачками
+    по batch_size, затем выполняются все порожденные задачи. Изменения откатываются.
+    Прогон пишет только в созданные им строки и выполняет только свои задачи (job_scope):
+    задачи очереди, поставленные другими процессами, не забираются.
+    """
+    with transaction.atomic(), job_scope() as job_ids:
+        sandbox = sandbox_event(event)
+        user = User.objects.create(username=f'simulator-{time.time_ns()}')
+        profile, _ = Profile.objects.get_or_create(user=user)
+        applications = Application.objects.bulk_create(
+            [Application(user=profile, event=sandbox, status=status) for _ in range(count)], batch_size=1000
+        )
+        application_ids = [application.pk for application in applications]
+
+        stages = {}
+        with count_queries() as counter:
+            started = time.perf_counter()
+            for start in range(0, count, batch_size):
+                update_applications_status(application_ids[start:start + batch_size], status)
+            stages['enter'] = time.perf_counter() - started
+
+            mark = time.perf_counter()
+            drain(job_ids, concurrency)
+            stages['status_functions'] = time.perf_counter() - mark
+
+            mark = time.perf_counter()
+            if time_triggers:
+                # Триггеры статусов, в которые заявки попали по триггерам, тоже выполняются
+                for _ in range(settings.AUTOMATION_MAX_HOPS):
+                    if not fire_time_triggers(application_ids, job_ids, concurrency):
+                        break
+            stages['time_triggers'] = time.perf_counter() - mark
+
+            mark = time.perf_counter()
+            Job.objects.filter(pk__in=list(job_ids), kind='notification_digest', status=Job.PENDING).update(
+                run_at=timezone.now()
+            )
+            drain(job_ids, concurrency)
+            stages['notifications'] = time.perf_counter() - mark
+            elapsed = time.perf_counter() - started
+
+        report = collect_report(job_ids, sandbox, count, elapsed, counter['queries'])
+        report['stages'] = {stage: round(seconds, 4) for stage, seconds in stages.items()}
+        transaction.set_rollback(True)
+    # Планы откатанной копии не должны достаться мероприятию, получившему тот же id
+    forget_plans(sandbox.pk)
+    return report
+
+
+def collect_report(job_ids, sandbox, count, elapsed, queries):
+    jobs = defaultdict(lambda: {'durations': [], 'failed': 0})
+    chains = defaultdict(int)
+    aborted = 0
+    for kind, status, payload, started_at, finished_at, error in Job.objects.filter(pk__in=list(job_ids)).values_list(
+            'kind', 'status', 'payload', 'started_at', 'finished_at', 'last_error').iterator():
+        if status == Job.DONE:
+            jobs[kind]['durations'].append((finished_at - started_at).total_seconds())
+        else:
+            jobs[kind]['failed'] += 1
+            aborted += error.startswith('Цепочка переводов прервана')
+        if kind == 'status_functions' and payload.get('chain'):
+            chain = payload['chain']
+            chains[chain['started']] = max(chains[chain['started']], chain['hops'])
+
+    steps = step_stats(AutomationRun.objects.filter(event_id=sandbox.pk), 'type_function', 'action')
+
+    hops = list(chains.values())
+    return {
+        'applications': count,
+        'seconds': round(elapsed, 4),
+        'throughput': round(count / elapsed, 2) if elapsed else None,
+        'queries': queries,
+        'queries_per_application': round(queries / count, 3),
+        'jobs': {kind: {**duration_summary(data['durations']), 'failed': data['failed']}
+                 for kind, data in sorted(jobs.items())},
+        'steps': sorted(steps, key=lambda step: (step['type_function'], step['action'])),
+        'chains': {
+            'count': len(hops),
+            'avg_hops': round(statistics.mean(hops), 3) if hops else 0,
+            'max_hops': max(hops, default=0),
+            'aborted': aborted,
+        },
+    }
+
+
+def simulate(event, status, count, batch_size=1000, concurrency=10, repeat=3, time_triggers=True,
+             rate_limits=False):
+    """
+    Прогон цепочек функций статусов мероприятия на синтетических заявках без сохранения изменений.
+    Выполняется repeat раз; подробности отчета — по прогону с медианной пропускной способностью,
+    разброс виден по throughput_runs.
+    """
+    reports = []
+    with stub_telegram(rate_limits) as server:
+        for _ in range(repeat):
+            requests = server.requests
+            report = simulate_once(event, status, count, batch_size, concurrency, time_triggers)
+            report['telegram_requests'] = server.requests - requests
+            reports.append(report)
+
+    reports.sort(key=lambda report: report['throughput'] or 0)
+    median = reports[len(reports) // 2]
+    return {
+        'event': event.pk,
+        'status': status.name,
+        **median,
+        'throughput_runs': [report['throughput'] for report in reports],
+    }
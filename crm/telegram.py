@@ -0,0 +1,234 @@
+import asyncio
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+
+
+class TelegramError(Exception):
+    """Ошибка Telegram Bot API: ответ с ok=false, HTTP-ошибка или исчерпанные повторы"""
+
+    def __init__(self, description, status_code=None, retry_after=None):
+        super().__init__(description)
+        self.description = description
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Ведро токенов с резервированием: каждый вызов reserve() забирает токен
+    и возвращает, сколько секунд нужно подождать до отправки.
+    Отрицательный запас — очередь уже зарезервированных отправок.
+    """
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        self.refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds, now):
+        """Запрет отправок на seconds секунд (ответ 429 с retry_after)"""
+        self.refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    Ограничения Telegram для одного бота: общий поток сообщений
+    и отдельный поток на каждый чат (группы — с отрицательным chat_id — медленнее).
+    Потокобезопасен, поэтому общий для синхронных запросов и воркера очереди.
+    """
+    max_idle_chats = 10000
+
+    def __init__(self, global_rate, chat_rate, group_rate, clock=time.monotonic):
+        self.clock = clock
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.lock = threading.Lock()
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock())
+        self.chats = {}
+
+    def chat_bucket(self, chat_id, now):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.max_idle_chats:
+                # Полные ведра неотличимы от новых, их можно выбросить
+                self.chats = {key: value for key, value in self.chats.items() if not value.is_idle(now)}
+            rate = self.group_rate if str(chat_id).startswith('-') else self.chat_rate
+            bucket = self.chats[chat_id] = TokenBucket(rate, 1, now)
+        return bucket
+
+    def reserve(self, chat_id):
+        """Резервирует отправку в чат и возвращает задержку в секундах"""
+        with self.lock:
+            now = self.clock()
+            return max(self.global_bucket.reserve(now), self.chat_bucket(chat_id, now).reserve(now))
+
+    def pause(self, chat_id, seconds):
+        with self.lock:
+            now = self.clock()
+            self.chat_bucket(chat_id, now).pause(seconds, now)
+
+
+class TelegramClient:
+    """
+    Общий клиент Telegram Bot API с пулом keep-alive соединений.
+
+    Синхронные вызовы (send_message) используют один httpx.Client, асинхронные
+    (asend_message) — один httpx.AsyncClient на event loop. Ограничители скорости
+    общие для обоих и заводятся на каждый токен бота.
+    """
+
+    def __init__(self, base_url=None, bot_token=None, timeout=None, max_connections=None, max_retries=None,
+                 global_rate=None, chat_rate=None, group_rate=None, transport=None, async_transport=None,
+                 clock=time.monotonic):
+        self.base_url = (base_url or settings.TELEGRAM_API_URL).rstrip('/')
+        self.bot_token = bot_token or settings.TELEGRAM_BOT_TOKEN
+        self.timeout = timeout or settings.TELEGRAM_TIMEOUT
+        self.max_retries = settings.TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+        self.rates = (
+            global_rate or settings.TELEGRAM_GLOBAL_RATE,
+            chat_rate or settings.TELEGRAM_CHAT_RATE,
+            group_rate or settings.TELEGRAM_GROUP_RATE,
+        )
+        self.limits = httpx.Limits(
+            max_connections=max_connections or settings.TELEGRAM_MAX_CONNECTIONS,
+            max_keepalive_connections=max_connections or settings.TELEGRAM_MAX_CONNECTIONS,
+        )
+        self.transport = transport
+        self.async_transport = async_transport
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.limiters = {}
+        self.client = None
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def limiter(self, bot_token):
+        with self.lock:
+            limiter = self.limiters.get(bot_token)
+            if limiter is None:
+                limiter = self.limiters[bot_token] = RateLimiter(*self.rates, clock=self.clock)
+            return limiter
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                self.client = httpx.Client(timeout=self.timeout, limits=self.limits, transport=self.transport)
+            return self.client
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            client = self.async_clients.get(loop)
+            if client is None:
+                client = self.async_clients[loop] = httpx.AsyncClient(
+                    timeout=self.timeout, limits=self.limits, transport=self.async_transport
+                )
+            return client
+
+    def method_url(self, method, bot_token):
+        return f"{self.base_url}/bot{bot_token or self.bot_token}/{method}"
+
+    def handle_response(self, response):
+        """Разбор ответа: результат метода или TelegramError (для 429 — с retry_after)"""
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code == 429:
+            retry_after = data.get('parameters', {}).get('retry_after', 1)
+            raise TelegramError(data.get('description', 'Too Many Requests'), 429, retry_after)
+        if response.is_error or not data.get('ok'):
+            raise TelegramError(data.get('description') or response.text, response.status_code)
+        return data['result']
+
+    def send_message(self, chat_id, text, parse_mode='HTML', bot_token=None):
+        """Синхронная отправка сообщения с ожиданием лимитов; возвращает Message из ответа"""
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
+        return self.call('sendMessage', payload, bot_token, chat_id)
+
+    async def asend_message(self, chat_id, text, parse_mode='HTML', bot_token=None):
+        """Асинхронная отправка сообщения с ожиданием лимитов; возвращает Message из ответа"""
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
+        return await self.acall('sendMessage', payload, bot_token, chat_id)
+
+    async def asend_many(self, chat_ids, text, parse_mode='HTML', bot_token=None):
+        """
+        Рассылка одного сообщения по списку чатов с максимальной разрешенной скоростью.
+        Возвращает {chat_id: Message или TelegramError}.
+        """
+        async def send(chat_id):
+            try:
+                return chat_id, await self.asend_message(chat_id, text, parse_mode, bot_token)
+            except TelegramError as e:
+                return chat_id, e
+
+        return dict(await asyncio.gather(*(send(chat_id) for chat_id in chat_ids)))
+
+    def call(self, method, payload, bot_token=None, chat_id=None):
+        limiter = self.limiter(bot_token or self.bot_token)
+        url = self.method_url(method, bot_token)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(limiter.reserve(chat_id))
+            try:
+                return self.handle_response(self.get_client().post(url, json=payload))
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise TelegramError(f"Ошибка соединения: {e}") from e
+                time.sleep(2 ** attempt * 0.5)
+            except TelegramError as e:
+                if e.retry_after is None or attempt == self.max_retries:
+                    raise
+                limiter.pause(chat_id, e.retry_after)
+
+    async def acall(self, method, payload, bot_token=None, chat_id=None):
+        limiter = self.limiter(bot_token or self.bot_token)
+        url = self.method_url(method, bot_token)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(limiter.reserve(chat_id))
+            try:
+                return self.handle_response(await self.get_async_client().post(url, json=payload))
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise TelegramError(f"Ошибка соединения: {e}") from e
+                await asyncio.sleep(2 ** attempt * 0.5)
+            except TelegramError as e:
+                if e.retry_after is None or attempt == self.max_retries:
+                    raise
+                limiter.pause(chat_id, e.retry_after)
+
+    async def aclose(self):
+        """Закрывает асинхронный клиент текущего event loop (при остановке воркера)"""
+        with self.lock:
+            client = self.async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_telegram_client():
+    """Общий на процесс клиент Telegram"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TelegramClient()
+        return _client
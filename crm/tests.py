@@ -1,3 +1,1131 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APITestCase
+
+from .automation import evaluate_event_trigger, evaluate_trigger, get_status_plan, plans_scope
+from .funnel import verify_funnel
+from .journal import journal_stats
+from .jobs import claim_jobs, enqueue_job, job_scope, job_stats, run_pending_jobs
+from .notifications import build_digest, queue_notification
+from .scheduler import dispatch_due_triggers
+from .telegram import RateLimiter, TelegramClient
+from .views import ApplicationFilter
+from .models import *
+from .serializers import FunctionOrderSerializer
+
+
+class CrmTestMixin:
+    """Общие фикстуры для тестов crm"""
+
+    def create_user(self, username, **kwargs):
+        user = User.objects.create(username=username, **kwargs)
+        return user.profile
+
+    def create_event(self, name='Мероприятие'):
+        event = Event.objects.create(
+            name=name,
+            start=datetime.date(2025, 1, 1),
+            end=datetime.date(2025, 2, 1),
+            end_app=datetime.date(2025, 1, 15),
+        )
+        return event
+
+    def create_application(self, event, profile, status, **kwargs):
+        return Application.objects.create(event=event, user=profile, status=status, **kwargs)
+
+    def explain_table_access(self, queryset, table):
+        """Способы доступа к таблице в плане запроса: (через индекс, полный просмотр)"""
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                details = [row[-1] for row in cursor.fetchall()]
+                searches = [detail for detail in details if detail.startswith(f'SEARCH {table} ')]
+                scans = [detail for detail in details if detail.split(' ')[:2] == ['SCAN', table]]
+            else:
+                cursor.execute('EXPLAIN ' + sql, params)
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                rows = [row for row in rows if row['table'] == table]
+                searches = [row for row in rows if row['type'] != 'ALL']
+                scans = [row for row in rows if row['type'] == 'ALL']
+        return searches, scans
+
+    def assert_filter_uses_index(self, filterset_class, queryset, params, table):
+        """Первая страница отфильтрованного списка читает таблицу по индексу, а не полным просмотром"""
+        filterset = filterset_class(params, queryset=queryset)
+        self.assertTrue(filterset.is_valid(), filterset.errors)
+        page = filterset.qs.order_by('pk')[:11]
+        searches, scans = self.explain_table_access(page, table)
+        self.assertTrue(searches and not scans, f'{params}: {searches or scans}')
+
+
+class EventListQueriesTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('organizer')
+        self.client.force_authenticate(self.profile.user)
+        self.status = Status.objects.create(name='Новая')
+
+    def populate(self, events, applications_per_event):
+        offset = Event.objects.count()
+        for i in range(offset, offset + events):
+            event = self.create_event(f'Мероприятие {i}')
+            specialization = Specialization.objects.create(name=f'Специализация {i}')
+            event.specializations.add(specialization)
+            direction = Direction.objects.create(event=event, name=f'Направление {i}')
+            for j in range(applications_per_event):
+                profile = self.create_user(f'user-{i}-{j}')
+                self.create_application(event, profile, self.status,
+                                        direction=direction, specialization=specialization)
+
+    def test_event_list_query_count_is_constant(self):
+        self.populate(events=3, applications_per_event=4)
+        # отметка изменений для ETag, COUNT для пагинации, мероприятия, заявки,
+        # специализации мероприятий из заявок, направления и специализации
+        with self.assertNumQueries(7):
+            response = self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['results'][0]['applications']), 4)
+
+        self.populate(events=5, applications_per_event=6)
+        with self.assertNumQueries(7):
+            response = self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_event_list_payload(self):
+        self.populate(events=1, applications_per_event=1)
+        response = self.client.get('/api/events/')
+        event = response.data['results'][0]
+        application = event['applications'][0]
+        self.assertEqual(application['status']['name'], 'Новая')
+        self.assertEqual(application['user']['user_id'], Application.objects.get().user_id)
+        self.assertEqual(application['event']['specializations'], event['specializations'])
+        self.assertEqual(event['directions'][0]['name'], 'Направление 0')
+
+
+class SparseFieldsTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('organizer')
+        self.client.force_authenticate(self.profile.user)
+        self.event = self.create_event()
+        self.create_application(self.event, self.create_user('student'), Status.objects.create(name='Новая'))
+
+    def test_fields_trims_payload_and_queries(self):
+        # отметка изменений, COUNT для пагинации и одна выборка мероприятий без связей
+        with self.assertNumQueries(3) as context:
+            response = self.client.get('/api/events/', {'fields': 'event_id,name,start'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0], {
+            'event_id': self.event.id, 'name': 'Мероприятие', 'start': '2025-01-01'
+        })
+        self.assertNotIn('description', context.captured_queries[2]['sql'])
+
+    def test_omit_skips_prefetch(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/events/', {'omit': 'applications'})
+        self.assertNotIn('applications', response.data['results'][0])
+        self.assertIn('directions', response.data['results'][0])
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/events/', {'fields': 'name,unknown'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_nested_application_fields(self):
+        response = self.client.get('/api/application/', {'fields': 'id,status'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status'})
+        self.assertEqual(response.data['results'][0]['status']['name'], 'Новая')
+
+
+class KeysetPaginationTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('organizer')
+        self.client.force_authenticate(self.profile.user)
+        event = self.create_event()
+        status = Status.objects.create(name='Новая')
+        self.applications = [
+            self.create_application(event, self.create_user(f'student-{i}'), status) for i in range(25)
+        ]
+
+    def test_walk_pages_without_count(self):
+        ids = []
+        url = '/api/application/?fields=id&pagination=keyset'
+        while url:
+            # отметка изменений для ETag и выборка страницы
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, [application.id for application in self.applications])
+
+    def test_optional_count(self):
+        response = self.client.get('/api/application/', {'pagination': 'keyset', 'count': 'exact'})
+        self.assertEqual(response.data['count'], 25)
+        self.assertTrue(response.data['count_exact'])
+
+        response = self.client.get('/api/application/',
+                                   {'pagination': 'keyset', 'count': 'estimate', 'is_approved': 'false'})
+        self.assertEqual(response.data['count'], 25)
+
+    def test_legacy_by_default(self):
+        # Первая и следующие страницы без явного выбора keyset — в прежнем формате
+        first = self.client.get('/api/application/').data
+        self.assertEqual((first['count'], len(first['results'])), (25, 10))
+        self.assertIn('offset=10', first['next'])
+        response = self.client.get('/api/application/', {'offset': 20, 'limit': 10})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 5)
+
+
+class EventDetailCacheTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = self.create_user('organizer')
+        self.client.force_authenticate(self.profile.user)
+        self.event = self.create_event()
+        self.status = Status.objects.create(name='Новая')
+        self.url = f'/api/events/{self.event.id}'
+
+    def test_hit_reads_only_version(self):
+        self.client.get(self.url)
+        # отметка изменений для ETag и версия мероприятия
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['name'], 'Мероприятие')
+
+    def test_related_writes_invalidate(self):
+        self.assertEqual(self.client.get(self.url).data['applications'], [])
+        application = self.create_application(self.event, self.create_user('student'), self.status)
+        self.assertEqual(len(self.client.get(self.url).data['applications']), 1)
+
+        Direction.objects.create(event=self.event, name='Направление')
+        self.assertEqual(len(self.client.get(self.url).data['directions']), 1)
+
+        specialization = Specialization.objects.create(name='Backend')
+        self.event.specializations.add(specialization)
+        self.assertEqual(self.client.get(self.url).data['specializations'], [specialization.id])
+
+        specialization.name = 'Frontend'
+        specialization.save()
+        self.assertEqual(self.client.get(self.url).data['specializationsSet'][0]['name'], 'Frontend')
+
+        application.delete()
+        self.assertEqual(self.client.get(self.url).data['applications'], [])
+
+    def test_fieldsets_are_cached_separately(self):
+        self.assertIn('applications', self.client.get(self.url).data)
+        self.assertNotIn('applications', self.client.get(self.url, {'omit': 'applications'}).data)
+
+    def test_missing_event(self):
+        self.assertEqual(self.client.get('/api/events/100500').status_code, 404)
+
+
+class ConditionalGetTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('organizer')
+        self.client.force_authenticate(self.profile.user)
+        self.event = self.create_event()
+        self.status = Status.objects.create(name='Новая')
+
+    def test_not_modified_skips_serialization(self):
+        response = self.client.get('/api/events/')
+        etag = response['ETag']
+
+        # только агрегат по отметкам изменений
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/events/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_nested_change_updates_etag(self):
+        etag = self.client.get('/api/events/')['ETag']
+        self.create_application(self.event, self.create_user('student'), self.status)
+        response = self.client.get('/api/events/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_delete_updates_etag(self):
+        application = self.create_application(self.event, self.create_user('student'), self.status)
+        response = self.client.get('/api/application/')
+        # Удаление не меняет наибольшую отметку времени списка — списки проверяются только по ETag
+        self.assertNotIn('Last-Modified', response)
+        application.delete()
+        self.assertEqual(self.client.get('/api/application/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get('/api/application/', HTTP_IF_MODIFIED_SINCE=http_date()).status_code, 200)
+
+    def test_related_change_updates_etag_without_joins(self):
+        student = self.create_user('student')
+        self.create_application(self.event, student, self.status)
+        etag = self.client.get('/api/application/')['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/application/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Отметка изменений — агрегат основной таблицы и концы индексов updated_at связанных таблиц
+        self.assertNotIn('JOIN', context.captured_queries[0]['sql'])
+        self.assertNotIn('DISTINCT', context.captured_queries[0]['sql'])
+
+        student.name = 'Иван'
+        student.save()
+        self.assertEqual(self.client.get('/api/application/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_change_timestamps_are_not_serialized(self):
+        direction = Direction.objects.create(event=self.event, name='Направление')
+        self.create_application(self.event, self.create_user('student'), self.status, direction=direction)
+        [application] = self.client.get('/api/application/').data['results']
+        for name in ('event', 'direction', 'status'):
+            self.assertNotIn('updated_at', application[name])
+
+    def test_etag_depends_on_query(self):
+        etag = self.client.get('/api/events/')['ETag']
+        response = self.client.get('/api/events/', {'fields': 'name'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(f'/api/events/{self.event.id}')['Last-Modified']
+        response = self.client.get(f'/api/events/{self.event.id}', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+
+class ApplicationExportTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('organizer')
+        self.client.force_authenticate(self.profile.user)
+        self.event = self.create_event()
+        status = Status.objects.create(name='Новая')
+        for i in range(5):
+            student = self.create_user(f'student-{i}')
+            student.surname = f'Фамилия {i}'
+            student.save()
+            self.create_application(self.event, student, status)
+        self.create_application(self.create_event('Другое'), self.profile, status)
+        self.url = f'/api/events/{self.event.id}/applications/export/'
+
+    def test_csv(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('id,date_sub,date_end,status'))
+        self.assertIn('Фамилия 0', lines[1])
+
+    def test_ndjson_chunks(self):
+        from .export import iter_application_rows
+        with self.assertNumQueries(3):
+            rows = list(iter_application_rows(self.event.id, chunk_size=2))
+        self.assertEqual(len(rows), 5)
+
+        response = self.client.get(self.url, {'type': 'ndjson'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['status'] for record in records], ['Новая'] * 5)
+
+    def test_unknown_event(self):
+        self.assertEqual(self.client.get('/api/events/100500/applications/export/').status_code, 404)
+
+
+class BulkStatusMixin(CrmTestMixin):
+    def setUp(self):
+        self.profile = self.create_user('organizer', is_staff=True)
+        self.client.force_authenticate(self.profile.user)
+        self.event = self.create_event()
+        self.new = Status.objects.create(name='Новая')
+        self.approved = Status.objects.create(name='Одобрена')
+        self.applications = [
+            self.create_application(self.event, self.create_user(f'student-{i}'), self.new) for i in range(3)
+        ]
+        self.status_order = Status_order.objects.create(event=self.event, status=self.approved, number=2)
+
+    def add_robot(self, status_order, position, type_action, config):
+        robot = Robot.objects.create(name=type_action, type_action=type_action)
+        return FunctionOrder.objects.create(status_order=status_order, position=position, type_function='robot',
+                                            robot=robot, config=config)
+
+    def add_trigger(self, position, type_condition, config):
+        trigger = Trigger.objects.create(name=type_condition, type_condition=type_condition)
+        return FunctionOrder.objects.create(status_order=self.status_order, position=position,
+                                            type_function='trigger', trigger=trigger, config=config)
+
+    def post(self, ids, status):
+        return self.client.post('/api/application/bulk-status/', {'applications': ids, 'status': status.id},
+                                format='json')
+
+
+class BulkStatusTest(BulkStatusMixin, APITestCase):
+    def test_bulk_update_reports_per_application(self):
+        version = self.event.version
+        ids = [application.id for application in self.applications]
+        response = self.post(ids + [100500], self.approved)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 3)
+        results = {result['id']: result for result in response.data['results']}
+        self.assertFalse(results[100500]['success'])
+        self.assertTrue(all(results[application_id]['success'] for application_id in ids))
+        self.assertEqual(Application.objects.filter(status=self.approved).count(), 3)
+        self.event.refresh_from_db()
+        self.assertNotEqual(self.event.version, version)
+
+    def test_requires_admin(self):
+        self.client.force_authenticate(self.create_user('student').user)
+        response = self.post([application.id for application in self.applications], self.approved)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Application.objects.filter(status=self.approved).exists())
+
+    def test_notification_runs_once_per_batch(self):
+        self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        with mock.patch('crm.robots_triggers.send_telegram_notification_batch',
+                        new=mock.AsyncMock(return_value=(True, 'ok'))) as send:
+            self.post([application.id for application in self.applications], self.approved)
+            # Запрос только ставит задачу, роботы выполняются воркером
+            send.assert_not_awaited()
+            run_pending_jobs()
+        send.assert_awaited_once()
+        self.assertEqual(len(send.await_args.args[0]), 3)
+
+    def test_move_status_robot_chain(self):
+        rejected = Status.objects.create(name='Отклонена')
+        self.add_robot(self.status_order, 1, 'move_status', {'target_status': 'Отклонена'})
+        self.post([application.id for application in self.applications], self.approved)
+        run_pending_jobs()
+        self.assertEqual(Application.objects.filter(status=rejected).count(), 3)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+
+
+class JobQueueTest(BulkStatusMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        self.post([application.id for application in self.applications], self.approved)
+        self.job = Job.objects.get()
+
+    def test_failed_job_is_retried_with_backoff(self):
+        with mock.patch('crm.robots_triggers.send_telegram_notification_batch',
+                        new=mock.AsyncMock(return_value=(False, 'Ошибка отправки'))):
+            run_pending_jobs()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, Job.PENDING)
+        self.assertEqual(self.job.attempts, 1)
+        self.assertIn('Ошибка отправки', self.job.last_error)
+        self.assertGreater(self.job.run_at, timezone.now())
+
+        # До наступления run_at задача не забирается, после последней попытки помечается ошибочной
+        self.assertEqual(claim_jobs('worker', 10), [])
+        Job.objects.update(run_at=timezone.now(), attempts=F('max_attempts') - 1)
+        with mock.patch('crm.robots_triggers.send_telegram_notification_batch',
+                        new=mock.AsyncMock(side_effect=RuntimeError('timeout'))):
+            run_pending_jobs()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, Job.FAILED)
+        self.assertEqual(self.job.last_error, 'Ошибка выполнения: timeout')
+
+    def test_expired_lease_is_reclaimed(self):
+        self.assertEqual(len(claim_jobs('first', 10)), 1)
+        self.assertEqual(claim_jobs('second', 10), [])
+        Job.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        [job] = claim_jobs('second', 10)
+        self.assertEqual((job.locked_by, job.attempts), ('second', 2))
+
+    def test_scope_claims_only_its_jobs(self):
+        outside = enqueue_job('reschedule_triggers', {}, key='reschedule')
+        with job_scope() as job_ids:
+            # Ожидающая задача с тем же ключом вне области не переиспользуется
+            own = enqueue_job('reschedule_triggers', {}, key='reschedule')
+            self.assertNotEqual(own.pk, outside.pk)
+            self.assertEqual(enqueue_job('reschedule_triggers', {}, key='reschedule').pk, own.pk)
+        # Задача другого процесса, поставленная позже задач области
+        foreign = enqueue_job('reschedule_triggers', {})
+        self.assertEqual(job_ids, {own.pk})
+        self.assertEqual([job.pk for job in claim_jobs('simulator', 10, job_ids)], [own.pk])
+        self.assertEqual(set(Job.objects.filter(status=Job.PENDING).values_list('pk', flat=True)),
+                         {self.job.pk, outside.pk, foreign.pk})
+
+    def test_stats(self):
+        self.assertEqual(job_stats()['depth'][Job.PENDING], 1)
+        self.assertEqual(job_stats()['ready'], 1)
+        with mock.patch('crm.robots_triggers.send_telegram_notification_batch',
+                        new=mock.AsyncMock(return_value=(True, 'ok'))):
+            run_pending_jobs()
+        admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/jobs/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['depth'][Job.DONE], 1)
+        self.assertEqual(response.data['completed'], 1)
+        self.assertIsNotNone(response.data['duration']['avg'])
+
+
+class NotificationDigestTest(BulkStatusMixin, APITestCase):
+    def send(self):
+        client = mock.Mock(asend_message=mock.AsyncMock(return_value={'message_id': 1}))
+        with mock.patch('crm.notifications.get_telegram_client', return_value=client):
+            run_pending_jobs()
+        return [call.args for call in client.asend_message.await_args_list]
+
+    def test_flush_on_size(self):
+        for i in range(120):
+            queue_notification('100', 'Статус изменен: Одобрена', 'token')
+        self.assertEqual(Job.objects.filter(kind='notification_digest').count(), 1)
+        # Токен бота в payload задачи не хранится
+        self.assertNotIn('token', json.dumps(Job.objects.get(kind='notification_digest').payload))
+
+        sent = self.send()
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(sent[0][1], 'Уведомлений: 50\n\nСтатус изменен: Одобрена\n(×50)')
+        self.assertTrue(sent[2][1].startswith('Уведомлений: 20'))
+        self.assertFalse(PendingNotification.objects.filter(sent_at__isnull=True).exists())
+
+    def test_flush_on_window(self):
+        for chat_id in ('1', '1', '2'):
+            queue_notification(chat_id, f'Сообщение для {chat_id}', 'token', window=60)
+        self.assertEqual(self.send(), [])
+
+        Job.objects.update(run_at=timezone.now())
+        sent = sorted(self.send())
+        self.assertEqual(sent, [('1', 'Уведомлений: 2\n\nСообщение для 1\n(×2)', 'HTML'),
+                                ('2', 'Сообщение для 2', 'HTML')])
+
+    def test_notification_robot_is_coalesced(self):
+        self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        for application in self.applications:
+            self.post([application.id], self.approved)
+        self.assertEqual(self.send(), [])
+        self.assertEqual(PendingNotification.objects.count(), 3)
+
+    def test_retried_job_does_not_duplicate_notification(self):
+        self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        self.add_robot(self.status_order, 2, 'move_status', {'target_status': 'Нет такого'})
+        self.post([application.id for application in self.applications], self.approved)
+        job = Job.objects.get(kind='status_functions')
+        for attempt in range(2):
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            self.send()
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(PendingNotification.objects.count(), 1)
+
+    def test_zero_window_is_sent_by_next_job(self):
+        self.add_robot(self.status_order, 1, 'notification',
+                       {'chat_id': '1', 'bot_token': 'token', 'digest_window': 0})
+        self.post([application.id for application in self.applications], self.approved)
+        sent = self.send()
+        self.assertEqual(sent, [('1', 'Статус изменен: Одобрена\nЗаявок: 3', 'HTML')])
+        self.assertIsNotNone(PendingNotification.objects.get().sent_at)
+
+    def test_digest_respects_message_limit(self):
+        notifications = [PendingNotification(text=f'Сообщение {i} ' + 'x' * 100) for i in range(100)]
+        digest, included = build_digest(notifications)
+        self.assertLessEqual(len(digest), 4096)
+        self.assertRegex(digest, rf'… и еще {100 - len(included)} следующим сообщением$')
+        self.assertEqual(included, notifications[:len(included)])
+
+        # Одиночный текст длиннее лимита обрезается, а не отклоняется Telegram
+        digest, included = build_digest([PendingNotification(text='x' * 5000)])
+        self.assertEqual((len(digest), len(included)), (4096, 1))
+
+    def test_digest_over_limit_marks_only_delivered(self):
+        texts = [f'Сообщение {i} ' + 'x' * 200 for i in range(40)] + ['y' * 5000]
+        for text in texts:
+            queue_notification('1', text, 'token', window=0)
+        sent = self.send()
+        self.assertGreater(len(sent), 1)
+        self.assertTrue(all(len(text) <= 4096 for _, text, _ in sent))
+        # Каждое уведомление, помеченное отправленным, есть в одном из отправленных сообщений
+        delivered = '\n'.join(text for _, text, _ in sent)
+        for text in texts[:-1]:
+            self.assertIn(text, delivered)
+        self.assertIn('y' * 4000, delivered)
+        self.assertFalse(PendingNotification.objects.filter(sent_at__isnull=True).exists())
+
+
+class StatusPlanTest(BulkStatusMixin, APITestCase):
+    def plan(self):
+        return get_status_plan(self.approved.id, self.event.id)
+
+    def test_plan_is_compiled_once(self):
+        self.add_robot(self.status_order, 1, 'move_status', {'target_status': 'Новая'})
+        plan = self.plan()
+        self.assertEqual(plan.steps[0].config['target_status_id'], self.new.id)
+        # Вне задачи — одно чтение поколения, внутри области поколения — без запросов
+        with self.assertNumQueries(1):
+            self.assertIs(self.plan(), plan)
+        with plans_scope(), self.assertNumQueries(0):
+            self.assertIs(self.plan(), plan)
+
+        # Изменение функций статуса в этом процессе
+        self.add_robot(self.status_order, 2, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        plan = self.plan()
+        self.assertEqual([step.action for step in plan.steps], ['move_status', 'notification'])
+
+        # Смена поколения другим процессом видна через БД, без общего кэша и сброса памяти процесса
+        cache.clear()
+        AutomationPlansVersion.objects.filter(pk=1).update(generation=F('generation') + 1)
+        self.assertIsNot(self.plan(), plan)
+
+    def test_configs_are_validated(self):
+        self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1'})
+        self.add_trigger(2, 'field_comparison', {'field': 'missing', 'operator': '>', 'value': 1})
+        self.add_trigger(3, 'time_expiration', {'interval': 'days', 'value': 1})
+        robot, field_trigger, time_trigger = self.plan().steps
+        self.assertEqual(robot.error, 'Не заданы параметры: bot_token')
+        self.assertEqual(field_trigger.error, 'Неизвестное поле заявки: missing')
+        self.assertFalse(time_trigger.error)
+
+        application = self.applications[0]
+        self.assertFalse(time_trigger.check(application))
+        application.date_sub = timezone.now() - datetime.timedelta(days=2)
+        self.assertTrue(time_trigger.check(application))
+
+        self.post([application.id for application in self.applications], self.approved)
+        run_pending_jobs()
+        self.assertIn('Ошибка конфигурации', Job.objects.get(kind='status_functions').last_error)
+
+    def test_field_trigger_operator(self):
+        self.add_trigger(1, 'field_comparison', {'field': 'is_approved', 'operator': '==', 'value': True})
+        [step] = self.plan().steps
+        self.applications[0].is_approved = True
+        self.assertEqual([step.check(application) for application in self.applications], [True, False, False])
+
+    def test_inactive_robot_is_skipped(self):
+        function = self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        function.robot.status = False
+        function.robot.save()
+        self.assertEqual(self.plan().steps, ())
+
+
+class SetBasedTriggerTest(BulkStatusMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        first, second, third = self.applications
+        Application.objects.filter(pk=first.pk).update(is_approved=True, status=self.approved,
+                                                       date_sub=timezone.now() - datetime.timedelta(days=3))
+        Application.objects.filter(pk=second.pk).update(date_end=timezone.now(), message='Привет')
+        Application.objects.filter(pk=third.pk).update(direction=Direction.objects.create(event=self.event, name='A'))
+
+    def steps(self, type_condition, configs):
+        for position, config in enumerate(configs, start=1):
+            self.add_trigger(position, type_condition, config)
+        return get_status_plan(self.approved.id, self.event.id).steps
+
+    def assert_matches_python(self, steps):
+        queryset = Application.objects.filter(event=self.event)
+        applications = list(queryset.select_related('status'))
+        for step in steps:
+            with self.subTest(config=dict(step.config) or step.function_id):
+                self.assertFalse(step.error)
+                expected = {application.pk for application in applications if step.check(application)}
+                # Не больше одного запроса (заведомо ложное условие не выполняется вовсе)
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(evaluate_trigger(step, queryset), expected)
+                self.assertLessEqual(len(queries), 1)
+
+    def test_field_comparison(self):
+        direction = Application.objects.get(pk=self.applications[2].pk).direction_id
+        self.assert_matches_python(self.steps('field_comparison', [
+            {'field': 'is_approved', 'operator': '==', 'value': True},
+            {'field': 'is_approved', 'operator': '!=', 'value': 'True'},
+            {'field': 'date_end', 'operator': '==', 'value': None},
+            {'field': 'date_end', 'operator': '!=', 'value': None},
+            {'field': 'date_end', 'operator': '<', 'value': '2100-01-01T00:00:00'},
+            {'field': 'date_sub', 'operator': '>=', 'value': '2000-01-01 00:00'},
+            {'field': 'message', 'operator': '==', 'value': 'Привет'},
+            {'field': 'message', 'operator': '!=', 'value': 'Привет'},
+            {'field': 'direction', 'operator': '==', 'value': direction},
+            {'field': 'direction_id', 'operator': '!=', 'value': direction},
+            {'field': 'direction', 'operator': '>', 'value': None},
+        ]))
+
+    def test_status_and_time(self):
+        self.assert_matches_python(self.steps('status_check', [{'status': 'Одобрена'}, {'status': 'Нет такого'}]))
+        self.assertEqual(evaluate_event_trigger(get_status_plan(self.approved.id, self.event.id).steps[0],
+                                                self.event.id), {self.applications[0].pk})
+
+    def test_time_expiration(self):
+        self.assert_matches_python(self.steps('time_expiration', [
+            {'interval': 'days', 'value': 1},
+            {'interval': 'days', 'value': 5},
+            {'interval': 'hours', 'value': 1, 'field': 'date_end'},
+        ]))
+
+
+class ActionGraphTest(BulkStatusMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.rejected = Status.objects.create(name='Отклонена')
+        self.log = []
+
+    def add_action(self, function, position, type_action, config, depends_on=()):
+        robot = Robot.objects.create(name=type_action, type_action=type_action)
+        action = TriggerAction.objects.create(function_order=function, position=position, robot=robot, config=config)
+        action.depends_on.set(depends_on)
+        return action
+
+    def notification(self, message):
+        return {'chat_id': '1', 'bot_token': 'token', 'message': message}
+
+    async def fake_send(self, applications, config):
+        statuses = await sync_to_async(list)(
+            Application.objects.filter(pk__in=[application.pk for application in applications])
+            .values_list('status__name', flat=True)
+        )
+        self.log.append(('start', config['message'], set(statuses)))
+        await asyncio.sleep(0.2)
+        self.log.append(('end', config['message']))
+        return True, 'ok'
+
+    def run_chain(self):
+        with mock.patch('crm.robots_triggers.send_telegram_notification_batch', new=self.fake_send):
+            started = time.monotonic()
+            self.post([application.id for application in self.applications], self.approved)
+            run_pending_jobs()
+            return time.monotonic() - started
+
+    def test_trigger_actions_graph(self):
+        function = self.add_trigger(1, 'status_check', {'status': 'Одобрена'})
+        first = self.add_action(function, 1, 'notification', self.notification('A'))
+        self.add_action(function, 2, 'notification', self.notification('B'))
+        self.add_action(function, 3, 'notification', self.notification('C'), depends_on=[first])
+        self.add_action(function, 4, 'move_status', {'target_status': 'Отклонена'})
+        self.add_action(function, 5, 'notification', self.notification('D'))
+
+        [step] = get_status_plan(self.approved.id, self.event.id).steps
+        self.assertTrue(step.barrier)
+        self.assertEqual([action.depends_on for action in step.actions], [(), (), (0,), (0, 1, 2), (3,)])
+
+        elapsed = self.run_chain()
+        order = [entry[:2] for entry in self.log]
+        # A и B параллельно, C после A, D после смены статуса
+        self.assertEqual(order[:2], [('start', 'A'), ('start', 'B')])
+        self.assertLess(order.index(('end', 'A')), order.index(('start', 'C')))
+        self.assertEqual(self.log[-2], ('start', 'D', {'Отклонена'}))
+        self.assertEqual(Application.objects.filter(status=self.rejected).count(), 3)
+        # Критический путь A -> C -> (move_status) -> D — 0.6 с, последовательно было бы 0.8 с
+        self.assertLess(elapsed, 0.75)
+
+    def test_status_robots_run_concurrently(self):
+        for position in range(1, 4):
+            self.add_robot(self.status_order, position, 'notification', self.notification(str(position)))
+        elapsed = self.run_chain()
+        self.assertEqual(len(self.log), 6)
+        self.assertLess(elapsed, 0.5)
+
+    @override_settings(AUTOMATION_MAX_PARALLEL=2)
+    def test_parallel_limit_covers_nested_actions(self):
+        running = {'now': 0, 'max': 0}
+
+        async def counting_send(applications, config):
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+            await self.fake_send(applications, config)
+            running['now'] -= 1
+            return True, 'ok'
+
+        self.add_robot(self.status_order, 1, 'notification', self.notification('Статус'))
+        for position in (2, 3):
+            function = self.add_trigger(position, 'status_check', {'status': 'Одобрена'})
+            for action_position in (1, 2):
+                self.add_action(function, action_position, 'notification', self.notification(f'{position}.{action_position}'))
+        with mock.patch('crm.robots_triggers.send_telegram_notification_batch', new=counting_send):
+            self.post([application.id for application in self.applications], self.approved)
+            run_pending_jobs()
+        # Пять роботов в трех графах (статус и два триггера), одновременно — не больше лимита задачи
+        self.assertEqual(len(self.log), 10)
+        self.assertEqual(running['max'], 2)
+
+    def test_forward_dependency_is_rejected(self):
+        function = self.add_trigger(1, 'status_check', {'status': 'Одобрена'})
+        first = self.add_action(function, 1, 'notification', self.notification('A'))
+        second = self.add_action(function, 2, 'notification', self.notification('B'))
+        first.depends_on.add(second)
+        [step] = get_status_plan(self.approved.id, self.event.id).steps
+        self.assertEqual(step.actions[0].error, 'Зависимость от следующего действия #2')
+
+
+class TimeTriggerSchedulerTest(BulkStatusMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.function = self.add_trigger(1, 'time_expiration', {'interval': 'days', 'value': 1})
+        run_pending_jobs()
+
+    def test_status_change_schedules_due_time(self):
+        self.post([application.id for application in self.applications], self.approved)
+        rows = ScheduledTrigger.objects.filter(function_order=self.function)
+        self.assertEqual(rows.count(), 3)
+        due_at = rows.first().due_at
+        self.assertAlmostEqual((due_at - timezone.now()).total_seconds(), 24 * 60 * 60, delta=60)
+
+        # Уход из статуса снимает заявку с расписания
+        application = Application.objects.get(pk=self.applications[0].pk)
+        application.status = self.new
+        application.save()
+        self.assertEqual(rows.count(), 2)
+
+    def test_only_due_rows_are_dispatched(self):
+        self.post([application.id for application in self.applications], self.approved)
+        run_pending_jobs()
+        self.assertEqual(dispatch_due_triggers(), 0)
+
+        past = timezone.now() - datetime.timedelta(days=2)
+        Application.objects.filter(pk=self.applications[0].pk).update(date_sub=past)
+        ScheduledTrigger.objects.filter(application=self.applications[0]).update(due_at=past)
+        self.assertEqual(dispatch_due_triggers(), 1)
+        self.assertEqual(ScheduledTrigger.objects.count(), 2)
+
+        with mock.patch('crm.robots_triggers.check_trigger_batch', new=mock.AsyncMock(return_value=[])) as check:
+            run_pending_jobs()
+        step, applications = check.await_args.args
+        self.assertEqual(step.function_id, self.function.id)
+        self.assertEqual([application.pk for application in applications], [self.applications[0].pk])
+
+    def test_config_change_reschedules(self):
+        self.post([application.id for application in self.applications], self.approved)
+        self.function.config = {'interval': 'hours', 'value': 2}
+        self.function.save()
+        run_pending_jobs()
+        due_at = ScheduledTrigger.objects.filter(function_order=self.function).first().due_at
+        self.assertAlmostEqual((due_at - timezone.now()).total_seconds(), 2 * 60 * 60, delta=60)
+
+
+class AutomationJournalTest(BulkStatusMixin, APITestCase):
+    def test_robots_and_triggers_are_journaled(self):
+        notification = self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        broken = self.add_robot(self.status_order, 2, 'move_status', {'target_status': 'Нет такого'})
+        function = self.add_trigger(3, 'status_check', {'status': 'Одобрена'})
+        robot = Robot.objects.create(name='notification', type_action='notification')
+        action = TriggerAction.objects.create(function_order=function, position=1, robot=robot,
+                                              config={'chat_id': '2', 'bot_token': 'token'})
+        with mock.patch('crm.robots_triggers.send_telegram_notification_batch',
+                        new=mock.AsyncMock(return_value=(True, 'ok'))):
+            self.post([application.id for application in self.applications], self.approved)
+            with CaptureQueriesContext(connection) as queries:
+                run_pending_jobs()
+
+        runs = AutomationRun.objects.all()
+        # Одна запись на выполнение каждого из четырех шагов для пачки из трех заявок, журнал пишется одним INSERT
+        self.assertEqual(runs.count(), 4)
+        self.assertEqual(set(runs.values_list('applications', flat=True)), {3})
+        self.assertEqual(sum('INSERT INTO "crm_automationrun"' in query['sql'] for query in queries), 1)
+        self.assertEqual(set(runs.filter(function_order_id=notification.pk).values_list('outcome', flat=True)),
+                         {AutomationRun.SUCCESS})
+        failed = runs.filter(function_order_id=broken.pk).first()
+        self.assertEqual(failed.outcome, AutomationRun.ERROR)
+        self.assertIn('Нет такого', failed.error)
+        self.assertEqual(runs.filter(function_order_id=function.pk, trigger_action_id=action.pk).count(), 1)
+        self.assertEqual(runs.filter(event_id=self.event.pk).count(), 4)
+
+    def test_stats_endpoint(self):
+        for duration, outcome in [(0.1, AutomationRun.SUCCESS)] * 9 + [(2.0, AutomationRun.ERROR)]:
+            AutomationRun.objects.create(function_order_id=1, applications=2, event_id=self.event.pk,
+                                         type_function='robot', action='notification', duration=duration,
+                                         outcome=outcome)
+        self.client.force_authenticate(self.create_user('student').user)
+        response = self.client.get('/api/automation/stats/')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        response = self.client.get('/api/automation/stats/', {'event': self.event.pk})
+        self.assertEqual(response.status_code, 200)
+        action = response.data['actions'][0]
+        self.assertEqual((action['action'], action['runs'], action['failure_rate']), ('notification', 10, 0.1))
+        self.assertEqual(action['applications'], 20)
+        self.assertEqual((action['p50'], action['p99']), (0.1, 2.0))
+        self.assertEqual(response.data['events'][0]['event'], self.event.pk)
+
+        # Разбивка по действиям и по мероприятиям — по одному запросу независимо от числа групп
+        for event_id in range(100, 110):
+            AutomationRun.objects.create(function_order_id=1, event_id=event_id, type_function='robot',
+                                         action=f'action-{event_id}', duration=0.5, outcome=AutomationRun.SUCCESS)
+        with self.assertNumQueries(2):
+            stats = journal_stats()
+        self.assertEqual(len(stats['events']), 11)
+        self.assertEqual(stats['events'][0], {'event': self.event.pk, 'runs': 10, 'applications': 20, 'failures': 1,
+                                              'failure_rate': 0.1, 'max': 2.0, 'p50': 0.1, 'p95': 2.0, 'p99': 2.0})
+        for hours in ('x', '0', 'nan', 'inf', '1e12'):
+            self.assertEqual(self.client.get('/api/automation/stats/', {'hours': hours}).status_code, 400)
+
+
+class SimulateAutomationTest(BulkStatusMixin, APITestCase):
+    def test_simulation_reports_and_rolls_back(self):
+        self.add_robot(self.status_order, 1, 'notification', {'chat_id': '1', 'bot_token': 'token'})
+        self.add_robot(self.status_order, 2, 'move_status', {'target_status': 'Новая'})
+        applications, jobs, events = Application.objects.count(), Job.objects.count(), Event.objects.count()
+
+        out = StringIO()
+        # Тестовая БД SQLite не рабочая — блокировка записи на время прогона никому не мешает
+        with mock.patch('crm.management.commands.simulate_automation.locks_whole_database', return_value=False):
+            call_command('simulate_automation', self.event.pk, '--status', 'Одобрена', '--applications', '25',
+                         '--batch-size', '10', '--repeat', '1', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['applications'], 25)
+        self.assertEqual(len(report['throughput_runs']), 1)
+        self.assertEqual(report['jobs']['status_functions']['count'], 6)
+        self.assertEqual({step['action']: (step['runs'], step['applications']) for step in report['steps']},
+                         {'move_status': (3, 25), 'notification': (3, 25)})
+        self.assertEqual(report['chains'], {'count': 3, 'avg_hops': 1, 'max_hops': 1, 'aborted': 0})
+        self.assertEqual(report['telegram_requests'], 1)
+        self.assertGreater(report['queries_per_application'], 0)
+
+        self.assertEqual(Application.objects.count(), applications)
+        self.assertEqual(Job.objects.count(), jobs)
+        self.assertEqual(Event.objects.count(), events)
+        self.assertFalse(AutomationRun.objects.exists())
+
+    def test_invalid_arguments(self):
+        for args in (['--concurrency', '0'], ['--database', 'nope'], []):
+            with self.assertRaises(CommandError):
+                call_command('simulate_automation', self.event.pk, *args)
+        # Рабочая БД SQLite не принимается: транзакция прогона заблокировала бы в ней запись
+        with self.assertRaisesRegex(CommandError, '--database'):
+            call_command('simulate_automation', self.event.pk)
+
+    def test_unknown_event(self):
+        with mock.patch('crm.management.commands.simulate_automation.locks_whole_database', return_value=False):
+            with self.assertRaises(CommandError):
+                call_command('simulate_automation', 100500)
+
+
+class StatusCycleTest(BulkStatusMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.new_order = Status_order.objects.create(event=self.event, status=self.new, number=1)
+        self.add_robot(self.status_order, 1, 'move_status', {'target_status': 'Новая'})
+
+    def serializer(self, config):
+        robot = Robot.objects.create(name='move_status', type_action='move_status')
+        return FunctionOrderSerializer(data={'status_order': self.new_order.pk, 'position': 1, 'type_function': 'robot',
+                                             'robot': robot.pk, 'config': config})
+
+    def test_cycle_is_rejected_on_save(self):
+        serializer = self.serializer({'target_status': 'Одобрена'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('Новая → Одобрена → Новая', str(serializer.errors['config']))
+
+        Status.objects.create(name='Отклонена')
+        self.assertTrue(self.serializer({'target_status': 'Отклонена'}).is_valid())
+
+    def test_time_trigger_does_not_close_cycle(self):
+        function = self.add_trigger(2, 'time_expiration', {'interval': 'days', 'value': 1})
+        robot = Robot.objects.create(name='move_status', type_action='move_status')
+        action = TriggerAction(function_order=function, position=1, robot=robot, config={'target_status': 'Новая'})
+        action.clean()
+
+    @override_settings(AUTOMATION_MAX_HOPS=4)
+    def test_runaway_chain_is_aborted(self):
+        # Цикл, созданный в обход валидации: заявки переводятся между статусами до исчерпания бюджета
+        self.add_robot(self.new_order, 1, 'move_status', {'target_status': 'Одобрена'})
+        self.post([application.id for application in self.applications], self.approved)
+        run_pending_jobs()
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 5)
+        aborted = Job.objects.get(status=Job.FAILED)
+        self.assertEqual(aborted.attempts, 1)
+        self.assertEqual(aborted.payload['chain']['hops'], 5)
+        self.assertIn('Цепочка переводов прервана', aborted.last_error)
+        self.assertFalse(Job.objects.filter(status=Job.PENDING).exists())
+
+    @override_settings(AUTOMATION_MAX_CHAIN_SECONDS=60)
+    def test_chain_wall_time_is_limited(self):
+        self.post([application.id for application in self.applications], self.approved)
+        job = Job.objects.get()
+        job.payload['chain']['started'] -= 120
+        job.save()
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(Application.objects.filter(status=self.approved).count(), 3)
+
+
+class FunnelTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('organizer', is_staff=True)
+        self.client.force_authenticate(self.profile.user)
+        self.event = self.create_event()
+        self.direction = Direction.objects.create(event=self.event, name='Направление')
+        self.new = Status.objects.create(name='Новая')
+        self.approved = Status.objects.create(name='Одобрена')
+        Status_order.objects.create(event=self.event, status=self.new, number=1)
+        Status_order.objects.create(event=self.event, status=self.approved, number=2)
+        self.applications = [
+            self.create_application(self.event, self.create_user(f'student-{i}'), self.new, direction=self.direction)
+            for i in range(4)
+        ]
+
+    def steps(self):
+        response = self.client.get(f'/api/events/{self.event.id}/funnel/')
+        return {step['name']: step for step in response.data['steps']}
+
+    def test_counters_follow_changes(self):
+        self.assertEqual(self.steps()['Новая']['count'], 4)
+
+        application = self.applications[0]
+        application.status = self.approved
+        application.save()
+        self.applications[1].delete()
+        self.client.post('/api/application/bulk-status/',
+                         {'applications': [self.applications[2].id], 'status': self.approved.id}, format='json')
+
+        steps = self.steps()
+        self.assertEqual(steps['Новая']['count'], 1)
+        self.assertEqual(steps['Одобрена']['count'], 2)
+        self.assertEqual(steps['Одобрена']['by_direction'], [{'direction': self.direction.id, 'count': 2}])
+        self.assertEqual(verify_funnel(), {})
+
+    def test_rebuild_command(self):
+        FunnelCounter.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_funnel', '--check', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_funnel', stdout=StringIO())
+        self.assertEqual(self.steps()['Новая']['count'], 4)
+
+    def test_event_delete(self):
+        self.event.delete()
+        self.assertFalse(FunnelCounter.objects.exists())
+
+
+class ApplicationFilterTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.event = self.create_event()
+        self.other_event = self.create_event('Другое мероприятие')
+        self.status = Status.objects.create(name='Новая')
+        self.accepted = Status.objects.create(name='Принята')
+        profile = self.create_user('student')
+        Profile.objects.filter(pk=profile.pk).update(name='Студент')
+        self.application = self.create_application(self.event, profile, self.status)
+        self.create_application(self.other_event, profile, self.accepted, is_approved=True)
+        Application.objects.filter(pk=self.application.pk).update(
+            date_sub=datetime.datetime(2025, 1, 10, 23, 30, tzinfo=datetime.timezone.utc)
+        )
+
+    def filter(self, **params):
+        return set(ApplicationFilter(params, queryset=Application.objects.all()).qs.values_list('pk', flat=True))
+
+    def test_filters(self):
+        self.assertEqual(self.filter(event=self.event.pk), {self.application.pk})
+        self.assertEqual(self.filter(status=self.status.pk), {self.application.pk})
+        self.assertEqual(self.filter(status='Новая'), {self.application.pk})
+        self.assertEqual(self.filter(event=self.other_event.pk, is_approved='true'),
+                         set(Application.objects.filter(event=self.other_event).values_list('pk', flat=True)))
+        self.assertEqual(self.filter(event=self.other_event.pk, is_approved='false'), set())
+        self.assertEqual(self.filter(name='Студ'), set(Application.objects.values_list('pk', flat=True)))
+        # Граница дня включается целиком, сравнение идет без функций над колонкой
+        self.assertEqual(self.filter(created_before='2025-01-10'), {self.application.pk})
+        self.assertEqual(self.filter(created_after='2025-01-11', event=self.event.pk), set())
+
+    def test_filters_use_indexes(self):
+        table = Application._meta.db_table
+        combinations = [
+            {'event': self.event.pk},
+            {'event': self.event.pk, 'status': self.status.pk},
+            {'event': self.event.pk, 'is_approved': 'true'},
+            {'event': self.event.pk, 'is_link': 'false'},
+            {'event': self.event.pk, 'created_after': '2025-01-01'},
+            {'status': 'Новая', 'event': self.event.pk},
+            {'project': 1, 'status': self.status.pk},
+            {'team': 1, 'status': self.status.pk},
+            {'specialization': 1, 'status': self.status.pk},
+            {'is_approved': 'true', 'created_after': '2025-01-01'},
+            {'is_link': 'true', 'created_before': '2025-01-01'},
+            {'created_after': '2025-01-01', 'created_before': '2025-01-31'},
+        ]
+        for params in combinations:
+            with self.subTest(params=params):
+                self.assert_filter_uses_index(ApplicationFilter, Application.objects.all(), params, table)
+
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    """Заглушка Bot API: отвечает на sendMessage, первый запрос в чат из server.flood получает 429"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests.append((self.client_address[1], self.path, payload))
+            flooded = payload['chat_id'] in self.server.flood
+            self.server.flood.discard(payload['chat_id'])
+        if flooded:
+            self.respond(429, {'ok': False, 'description': 'Too Many Requests', 'parameters': {'retry_after': 0}})
+        else:
+            self.respond(200, {'ok': True, 'result': {'message_id': len(self.server.requests),
+                                                      'chat': {'id': payload['chat_id']}}})
+
+    def respond(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TelegramClientTest(CrmTestMixin, APITestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), TelegramStubHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.flood = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client_api = TelegramClient(base_url=f'http://127.0.0.1:{self.server.server_port}', bot_token='token',
+                                         global_rate=1000, chat_rate=1000, max_connections=5)
+
+    def test_send_message_api_reuses_connection(self):
+        self.client.force_authenticate(self.create_user('organizer').user)
+        with mock.patch('crm.views.get_telegram_client', return_value=self.client_api):
+            for _ in range(3):
+                response = self.client.post('/api/send-message/', {'chat_id': '1', 'message': 'Привет'},
+                                            format='json')
+                self.assertEqual(response.status_code, 200)
+        ports = {port for port, _, _ in self.server.requests}
+        self.assertEqual(len(ports), 1)
+        self.assertEqual(self.server.requests[0][1], '/bottoken/sendMessage')
+
+    def test_mass_send_retries_after_429(self):
+        chat_ids = [str(chat_id) for chat_id in range(200)]
+        self.server.flood = {'7', '42'}
+
+        async def send():
+            try:
+                return await self.client_api.asend_many(chat_ids, 'Рассылка')
+            finally:
+                await self.client_api.aclose()
+
+        results = async_to_sync(send)()
+        self.assertEqual(set(results), set(chat_ids))
+        self.assertTrue(all(isinstance(result, dict) for result in results.values()))
+        self.assertEqual(len(self.server.requests), len(chat_ids) + 2)
+        # Соединения берутся из пула, а не открываются на каждое сообщение
+        self.assertLessEqual(len({port for port, _, _ in self.server.requests}), 5)
+
+    def test_rate_limits(self):
+        now = [0.0]
+        limiter = RateLimiter(global_rate=30, chat_rate=1, group_rate=20 / 60, clock=lambda: now[0])
+        delays = [limiter.reserve(str(chat_id)) for chat_id in range(31)]
+        self.assertEqual(delays[:30], [0.0] * 30)
+        self.assertAlmostEqual(delays[30], 1 / 30)
+
+        now[0] = 10.0
+        self.assertEqual(limiter.reserve('1'), 0.0)
+        self.assertAlmostEqual(limiter.reserve('1'), 1.0)
+        self.assertEqual(limiter.reserve('-100'), 0.0)
+        self.assertAlmostEqual(limiter.reserve('-100'), 3.0)
+        limiter.pause('2', 5)
+        self.assertAlmostEqual(limiter.reserve('2'), 6.0)
@@ -17,8 +17,13 @@ urlpatterns = [
     path('events/create/', EventAPICreate.as_view()),
     path('events/<int:pk>', EventAPIUpdate.as_view()),
     path('events/delete/<int:pk>', EventAPIDestroy.as_view()),
+    path('events/<int:pk>/applications/export/', ApplicationExportAPI.as_view()),
+    path('events/<int:pk>/funnel/', EventFunnelAPI.as_view()),
     path('application/', ApplicationAPIList.as_view()),
     path('application/create/', ApplicationAPICreate.as_view()),
+    path('application/bulk-status/', ApplicationBulkStatusAPI.as_view()),
+    path('jobs/stats/', JobStatsAPI.as_view()),
+    path('automation/stats/', AutomationStatsAPI.as_view()),
     path('application/<int:pk>', ApplicationAPIUpdate.as_view()),
     path('application/delete/<int:pk>', ApplicationAPIDestroy.as_view()),
     path('profile/', ProfileAPI.as_view()),
@@ -1,23 +1,35 @@
+import datetime
 import json
+import math
 
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.decorators import api_view
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics, viewsets, pagination
 from .serializers import *
 from .models import *
 from .permissions import *
+from .fieldsets import SparseFieldsViewMixin
+from .filters import DayEndFilter, DayStartFilter, IndexedBooleanFilter, filter_by_id_or_name
+from .pagination import KeysetPagination
+from .cache import cached_event_detail
+from .conditional import ConditionalGetMixin
+from .export import stream_applications_csv, stream_applications_ndjson
+from .robots_triggers import bulk_move_applications_status
+from .funnel import event_funnel
+from .jobs import job_stats
+from .journal import JOURNAL_STATS_MAX_HOURS, journal_stats
+from .telegram import TelegramError, get_telegram_client
+from asgiref.sync import async_to_sync
 from django_filters import BaseInFilter
 from django_filters import rest_framework as filters
 from rest_framework.filters import SearchFilter
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from django.contrib.auth import logout, authenticate, login
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-import httpx
-from django.conf import settings
 
 
 class TelegramBotAPI(APIView):
@@ -38,30 +50,20 @@ class TelegramBotAPI(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         data = serializer.validated_data
-        bot_token = settings.TELEGRAM_BOT_TOKEN
 
         try:
-            response = httpx.post(
-                f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                json={
-                    "chat_id": data['chat_id'],
-                    "text": data['message'],
-                    "parse_mode": data['parse_mode']
-                },
-                timeout=10
-            )
-            response.raise_for_status()
+            message = get_telegram_client().send_message(data['chat_id'], data['message'], data['parse_mode'])
 
             return Response({
                 "status": "success",
-                "message_id": response.json()['result']['message_id']
+                "message_id": message['message_id']
             }, status=status.HTTP_200_OK)
 
-        except httpx.HTTPStatusError as e:
+        except TelegramError as e:
             return Response({
                 "status": "error",
-                "detail": f"HTTP error: {e.response.text}"
-            }, status=e.response.status_code)
+                "detail": f"HTTP error: {e.description}"
+            }, status=e.status_code or status.HTTP_502_BAD_GATEWAY)
 
         except Exception as e:
             return Response({
@@ -80,6 +82,11 @@ class EventAPIListPagination(pagination.PageNumberPagination):
     max_page_size = 100
 
 
+class KeysetAPIListPagination(KeysetPagination):
+    page_size = 10
+    legacy_pagination_class = pagination.LimitOffsetPagination
+
+
 class RegisterView(APIView):
     permission_classes = [AllowAny]
 
@@ -113,14 +120,14 @@ def logout_view(request):
     return JsonResponse({'error': 'Only POST'}, status=405)
 
 
-class EventAPIViews(viewsets.ModelViewSet):
+class EventAPIViews(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = (IsAuthenticated,)
 
 
-class EventAPIList(generics.ListAPIView):
-    queryset = Event.objects.all()
+class EventAPIList(ConditionalGetMixin, SparseFieldsViewMixin, generics.ListAPIView):
+    queryset = Event.objects.order_by('id')
     serializer_class = EventSerializer
     permission_classes = (IsAuthenticated,)
     # filter_backends = [SearchFilter]
@@ -136,58 +143,113 @@ class EventAPICreate(generics.CreateAPIView):
         serializer.save(creator=self.request.user.profile)
 
 
-class EventAPIUpdate(generics.RetrieveUpdateAPIView):
+class EventAPIUpdate(ConditionalGetMixin, SparseFieldsViewMixin, generics.RetrieveUpdateAPIView):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = (IsAuthorOrReadOnly,)
 
+    def retrieve(self, request, *args, **kwargs):
+        # Ответ кэшируется по версии мероприятия и сбрасывается сигналами при изменениях
+        def build():
+            return self.get_serializer(self.get_object()).data
+
+        return Response(cached_event_detail(self.kwargs['pk'], request.query_params, build))
+
 
-class EventAPIDestroy(generics.RetrieveDestroyAPIView):
+class EventAPIDestroy(SparseFieldsViewMixin, generics.RetrieveDestroyAPIView):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = (IsAuthorOrReadOnly,)
 
 
-class DirectionAPIViews(viewsets.ModelViewSet):
+class DirectionAPIViews(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Direction.objects.all()
     serializer_class = DirectionSerializer
     permission_classes = (IsAuthenticated,)
 
 
 class ApplicationFilter(filters.FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='icontains')
-    status = filters.CharFilter(field_name='status', lookup_expr='iexact')
+    # Каждый фильтр опирается на индексы Application.Meta.indexes, кроме поиска по подстроке имени
+    name = filters.CharFilter(field_name='user__name', lookup_expr='icontains')
+    event = filters.NumberFilter(field_name='event')
+    status = filters.CharFilter(method='filter_status')  # id или название статуса
+    direction = filters.NumberFilter(field_name='direction')
     # deadline = filters.DateFilter(field_name='deadline')
     # author = filters.NumberFilter(field_name='author__id')  # фильтр по автору
-    created_after = filters.DateFilter(field_name='datetime', lookup_expr='gte')  # начальная дата
-    created_before = filters.DateFilter(field_name='datetime', lookup_expr='lte')  # конечная дата
-    is_approved = filters.BooleanFilter(field_name='is_approved')
-    is_link = filters.BooleanFilter(field_name='is_link')
-    project = filters.NumberFilter(field_name='project__id')
-    team = filters.NumberFilter(field_name='team__id')
-    specialization = filters.NumberFilter(field_name='specialization__id')
+    created_after = DayStartFilter(field_name='date_sub')  # начальная дата
+    created_before = DayEndFilter(field_name='date_sub')  # конечная дата
+    is_approved = IndexedBooleanFilter(field_name='is_approved')
+    is_link = IndexedBooleanFilter(field_name='is_link')
+    project = filters.NumberFilter(field_name='project')
+    team = filters.NumberFilter(field_name='team')
+    specialization = filters.NumberFilter(field_name='specialization')
+
+    def filter_status(self, queryset, name, value):
+        return filter_by_id_or_name(queryset, 'status', value)
 
     class Meta:
         model = Application
-        fields = ['name', 'status', 'created_after', 'created_before', "is_approved", "is_link", "project", "team",
-                  "specialization"]
+        fields = ['name', 'event', 'status', 'direction', 'created_after', 'created_before', "is_approved",
+                  "is_link", "project", "team", "specialization"]
 
 
-class ApplicationAPIViews(viewsets.ModelViewSet):
+class ApplicationAPIViews(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Application.objects.all()
     serializer_class = ApplicationSerializer
     permission_classes = (IsAuthenticated,)
 
 
-class ApplicationAPIList(generics.ListAPIView):
-    queryset = Application.objects.all()
+class ApplicationAPIList(ConditionalGetMixin, SparseFieldsViewMixin, generics.ListAPIView):
+    queryset = Application.objects.order_by('id')
     serializer_class = ApplicationSerializer
     permission_classes = (IsAuthenticated,)
     filterset_class = ApplicationFilter
+    pagination_class = KeysetAPIListPagination
+    # date_sub обновляется при каждом сохранении заявки (auto_now)
+    conditional_markers = ('date_sub',)
+    conditional_models = (Profile, Event, Direction, Specialization, Status)
     # filter_backends = [SearchFilter]
     # search_fields = ['name']
 
 
+class ApplicationExportAPI(APIView):
+    """
+    Потоковая выгрузка всех заявок мероприятия
+    GET /api/events/<pk>/applications/export/?type=csv|ndjson
+    """
+    permission_classes = (IsAuthenticated,)
+    export_types = {
+        'csv': ('text/csv; charset=utf-8', stream_applications_csv),
+        'ndjson': ('application/x-ndjson; charset=utf-8', stream_applications_ndjson),
+    }
+
+    def get(self, request, pk):
+        export_type = request.query_params.get('type', 'csv')
+        if export_type not in self.export_types:
+            return Response({"error": f"Неизвестный формат выгрузки: {export_type}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not Event.objects.filter(pk=pk).exists():
+            return Response({"error": "Event not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        content_type, stream = self.export_types[export_type]
+        response = StreamingHttpResponse(stream(pk), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="event-{pk}-applications.{export_type}"'
+        return response
+
+
+class EventFunnelAPI(APIView):
+    """
+    Воронка заявок мероприятия по шагам Status_order из таблицы счетчиков
+    GET /api/events/<pk>/funnel/
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, pk):
+        if not Event.objects.filter(pk=pk).exists():
+            return Response({"error": "Event not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"event": pk, "steps": event_funnel(pk)})
+
+
 class ApplicationAPICreate(generics.CreateAPIView):
     queryset = Application.objects.all()
     serializer_class = ApplicationCreateSerializer
@@ -203,7 +265,66 @@ class ApplicationAPIUpdate(generics.RetrieveUpdateAPIView):
     permission_classes = (IsAuthorOrReadOnly,)
 
 
-class ApplicationAPIDestroy(generics.RetrieveDestroyAPIView):
+class ApplicationBulkStatusAPI(APIView):
+    """
+    Массовый перевод заявок в статус; роботы статуса выполняются фоновой задачей один раз на пачку
+    POST /api/application/bulk-status/
+    {
+        "applications": [1, 2, 3],
+        "status": 4
+    }
+    Действие организатора: доступно только администраторам
+    """
+    permission_classes = (IsAdminUser,)
+
+    def post(self, request):
+        serializer = ApplicationBulkStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        application_ids = list(dict.fromkeys(data['applications']))
+        results = async_to_sync(bulk_move_applications_status)(application_ids, data['status'])
+        return Response({
+            "status": data['status'].id,
+            "updated": sum(result["success"] for result in results.values()),
+            "results": [{"id": application_id, **result} for application_id, result in results.items()],
+        }, status=status.HTTP_200_OK)
+
+
+class JobStatsAPI(APIView):
+    """
+    Состояние очереди фоновых задач: глубина по состояниям и задержки выполнения
+    GET /api/jobs/stats/
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(job_stats())
+
+
+class AutomationStatsAPI(APIView):
+    """
+    Задержки p50/p95/p99 и доля ошибок роботов и триггеров по журналу автоматизации:
+    по типу действия и по мероприятию
+    GET /api/automation/stats/?hours=24&event=<id>
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        try:
+            hours = float(request.query_params.get('hours', 24))
+            event_id = request.query_params.get('event')
+            event_id = int(event_id) if event_id else None
+        except ValueError:
+            return Response({"error": "Некорректные параметры hours или event"}, status=status.HTTP_400_BAD_REQUEST)
+        if not math.isfinite(hours) or not 0 < hours <= JOURNAL_STATS_MAX_HOURS:
+            return Response({"error": f"Окно hours должно быть от 0 до {JOURNAL_STATS_MAX_HOURS} ч"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(journal_stats(datetime.timedelta(hours=hours), event_id))
+
+
+class ApplicationAPIDestroy(SparseFieldsViewMixin, generics.RetrieveDestroyAPIView):
     queryset = Application.objects.all()
     serializer_class = ApplicationSerializer
     permission_classes = (IsAuthorOrReadOnly,)
@@ -214,13 +335,13 @@ class ApplicationAPIDestroy(generics.RetrieveDestroyAPIView):
 #     serializer_class = App_reviewSerializer
 #     permission_classes = (IsAuthenticated,)
 
-class status_AppAPIViews(viewsets.ModelViewSet):
+class status_AppAPIViews(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Status.objects.all()
     serializer_class = Status_AppSerializer
     permission_classes = (IsAuthenticated,)
 
 
-class SpecializationAPIViews(viewsets.ModelViewSet):
+class SpecializationAPIViews(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Specialization.objects.all()
     serializer_class = SpecializationSerializer
     permission_classes = (IsAuthenticated,)
@@ -232,13 +353,13 @@ class RoleAPIViews(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated,)
 
 
-class ProfileAPIViews(viewsets.ModelViewSet):
+class ProfileAPIViews(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = (IsAuthenticated,)
 
 
-class ProfileAPI(generics.ListAPIView):
+class ProfileAPI(SparseFieldsViewMixin, generics.ListAPIView):
     serializer_class = ProfileSerializer
     permission_classes = (IsAuthenticated,)
 
@@ -256,10 +377,11 @@ class ProfileAPIUpdate(generics.RetrieveUpdateAPIView):
         return Profile.objects.get(user=self.request.user)
 
 
-class ProfilesAPIList(generics.ListAPIView):
+class ProfilesAPIList(ConditionalGetMixin, SparseFieldsViewMixin, generics.ListAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetAPIListPagination
     filter_backends = [SearchFilter]
     search_fields = ['name', 'surname', 'course']
 #
@@ -6,6 +6,7 @@ admin.site.register(Task)
 admin.site.register(Result)
 admin.site.register(Stage)
 admin.site.register(Comment)
+admin.site.register(CommentUpload)
 admin.site.register(Checklist)
 admin.site.register(ChecklistItem)
 admin.site.register(Team)
@@ -5,4 +5,7 @@ class CanbanConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'plan'
 
+    def ready(self):
+        import plan.signals
+
 
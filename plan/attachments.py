@@ -0,0 +1,191 @@
+import fcntl
+import io
+import mimetypes
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from crm.jobs import enqueue_job
+from .models import Comment, CommentUpload
+
+# Размер порции чтения тела запроса при записи части
+UPLOAD_READ_SIZE = 64 * 1024
+
+
+class UploadConflict(Exception):
+    """Часть не продолжает уже полученные данные (повтор или параллельная отправка)"""
+
+
+class PartFile(File):
+    """Собранный файл загрузки: FileSystemStorage переносит его переименованием, без копирования"""
+
+    def __init__(self, file, path):
+        super().__init__(file)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def upload_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, settings.COMMENT_UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def start_upload(upload):
+    """Пустой файл загрузки, в который дописываются части"""
+    path = upload_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Дописывает часть длиной length из потока тела запроса с позиции offset порциями
+    по UPLOAD_READ_SIZE, не держа часть в памяти. Оборванная часть засчитывается
+    в пределах записанного — клиент продолжает с нового смещения.
+    После последней части создается комментарий с вложением.
+
+    Запись идет под исключительной блокировкой файла части (flock), смещение проверяется
+    по строке загрузки уже под ней: из параллельных запросов с одним смещением файл меняет
+    только первый, остальные получают UploadConflict, не трогая записанное. Блокировка строки
+    select_for_update на SQLite не действует, поэтому одной ее недостаточно.
+    """
+    try:
+        part = open(upload_path(upload), 'r+b')
+    except FileNotFoundError:
+        # Загрузка уже завершена параллельным запросом или отменена
+        raise UploadConflict
+    with part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        # Блокировка снимается закрытием файла — после фиксации транзакции с новым смещением
+        with transaction.atomic():
+            locked = CommentUpload.objects.select_for_update().get(pk=upload.pk)
+            upload.received, upload.comment_id = locked.received, locked.comment_id
+            if locked.comment_id is not None or offset != locked.received:
+                raise UploadConflict
+            if offset + length > locked.size:
+                raise ValueError("Часть выходит за объявленный размер файла")
+
+            written = 0
+            part.seek(offset)
+            part.truncate()
+            while written < length:
+                data = stream.read(min(UPLOAD_READ_SIZE, length - written))
+                if not data:
+                    break
+                part.write(data)
+                written += len(data)
+            part.flush()
+
+            upload.received = offset + written
+            CommentUpload.objects.filter(pk=upload.pk).update(received=upload.received, updated_at=timezone.now())
+            if upload.received == upload.size:
+                finish_upload(upload)
+    return written
+
+
+def finish_upload(upload):
+    """Переносит собранный файл в хранилище вложений и создает комментарий"""
+    with transaction.atomic():
+        locked = CommentUpload.objects.select_for_update().get(pk=upload.pk)
+        if locked.comment_id is not None:
+            upload.comment_id = locked.comment_id
+            return locked.comment
+
+        path = upload_path(upload)
+        name = Comment._meta.get_field('file').generate_filename(None, upload.filename)
+        with open(path, 'rb') as assembled:
+            name = default_storage.save(name, PartFile(assembled, path))
+        if os.path.exists(path):
+            # Хранилище скопировало файл вместо переноса
+            os.remove(path)
+        comment = Comment.objects.create(task_id=upload.task_id, author_id=upload.author_id,
+                                         content=upload.content, file=name, file_size=upload.size)
+        locked.comment = comment
+        locked.save(update_fields=['comment', 'updated_at'])
+        schedule_attachment(comment)
+    upload.comment = comment
+    return comment
+
+
+def cancel_upload(upload):
+    if os.path.exists(upload_path(upload)):
+        os.remove(upload_path(upload))
+    upload.delete()
+
+
+def purge_uploads(older_than):
+    """Удаляет загрузки, не менявшиеся с older_than, вместе с файлами незавершенных"""
+    uploads = CommentUpload.objects.filter(updated_at__lt=older_than)
+    for upload in uploads.filter(comment=None).iterator():
+        if os.path.exists(upload_path(upload)):
+            os.remove(upload_path(upload))
+    deleted, _ = uploads.delete()
+    return deleted
+
+
+def schedule_attachment(comment):
+    """Ставит в очередь обработку вложения: размер, тип, размеры и миниатюра изображения"""
+    return enqueue_job('comment_attachment', {'comment': comment.pk}, key=f'comment_attachment:{comment.pk}')
+
+
+def encode_thumbnail(image):
+    """Миниатюра в PNG для изображений с прозрачностью, иначе в JPEG; возвращает байты и расширение"""
+    buffer = io.BytesIO()
+    if 'A' in image.getbands() or 'transparency' in image.info:
+        image.convert('RGBA').save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue(), 'png'
+    image.convert('RGB').save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue(), 'jpg'
+
+
+def describe_attachment(name):
+    """
+    Размер и сведения о файле вложения, для изображений — размеры и миниатюра.
+    Не обращается к БД: выполняется в пуле потоков, Pillow отпускает GIL при декодировании.
+    """
+    meta = {'content_type': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+    thumbnail = None
+    try:
+        with default_storage.open(name) as source, Image.open(source) as image:
+            meta.update(format=image.format, width=image.width, height=image.height)
+            # thumbnail() декодирует JPEG сразу в уменьшенном масштабе (draft)
+            image.thumbnail(settings.COMMENT_THUMBNAIL_SIZE)
+            thumbnail = encode_thumbnail(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        # Не изображение или поврежденный файл — остаются только размер и тип
+        pass
+    return default_storage.size(name), meta, thumbnail
+
+
+def save_attachment_meta(comment_id, size, meta, thumbnail):
+    comment = Comment.objects.filter(pk=comment_id).first()
+    if comment is None:
+        return
+    if thumbnail is not None:
+        data, extension = thumbnail
+        if comment.thumbnail:
+            comment.thumbnail.delete(save=False)
+        stem = os.path.splitext(os.path.basename(comment.file.name))[0]
+        comment.thumbnail.save(f'{stem}.{extension}', ContentFile(data), save=False)
+    comment.file_size, comment.file_meta = size, meta
+    comment.save(update_fields=['file_size', 'file_meta', 'thumbnail', 'updated_at'])
+
+
+async def process_comment_attachment_job(payload):
+    """Обработчик задачи очереди comment_attachment"""
+    name = await sync_to_async(
+        Comment.objects.filter(pk=payload['comment']).values_list('file', flat=True).first
+    )()
+    if not name:
+        return
+    # Чтение и масштабирование — в пуле потоков, а не в общем потоке обращений к БД
+    size, meta, thumbnail = await sync_to_async(describe_attachment, thread_sensitive=False)(name)
+    await sync_to_async(save_attachment_meta)(payload['comment'], size, meta, thumbnail)
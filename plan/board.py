@@ -0,0 +1,53 @@
+from django.db.models import Count, F, Q
+from django.db.models.expressions import RawSQL, Window
+from django.db.models.functions import RowNumber
+
+from .models import Stage, Task
+
+# Порядок задач в колонке доски (ключи позиций — plan/ranking.py)
+BOARD_TASK_ORDERING = ('rank', 'id')
+
+
+def board_task_ids(project_id, limit):
+    """
+    Подзапрос id первых limit задач каждого этапа проекта: нумерация ROW_NUMBER() по этапу
+    строится ORM, отбор по номеру — оберткой (фильтр по оконной функции в ORM недоступен).
+    """
+    ranked = Task.objects.filter(project_id=project_id).annotate(
+        board_row=Window(RowNumber(), partition_by=[F('status_id')], order_by=[F(name) for name in BOARD_TASK_ORDERING])
+    ).values('id', 'board_row')
+    sql, params = ranked.query.sql_with_params()
+    return RawSQL(f'SELECT ranked.id FROM ({sql}) ranked WHERE ranked.board_row <= %s', (*params, limit))
+
+
+def checklist_progress(prefix=''):
+    """Число пунктов чек-листов и выполненных пунктов (prefix — путь от модели запроса к задаче)"""
+    item = f'{prefix}checklist__checklistitem'
+    return {
+        'checklist_total': Count(item, distinct=True),
+        'checklist_done': Count(item, filter=Q(**{f'{item}__is_completed': True}), distinct=True),
+    }
+
+
+def project_board(project, limit):
+    """
+    Доска проекта: этапы с числом задач и прогрессом чек-листов по всем задачам этапа
+    и первые limit задач каждого этапа. Два запроса независимо от числа этапов и задач.
+    """
+    stages = list(
+        Stage.objects.filter(project=project).annotate(tasks_count=Count('task', distinct=True),
+                                                       **checklist_progress('task__')).order_by('id')
+    )
+    tasks = (
+        Task.objects.filter(pk__in=board_task_ids(project.pk, limit)).select_related('responsible_user')
+        .annotate(subtasks_count=Count('subtasks', distinct=True), **checklist_progress())
+        .order_by(*BOARD_TASK_ORDERING)
+    )
+    by_stage = {stage.pk: [] for stage in stages}
+    for task in tasks:
+        # Этап другого проекта (рассогласованные данные) на доску не попадает
+        if task.status_id in by_stage:
+            by_stage[task.status_id].append(task)
+    for stage in stages:
+        stage.board_tasks = by_stage[stage.pk]
+    return stages
@@ -0,0 +1,54 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plan', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checklist',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='checklistitem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата изменения записи'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def fill_task_paths(apps, schema_editor):
+    Task = apps.get_model('plan', 'Task')
+    parents = dict(Task.objects.values_list('pk', 'parent_task_id'))
+    paths = {}
+
+    def path_of(task_id):
+        if task_id not in paths:
+            parent_id = parents[task_id]
+            paths[task_id] = (path_of(parent_id) if parent_id else '') + f'{task_id:010d}/'
+        return paths[task_id]
+
+    tasks = []
+    for task_id in parents:
+        path = path_of(task_id)
+        tasks.append(Task(pk=task_id, path=path, depth=path.count('/') - 1))
+    Task.objects.bulk_update(tasks, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plan', '0003_task_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='Путь в дереве задач'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, verbose_name='Уровень вложенности'),
+        ),
+        migrations.RunPython(fill_task_paths, migrations.RunPython.noop),
+    ]
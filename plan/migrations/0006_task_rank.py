@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+RANK_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def spread_ranks(count):
+    # Копия plan.models.spread_ranks на момент миграции
+    base = len(RANK_DIGITS)
+    width = 3
+    while base ** width < (count + 1) * base * 2:
+        width += 1
+    step = base ** width // ((count + 1) * 2)
+    ranks = []
+    for number in range(1, count + 1):
+        value, digits = number * step, []
+        for _ in range(width):
+            value, digit = divmod(value, base)
+            digits.append(RANK_DIGITS[digit])
+        ranks.append(''.join(reversed(digits)).rstrip('0'))
+    return ranks
+
+
+def fill_task_ranks(apps, schema_editor):
+    # Исходный порядок колонок — прежний порядок доски (по дате создания)
+    Task = apps.get_model('plan', 'Task')
+    columns = {}
+    for task_id, stage_id in Task.objects.order_by('start', 'id').values_list('pk', 'status_id'):
+        columns.setdefault(stage_id, []).append(task_id)
+    tasks = []
+    for task_ids in columns.values():
+        tasks.extend(Task(pk=task_id, rank=rank) for task_id, rank in zip(task_ids, spread_ranks(len(task_ids))))
+    Task.objects.bulk_update(tasks, ['rank'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plan', '0005_task_project_depth_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='rank',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Позиция в колонке'),
+        ),
+        migrations.RunPython(fill_task_ranks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'rank'], name='task_status_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_notification_outbox'),
+        ('plan', '0006_task_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='file_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Размер файла'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='file_meta',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Сведения о файле'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='thumbnail',
+            field=models.FileField(blank=True, null=True, upload_to='comments/thumbnails', verbose_name='Миниатюра'),
+        ),
+        migrations.CreateModel(
+            name='CommentUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер файла')),
+                ('received', models.PositiveBigIntegerField(default=0, verbose_name='Получено байт')),
+                ('content', models.TextField(blank=True, default='', max_length=10000, verbose_name='Текст комментария')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения записи')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm.profile')),
+                ('comment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='plan.comment', verbose_name='Созданный комментарий')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='plan.task')),
+            ],
+        ),
+    ]
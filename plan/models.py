@@ -1,12 +1,108 @@
-from django.db import models
+import operator
+from functools import reduce
+
+from django.db import models, transaction
+from django.db.models import F, Max, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.utils.termcolors import RESET
 from crm.models import Profile, Direction
 
+# Ширина сегмента материализованного пути задачи: id, дополненный нулями,
+# чтобы лексикографический порядок путей совпадал с порядком обхода дерева
+TASK_PATH_WIDTH = 10
+TASK_PATH_MAX_LENGTH = 255
+# Наибольший уровень вложенности, путь которого помещается в Task.path
+TASK_MAX_DEPTH = TASK_PATH_MAX_LENGTH // (TASK_PATH_WIDTH + 1) - 1
+
+
+def task_path_segment(task_id):
+    return f'{task_id:0{TASK_PATH_WIDTH}d}/'
+
+
+def task_path_ids(path):
+    """Id задач пути от корня до самой задачи"""
+    return [int(segment) for segment in path.split('/') if segment]
+
+
+# Цифры ключей позиции задачи в колонке. Ключ — дробная часть числа в этой системе счисления
+# без завершающих нулей: порядок ключей как строк совпадает с порядком чисел, и между любыми
+# двумя ключами есть третий. Только цифры и строчные буквы — порядок одинаков в Python и в БД.
+RANK_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+# Минимальная ширина ключа при добавлении в начало и конец колонки: соседние задачи получают
+# ключи, отличающиеся на единицу в последнем разряде, и ключ удлиняется лишь после 36 ** 3 вставок
+RANK_STEP_WIDTH = 3
+
+
+def rank_number(rank, width):
+    """Ключ как целое число из width разрядов"""
+    value = 0
+    for position in range(width):
+        value = value * len(RANK_DIGITS) + (RANK_DIGITS.index(rank[position]) if position < len(rank) else 0)
+    return value
+
+
+def number_rank(value, width):
+    """Целое число из width разрядов как ключ (без завершающих нулей)"""
+    digits = []
+    for _ in range(width):
+        value, digit = divmod(value, len(RANK_DIGITS))
+        digits.append(RANK_DIGITS[digit])
+    return ''.join(reversed(digits)).rstrip('0')
+
+
+def rank_between(before=None, after=None):
+    """Ключ строго между ключами before и after; None — начало или конец колонки"""
+    before = before or ''
+    if after is not None and before >= after:
+        raise ValueError("Ключ before должен быть меньше ключа after")
+    if before and after is None:
+        width = max(len(before), RANK_STEP_WIDTH)
+        value = rank_number(before, width) + 1
+        return number_rank(value, width) if value < len(RANK_DIGITS) ** width else before + RANK_DIGITS[1]
+    if not before and after is not None:
+        width = max(len(after), RANK_STEP_WIDTH)
+        value = rank_number(after, width) - 1
+        if value > 0:
+            return number_rank(value, width)
+
+    # Середина интервала: общий префикс и средняя цифра в первом разряде, где между ключами есть место
+    rank = ''
+    position = 0
+    while True:
+        low = RANK_DIGITS.index(before[position]) if position < len(before) else 0
+        if after is None:
+            high = len(RANK_DIGITS)
+        else:
+            high = RANK_DIGITS.index(after[position]) if position < len(after) else 0
+        if high - low > 1:
+            return rank + RANK_DIGITS[(low + high) // 2]
+        rank += RANK_DIGITS[low]
+        if high > low:
+            # Ключ уже меньше after, дальше ограничение только снизу
+            after = None
+        position += 1
+
+
+def spread_ranks(count):
+    """
+    count возрастающих ключей одной ширины, равномерно распределенных по нижней половине
+    колонки: верхняя половина остается под добавление задач в конец
+    """
+    base = len(RANK_DIGITS)
+    width = RANK_STEP_WIDTH
+    while base ** width < (count + 1) * base * 2:
+        width += 1
+    step = base ** width // ((count + 1) * 2)
+    return [number_rank(number * step, width) for number in range(1, count + 1)]
+
 
 class Project(models.Model):
     direction = models.ForeignKey(Direction, on_delete=models.CASCADE)
     name = models.CharField(verbose_name="Название проекта", max_length=100)
     description = models.TextField(verbose_name="Описание", max_length=10000, null=True, blank=True)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.name}'
@@ -24,6 +120,7 @@ class Team(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True)
     students = models.ManyToManyField(Profile, blank=True, related_name="teams")
     is_agreed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.name}'
@@ -32,11 +129,32 @@ class Team(models.Model):
 class Stage(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="stages")
     name = models.CharField(verbose_name="Название этапа", max_length=255)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
 
+class TaskQuerySet(models.QuerySet):
+    def subtrees(self, tasks, levels=None):
+        """
+        Задачи tasks вместе с потомками — один запрос по префиксам материализованных путей.
+        levels ограничивает поддерево каждой задачи указанным числом уровней под ней.
+        """
+        conditions = []
+        last_prefix = None
+        for task in sorted((task for task in tasks if task.path), key=lambda task: task.path):
+            if levels is not None:
+                conditions.append(Q(path__startswith=task.path, depth__lte=task.depth + levels))
+            # Поддерево, вложенное в уже выбранное, отдельного условия не требует
+            elif last_prefix is None or not task.path.startswith(last_prefix):
+                conditions.append(Q(path__startswith=task.path))
+                last_prefix = task.path
+        if not conditions:
+            return self.none()
+        return self.filter(reduce(operator.or_, conditions)).order_by('path')
+
+
 class Task(models.Model):
     creator = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="tasks_creators",
                                 verbose_name="Создатель задачи")
@@ -55,15 +173,100 @@ class Task(models.Model):
         null=True,
         verbose_name="Родительская задача",
     )
+    # Материализованный путь: сегменты id предков и самой задачи ("0000000001/0000000007/")
+    path = models.CharField(verbose_name="Путь в дереве задач", max_length=TASK_PATH_MAX_LENGTH, blank=True, default='',
+                            db_index=True)
+    depth = models.PositiveIntegerField(verbose_name="Уровень вложенности", default=0)
+    # Позиция в колонке этапа (RANK_DIGITS): перемещение задачи меняет только ее собственный ключ
+    rank = models.CharField(verbose_name="Позиция в колонке", max_length=255, blank=True, default='')
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
+
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        # Индексы под комбинации TaskFilter (проверяются планами запросов в plan/tests.py)
+        indexes = [
+            models.Index(fields=['project', 'status'], name='task_project_status_idx'),
+            models.Index(fields=['project', 'responsible_user'], name='task_project_resp_idx'),
+            models.Index(fields=['project', 'start'], name='task_project_start_idx'),
+            models.Index(fields=['project', 'depth'], name='task_project_depth_idx'),
+            models.Index(fields=['status', 'rank'], name='task_status_rank_idx'),
+            models.Index(fields=['responsible_user', 'status'], name='task_resp_status_idx'),
+            models.Index(fields=['creator', 'status'], name='task_creator_status_idx'),
+            models.Index(fields=['start'], name='task_start_idx'),
+            models.Index(fields=['end'], name='task_end_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        task = super().from_db(db, field_names, values)
+        # Этап на момент загрузки: задача, перенесенная в другой этап, встает в конец его колонки
+        task._loaded_status_id = task.__dict__.get('status_id')
+        # Родитель на момент загрузки: при переносе задачи отметка изменения поднимается и у прежнего
+        task._loaded_parent_task_id = task.__dict__.get('parent_task_id')
+        return task
+
+    def save(self, *args, **kwargs):
+        # Путь включает id задачи, поэтому пишется после вставки в той же транзакции
+        with transaction.atomic():
+            moved = getattr(self, '_loaded_status_id', None) not in (None, self.status_id)
+            if not self.rank or moved:
+                self.rank = self.append_rank()
+                if kwargs.get('update_fields') is not None:
+                    kwargs['update_fields'] = {*kwargs['update_fields'], 'rank'}
+            super().save(*args, **kwargs)
+            self._loaded_status_id, self._loaded_parent_task_id = self.status_id, self.parent_task_id
+            self.update_path()
+
+    def append_rank(self):
+        """Ключ конца колонки этапа для новой задачи; слишком длинный ключ ставит перенумерацию колонки"""
+        from .ranking import TASK_RANK_REBALANCE_LENGTH, schedule_rebalance
+
+        last = Task.objects.filter(status_id=self.status_id).exclude(pk=self.pk).order_by('-rank')
+        rank = rank_between(last.values_list('rank', flat=True).first(), None)
+        if len(rank) > TASK_RANK_REBALANCE_LENGTH:
+            schedule_rebalance(self.status_id)
+        return rank
+
+    def subtree_height(self, path=None):
+        """Число уровней подзадач под задачей с путем path (0 — нет подзадач или задача еще не сохранена)"""
+        path = self.path if path is None else path
+        if not path:
+            return 0
+        depth = len(task_path_ids(path)) - 1
+        deepest = Task.objects.filter(path__startswith=path).aggregate(deepest=Max('depth'))['deepest']
+        return (deepest if deepest is not None else depth) - depth
+
+    def update_path(self):
+        """Пересчет пути задачи; при смене родителя поддерево переносится одним UPDATE"""
+        stored = dict(Task.objects.filter(pk__in=[self.pk, self.parent_task_id]).values_list('pk', 'path'))
+        parent_path = stored.get(self.parent_task_id, '') if self.parent_task_id else ''
+        old_path = stored.get(self.pk, '')
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError("Задача не может стать подзадачей собственной подзадачи")
+
+        path = parent_path + task_path_segment(self.pk)
+        depth = len(task_path_ids(path)) - 1
+        if path != old_path and depth + self.subtree_height(old_path) > TASK_MAX_DEPTH:
+            raise ValueError(f"Превышена наибольшая вложенность задач ({TASK_MAX_DEPTH})")
+        if path != old_path:
+            Task.objects.filter(pk=self.pk).update(path=path, depth=depth)
+            if old_path:
+                Task.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + depth - (len(task_path_ids(old_path)) - 1),
+                )
+        self.path, self.depth = path, depth
+
 
 class Checklist(models.Model):
     task = models.ForeignKey(Task, related_name="checklist", on_delete=models.CASCADE)
     name = models.TextField(verbose_name="Описание пункта", max_length=500)
     description = models.TextField(verbose_name="Описание пункта", max_length=500)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.description}"
@@ -73,6 +276,7 @@ class ChecklistItem(models.Model):
     checklist = models.ForeignKey(Checklist, on_delete=models.CASCADE)
     description = models.TextField(verbose_name="Описание пункта", max_length=500)
     is_completed = models.BooleanField(verbose_name="Выполнено", default=False)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.description} - {'Выполнено' if self.is_completed else 'Не выполнено'}"
@@ -83,3 +287,28 @@ class Comment(models.Model):
     author = models.ForeignKey(Profile, on_delete=models.CASCADE)
     content = models.TextField(verbose_name="Текст", max_length=10000)
     file = models.FileField(verbose_name="Файл", upload_to="comments", null=True, blank=True)
+    # Заполняются фоновой обработкой вложения (plan/attachments.py)
+    file_size = models.PositiveBigIntegerField(verbose_name="Размер файла", null=True, blank=True)
+    file_meta = models.JSONField(verbose_name="Сведения о файле", default=dict, blank=True)
+    thumbnail = models.FileField(verbose_name="Миниатюра", upload_to="comments/thumbnails", null=True, blank=True)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
+
+
+class CommentUpload(models.Model):
+    """
+    Загрузка вложения комментария частями (plan/attachments.py). Части пишутся подряд
+    в файл в MEDIA_ROOT; после последней части файл становится вложением нового комментария.
+    """
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="uploads")
+    author = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    filename = models.CharField(verbose_name="Имя файла", max_length=255)
+    size = models.PositiveBigIntegerField(verbose_name="Размер файла")
+    received = models.PositiveBigIntegerField(verbose_name="Получено байт", default=0)
+    content = models.TextField(verbose_name="Текст комментария", max_length=10000, blank=True, default='')
+    comment = models.OneToOneField(Comment, on_delete=models.SET_NULL, null=True, blank=True,
+                                   verbose_name="Созданный комментарий")
+    created_at = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения записи", auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
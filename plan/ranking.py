@@ -0,0 +1,90 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from crm.jobs import enqueue_job
+from .models import Task, rank_between, spread_ranks
+from .signals import touch_tasks
+
+# Длина ключа, после которой колонка перенумеровывается в фоне
+# (ключи удлиняются при многократных вставках между одними и теми же задачами)
+TASK_RANK_REBALANCE_LENGTH = 32
+
+
+def column(stage_id, exclude_pk):
+    return Task.objects.filter(status_id=stage_id).exclude(pk=exclude_pk)
+
+
+def next_task(stage_id, task, exclude_pk):
+    """Задача колонки, следующая за task в порядке (rank, id)"""
+    return (
+        column(stage_id, exclude_pk).filter(Q(rank__gt=task.rank) | Q(rank=task.rank, pk__gt=task.pk))
+        .order_by('rank', 'id').first()
+    )
+
+
+def previous_task(stage_id, task, exclude_pk):
+    """Задача колонки, предшествующая task в порядке (rank, id)"""
+    return (
+        column(stage_id, exclude_pk).filter(Q(rank__lt=task.rank) | Q(rank=task.rank, pk__lt=task.pk))
+        .order_by('-rank', '-id').first()
+    )
+
+
+def move_rank(task, stage_id, after=None, before=None):
+    """
+    Ключ позиции task в колонке stage_id между задачами after (выше) и before (ниже).
+    Если указан один сосед, второй — соседняя с ним задача колонки; без соседей — конец колонки.
+    """
+    if after is None and before is None:
+        return rank_between(column(stage_id, task.pk).order_by('-rank').values_list('rank', flat=True).first())
+    if before is None:
+        before = next_task(stage_id, after, task.pk)
+    elif after is None:
+        after = previous_task(stage_id, before, task.pk)
+    if after is not None and before is not None and after.rank >= before.rank:
+        # Соседи с одинаковыми ключами (гонка параллельных перемещений) —
+        # колонка перенумеровывается сразу, это единственный случай записи больше одной строки
+        rebalance_stage(stage_id)
+        ranks = dict(Task.objects.filter(pk__in=[after.pk, before.pk]).values_list('pk', 'rank'))
+        after.rank, before.rank = ranks[after.pk], ranks[before.pk]
+    return rank_between(after.rank if after else None, before.rank if before else None)
+
+
+def move_task(task, stage, after=None, before=None):
+    """
+    Переносит задачу в этап stage между задачами after и before одним UPDATE ее строки.
+    Слишком длинный ключ ставит фоновую перенумерацию колонки.
+    """
+    with transaction.atomic():
+        rank = move_rank(task, stage.pk, after, before)
+        now = timezone.now()
+        Task.objects.filter(pk=task.pk).update(status=stage, rank=rank, updated_at=now)
+        if len(rank) > TASK_RANK_REBALANCE_LENGTH:
+            schedule_rebalance(stage.pk)
+        # Подзадача сериализуется внутри родителя — его отметка изменения тоже поднимается
+        touch_tasks(task.parent_task_id)
+    task.status, task.rank, task.updated_at = stage, rank, now
+    return task
+
+
+def schedule_rebalance(stage_id):
+    return enqueue_job('rebalance_task_ranks', {'stage': stage_id}, key=f'rebalance_task_ranks:{stage_id}')
+
+
+def rebalance_stage(stage_id):
+    """Равномерная перенумерация ключей колонки с сохранением порядка задач"""
+    with transaction.atomic():
+        tasks = list(
+            Task.objects.select_for_update().filter(status_id=stage_id).order_by('rank', 'id').only('pk', 'rank')
+        )
+        for task, rank in zip(tasks, spread_ranks(len(tasks))):
+            task.rank = rank
+        Task.objects.bulk_update(tasks, ['rank'], batch_size=1000)
+    return len(tasks)
+
+
+async def rebalance_task_ranks_job(payload):
+    """Обработчик задачи очереди rebalance_task_ranks"""
+    await sync_to_async(rebalance_stage)(payload['stage'])
@@ -1,17 +1,23 @@
+import os
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import Count
 from rest_framework import serializers
+from crm.fieldsets import SparseFieldsMixin
 from crm.models import Profile
 from crm.serializers import ProfileSerializer, DirectionSerializer
 from .models import *
 
 
-class CheckListItemSerializer(serializers.ModelSerializer):
+class CheckListItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ChecklistItem
         fields = ['id', 'description', 'is_completed']
 
 
-class CheckListSerializer(serializers.ModelSerializer):
+class CheckListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     checklistItems = CheckListItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -19,67 +25,270 @@ class CheckListSerializer(serializers.ModelSerializer):
         fields = ['id', 'checklistItems', 'description']
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = '__all__'
+        exclude = ['updated_at']
+        # Заполняются фоновой обработкой вложения (plan/attachments.py)
+        read_only_fields = ['file_size', 'file_meta', 'thumbnail']
+
+
+class CommentUploadSerializer(serializers.ModelSerializer):
+    """Загрузка вложения частями: offset — число уже полученных байт, с него продолжается отправка"""
+    offset = serializers.IntegerField(source='received', read_only=True)
+
+    class Meta:
+        model = CommentUpload
+        fields = ['id', 'task', 'filename', 'size', 'offset', 'content', 'comment', 'created_at']
+        read_only_fields = ['task', 'comment']
+
+    def validate_filename(self, value):
+        filename = os.path.basename(value.replace('\\', '/'))
+        if not filename:
+            raise serializers.ValidationError("Пустое имя файла")
+        return filename
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.COMMENT_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Размер файла должен быть от 1 до {settings.COMMENT_UPLOAD_MAX_SIZE} байт")
+        return value
 
 
 class ProjectCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
 class TeamCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Team
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
-class StageSerializer(serializers.ModelSerializer):
+class StageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Stage
         fields = ['id', 'name']
 
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     stages = StageSerializer(many=True, read_only=True)
     direction = serializers.PrimaryKeyRelatedField(queryset=Direction.objects.all(), write_only=True, required=True)
     directionSet = DirectionSerializer(source="direction", read_only=True)
     project_id = serializers.IntegerField(read_only=True, source="id")
 
+    select_related_fields = {
+        'directionSet': ['direction'],
+    }
+    prefetch_related_fields = {
+        'stages': ['stages'],
+    }
+
     class Meta:
         model = Project
         fields = ['id', 'stages', 'direction', 'directionSet', 'project_id', 'name', 'description']
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # students = ProfileSerializer(many=True, read_only=True)
     students = serializers.PrimaryKeyRelatedField(many=True, queryset=Profile.objects.all())
 
+    prefetch_related_fields = {
+        'students': ['students'],
+    }
+
     class Meta:
         model = Team
-        fields = '__all__'
+        exclude = ['updated_at']
+
+
+def load_task_forest(serializer, tasks):
+    """
+    Загрузка поддеревьев задач для сериализатора: один запрос по материализованным путям
+    (плюс prefetch выбранных полей) на все задачи сразу, связи родитель-потомок строятся в памяти.
+    Дерево хранится в контексте и общее для всех вложенных сериализаторов.
+
+    При ограничении глубины (контекст task_levels) загружается task_levels уровней под задачами,
+    для задач нижнего уровня одним агрегирующим запросом считается число подзадач.
+    """
+    if 'subtasks' not in serializer.fields and 'subtasks_count' not in serializer.fields:
+        return
+    levels = serializer.context.get('task_levels')
+    if levels is not None:
+        # Уровни, оставшиеся до ограничения на текущей глубине вложенности ответа
+        levels = max(levels - serializer.context.get('task_level', 0), 0)
+    forest = serializer.context.setdefault('task_forest', {'limits': {}, 'children': {}, 'counts': {}})
+    limits = forest['limits']
+
+    def limit_for(task):
+        return float('inf') if levels is None else task.depth + levels
+
+    missing = [task for task in tasks if limits.get(task.pk, -1) < limit_for(task)]
+    if not missing:
+        return
+    queryset = serializer.setup_eager_loading(Task.objects.subtrees(missing, levels), list(serializer.fields))
+    roots = {task.pk: limit_for(task) for task in missing}
+    truncated = []
+    for task in queryset:
+        # Пути упорядочены, поэтому родитель из того же поддерева уже обработан
+        if task.parent_task_id in limits:
+            forest['children'].setdefault(task.parent_task_id, {})[task.pk] = task
+        # Поддерево задачи загружено до глубины ее собственного ограничения или ограничения предка
+        limits[task.pk] = max(roots.get(task.pk, -1), limits.get(task.parent_task_id, -1), limits.get(task.pk, -1))
+        if task.depth >= limits[task.pk]:
+            truncated.append(task.pk)
+
+    if truncated:
+        counts = Task.objects.filter(parent_task__in=truncated).values_list('parent_task').annotate(total=Count('pk'))
+        forest['counts'].update({task_id: 0 for task_id in truncated})
+        forest['counts'].update(counts.order_by())
+
+
+def task_children(context, task):
+    """Загруженные подзадачи задачи или None, если они не загружены из-за ограничения глубины"""
+    forest = context['task_forest']
+    if task.depth >= forest['limits'][task.pk]:
+        return None
+    return list(forest['children'].get(task.pk, {}).values())
+
+
+class TaskListSerializer(serializers.ListSerializer):
+    """Список задач, поддеревья которых загружаются до сериализации одним запросом"""
+
+    def to_representation(self, data):
+        tasks = list(data.all() if isinstance(data, models.Manager) else data)
+        load_task_forest(self.child, tasks)
+        return super().to_representation(tasks)
 
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     creator = ProfileSerializer(read_only=True)
     checklist = CheckListSerializer(many=True, required=False)
     comment_set = CommentSerializer(many=True, read_only=True)
     resp_user = ProfileSerializer(read_only=True, source='responsible_user')
     project_info = ProjectSerializer(read_only=True, source='project')
     subtasks = serializers.SerializerMethodField()
+    subtasks_count = serializers.SerializerMethodField()
+    subtasks_url = serializers.SerializerMethodField()
     stage = serializers.CharField(source='stage.name', read_only=True)
 
+    select_related_fields = {
+        'creator': ['creator'],
+        'resp_user': ['responsible_user'],
+        'project_info': ['project__direction'],
+    }
+    prefetch_related_fields = {
+        'checklist': ['checklist'],
+        'project_info': ['project__stages'],
+    }
+
     class Meta:
         model = Task
+        list_serializer_class = TaskListSerializer
         fields = [
             'id', 'project', 'name', 'start', 'end', 'description', 'creator', 'status', 'comment_set', 'parent_task',
-            'responsible_user', 'checklist', 'resp_user', 'project_info', 'subtasks', 'stage'
+            'responsible_user', 'checklist', 'resp_user', 'project_info', 'subtasks', 'subtasks_count',
+            'subtasks_url', 'stage'
         ]
 
+    def validate(self, data):
+        parent = data.get('parent_task')
+        if self.instance is not None and parent is not None and self.instance.path \
+                and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError({'parent_task': "Задача не может стать подзадачей собственной подзадачи"})
+        # Путь задачи и ее поддерева должен поместиться в Task.path
+        if parent is not None:
+            height = self.instance.subtree_height() if self.instance is not None else 0
+            if parent.depth + 1 + height > TASK_MAX_DEPTH:
+                raise serializers.ValidationError(
+                    {'parent_task': f"Превышена наибольшая вложенность задач ({TASK_MAX_DEPTH})"}
+                )
+        return data
+
     def get_subtasks(self, obj):
-        """Метод для получения подзадач"""
-        subtasks = obj.subtasks.all()  # Доступ к подзадачам через related_name
-        return TaskSerializer(subtasks, many=True).data  # Сериализуем подзадачи
+        """
+        Подзадачи из дерева, загруженного одним запросом (load_task_forest).
+        Ниже task_levels уровней от задач ответа возвращается None: подзадачи раскрываются по subtasks_url.
+        """
+        level = self.context.get('task_level', 0)
+        levels = self.context.get('task_levels')
+        if levels is not None and level >= levels:
+            return None
+        load_task_forest(self, [obj])
+        return TaskSerializer(task_children(self.context, obj), many=True,
+                              context={**self.context, 'task_level': level + 1}).data
+
+    def get_subtasks_count(self, obj):
+        load_task_forest(self, [obj])
+        children = task_children(self.context, obj)
+        return self.context['task_forest']['counts'][obj.pk] if children is None else len(children)
+
+    def get_subtasks_url(self, obj):
+        """Адрес для раскрытия подзадач, не вошедших в ответ; None, если они уже в ответе"""
+        levels = self.context.get('task_levels')
+        if levels is None or self.context.get('task_level', 0) < levels:
+            return None
+        url = f"/api/tasks/?parent={obj.pk}&depth={levels}"
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class BoardTaskSerializer(serializers.ModelSerializer):
+    """Карточка задачи на доске проекта (plan/board.py)"""
+    resp_user = ProfileSerializer(read_only=True, source='responsible_user')
+    subtasks_count = serializers.IntegerField(read_only=True)
+    checklist_total = serializers.IntegerField(read_only=True)
+    checklist_done = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Task
+        fields = ['id', 'name', 'status', 'rank', 'parent_task', 'start', 'end', 'resp_user', 'subtasks_count',
+                  'checklist_total', 'checklist_done']
+
+
+class TaskMoveSerializer(serializers.Serializer):
+    """
+    Перемещение задачи на доске (plan/ranking.py): этап и соседи на новом месте —
+    after (задача выше) и before (задача ниже); без соседей задача встает в конец колонки
+    """
+    status = serializers.PrimaryKeyRelatedField(queryset=Stage.objects.all())
+    after = serializers.PrimaryKeyRelatedField(queryset=Task.objects.all(), required=False, allow_null=True)
+    before = serializers.PrimaryKeyRelatedField(queryset=Task.objects.all(), required=False, allow_null=True)
+
+    def validate(self, data):
+        task = self.context['task']
+        stage = data['status']
+        if stage.project_id != task.project_id:
+            raise serializers.ValidationError({'status': "Этап принадлежит другому проекту"})
+        for field in ('after', 'before'):
+            neighbour = data.get(field)
+            if neighbour is None:
+                continue
+            if neighbour.pk == task.pk:
+                raise serializers.ValidationError({field: "Задача не может быть соседом самой себя"})
+            if neighbour.status_id != stage.pk:
+                raise serializers.ValidationError({field: "Соседняя задача находится в другом этапе"})
+        after, before = data.get('after'), data.get('before')
+        if after is not None and before is not None and (after.rank, after.pk) >= (before.rank, before.pk):
+            raise serializers.ValidationError({'before': "Задача before должна стоять ниже задачи after"})
+        return data
+
+
+class BoardStageSerializer(serializers.ModelSerializer):
+    """Колонка доски: этап, число его задач, прогресс чек-листов и первые задачи"""
+    tasks_count = serializers.IntegerField(read_only=True)
+    checklist_total = serializers.IntegerField(read_only=True)
+    checklist_done = serializers.IntegerField(read_only=True)
+    tasks = BoardTaskSerializer(many=True, read_only=True, source='board_tasks')
+    tasks_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Stage
+        fields = ['id', 'name', 'tasks_count', 'checklist_total', 'checklist_done', 'tasks', 'tasks_url']
+
+    def get_tasks_url(self, obj):
+        """Продолжение колонки: список задач этапа в порядке доски"""
+        url = f"/api/tasks/?project={obj.project_id}&status={obj.pk}&ordering=rank"
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
@@ -0,0 +1,41 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Checklist, ChecklistItem, Stage, Project, Task, task_path_ids
+
+
+def touch_tasks(*task_ids):
+    """Обновляет отметку изменения задач и всех их предков (подзадачи сериализуются внутри родителя)"""
+    task_ids = {task_id for task_id in task_ids if task_id}
+    if not task_ids:
+        return
+    # Предки берутся из материализованных путей, без подъема по дереву запросом на уровень
+    for path in Task.objects.filter(pk__in=task_ids).values_list('path', flat=True):
+        task_ids.update(task_path_ids(path))
+    Task.objects.filter(pk__in=task_ids).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def touch_parent_task(sender, instance, **kwargs):
+    # Перенесенная задача исчезает из подзадач прежнего родителя
+    touch_tasks(instance.parent_task_id, getattr(instance, '_loaded_parent_task_id', None))
+
+
+@receiver(post_save, sender=Checklist)
+@receiver(post_delete, sender=Checklist)
+def touch_checklist_task(sender, instance, **kwargs):
+    touch_tasks(instance.task_id)
+
+
+@receiver(post_save, sender=ChecklistItem)
+@receiver(post_delete, sender=ChecklistItem)
+def touch_checklist_item_task(sender, instance, **kwargs):
+    touch_tasks(Checklist.objects.filter(pk=instance.checklist_id).values_list('task_id', flat=True).first())
+
+
+@receiver(post_save, sender=Stage)
+@receiver(post_delete, sender=Stage)
+def touch_stage_project(sender, instance, **kwargs):
+    Project.objects.filter(pk=instance.project_id).update(updated_at=timezone.now())
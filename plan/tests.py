@@ -1,3 +1,554 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from django.db import connection, connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from crm.jobs import run_pending_jobs
+from crm.models import Job
+from crm.tests import CrmTestMixin
+from .attachments import UPLOAD_READ_SIZE, UploadConflict, start_upload, upload_path, write_chunk
+from .models import *
+from .ranking import TASK_RANK_REBALANCE_LENGTH
+from .views import TaskFilter
+
+
+class PlanTestMixin(CrmTestMixin):
+    """Общие фикстуры для тестов plan"""
+
+    def create_project(self, name='Проект', stages=('К выполнению', 'В работе', 'Готово')):
+        event = self.create_event()
+        direction = Direction.objects.create(event=event, name='Направление')
+        project = Project.objects.create(direction=direction, name=name)
+        for stage_name in stages:
+            Stage.objects.create(project=project, name=stage_name)
+        return project
+
+    def create_task(self, project, profile, name='Задача', stage=None, **kwargs):
+        return Task.objects.create(
+            project=project,
+            creator=profile,
+            responsible_user=profile,
+            status=stage or project.stages.first(),
+            name=name,
+            description='',
+            **kwargs
+        )
+
+
+class TaskSparseFieldsTest(PlanTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('curator')
+        self.client.force_authenticate(self.profile.user)
+        self.project = self.create_project()
+        self.create_task(self.project, self.profile)
+
+    def test_fields_skip_relations(self):
+        # Отметка изменений для ETag, COUNT для пагинации и выборка задач без join'ов и prefetch
+        with self.assertNumQueries(3) as context:
+            response = self.client.get('/api/tasks/', {'fields': 'id,name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        self.assertNotIn('JOIN', context.captured_queries[2]['sql'])
+
+    def test_full_payload(self):
+        response = self.client.get('/api/tasks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['project_info']['stages'][0]['name'], 'К выполнению')
+
+
+class TaskConditionalGetTest(PlanTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('curator')
+        self.client.force_authenticate(self.profile.user)
+        self.project = self.create_project()
+        self.task = self.create_task(self.project, self.profile)
+        self.subtask = self.create_task(self.project, self.profile, name='Подзадача', parent_task=self.task)
+
+    def test_checklist_change_updates_task_etag(self):
+        url = f'/api/tasks/{self.task.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        checklist = Checklist.objects.create(task=self.subtask, name='Чек-лист', description='')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        ChecklistItem.objects.create(checklist=checklist, description='Пункт')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_reparent_updates_old_parent_etag(self):
+        other = self.create_task(self.project, self.profile, name='Другая задача')
+        url = f'/api/tasks/{self.task.id}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.patch(url.replace(str(self.task.id), str(self.subtask.id)),
+                                     {'parent_task': other.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['subtasks'], [])
+
+
+class TaskTreeMixin(PlanTestMixin):
+    def setUp(self):
+        self.profile = self.create_user('curator')
+        self.client.force_authenticate(self.profile.user)
+        self.project = self.create_project()
+        self.root = self.create_task(self.project, self.profile, name='Корень')
+        self.children = [self.create_task(self.project, self.profile, name=f'Подзадача {i}', parent_task=self.root)
+                         for i in range(2)]
+        self.leaf = self.create_task(self.project, self.profile, name='Лист', parent_task=self.children[0])
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(context), response.data
+
+
+class TaskTreeTest(TaskTreeMixin, APITestCase):
+    def test_paths(self):
+        self.leaf.refresh_from_db()
+        self.assertEqual(task_path_ids(self.leaf.path), [self.root.pk, self.children[0].pk, self.leaf.pk])
+        self.assertEqual(self.leaf.depth, 2)
+        self.assertEqual(set(Task.objects.subtrees([self.children[0]])), {self.children[0], self.leaf})
+
+    def test_reparent_moves_subtree(self):
+        other = self.create_task(self.project, self.profile, name='Другой корень')
+        child = self.children[0]
+        child.parent_task = other
+        child.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual(task_path_ids(self.leaf.path), [other.pk, child.pk, self.leaf.pk])
+
+        response = self.client.patch(f'/api/tasks/{self.root.pk}/', {'parent_task': self.children[1].pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent_task', response.data)
+
+    def test_max_depth(self):
+        # Цепочка до наибольшего уровня: корень и leaf уже на уровнях 0 и 2
+        deepest = self.leaf
+        for i in range(TASK_MAX_DEPTH - 2):
+            deepest = self.create_task(self.project, self.profile, name=f'Уровень {i}', parent_task=deepest)
+        deepest.refresh_from_db()
+        self.assertEqual(deepest.depth, TASK_MAX_DEPTH)
+        self.assertLessEqual(len(deepest.path), Task._meta.get_field('path').max_length)
+
+        with self.assertRaises(ValueError):
+            self.create_task(self.project, self.profile, parent_task=deepest)
+        response = self.client.post('/api/tasks/create/', {
+            'project': self.project.pk, 'status': self.project.stages.first().pk, 'name': 'Слишком глубоко',
+            'description': 'Описание', 'responsible_user': self.profile.pk, 'parent_task': deepest.pk,
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent_task', response.data)
+
+        # Перенос поддерева учитывает его высоту: children[0] с листом не помещается под предпоследний уровень
+        response = self.client.patch(f'/api/tasks/{self.children[0].pk}/', {'parent_task': deepest.parent_task_id})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f'/api/tasks/{self.children[1].pk}/', {'parent_task': deepest.parent_task_id})
+        self.assertEqual(response.status_code, 200)
+
+    def test_tree_is_serialized_with_bounded_queries(self):
+        list_queries, data = self.count_queries('/api/tasks/', {'project': self.project.pk})
+        detail_queries, detail = self.count_queries(f'/api/tasks/{self.root.pk}/')
+        root = next(task for task in data['results'] if task['id'] == self.root.pk)
+        self.assertEqual([task['name'] for task in root['subtasks']], ['Подзадача 0', 'Подзадача 1'])
+        self.assertEqual(root['subtasks'][0]['subtasks'][0]['name'], 'Лист')
+        self.assertEqual(detail['subtasks'][0]['subtasks'][0]['resp_user']['user_id'], self.profile.pk)
+
+        # Более глубокое и широкое дерево не добавляет запросов
+        for i in range(3):
+            parent = self.create_task(self.project, self.profile, name=f'Уровень {i}', parent_task=self.leaf)
+            Checklist.objects.create(task=parent, name='Чек-лист', description='')
+            self.create_task(self.project, self.profile, name=f'Лист {i}', parent_task=parent)
+        self.assertEqual(self.count_queries('/api/tasks/', {'project': self.project.pk})[0], list_queries)
+        self.assertEqual(self.count_queries(f'/api/tasks/{self.root.pk}/')[0], detail_queries)
+
+
+class TaskTreeDepthTest(TaskTreeMixin, APITestCase):
+    def get(self, params):
+        response = self.client.get('/api/tasks/', {'project': self.project.pk, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_roots_only_with_depth(self):
+        results = self.get({'roots_only': '1', 'depth': '1'})
+        self.assertEqual([task['id'] for task in results], [self.root.pk])
+        root = results[0]
+        self.assertEqual(root['subtasks_count'], 2)
+        self.assertIsNone(root['subtasks_url'])
+        first, second = root['subtasks']
+        self.assertIsNone(first['subtasks'])
+        self.assertEqual((first['subtasks_count'], second['subtasks_count']), (1, 0))
+        self.assertTrue(first['subtasks_url'].endswith(f'/api/tasks/?parent={self.children[0].pk}&depth=1'))
+
+        # Ссылка раскрывает следующий уровень
+        expanded = self.client.get(first['subtasks_url']).data['results']
+        self.assertEqual([task['id'] for task in expanded], [self.leaf.pk])
+        self.assertEqual(expanded[0]['subtasks'], [])
+
+    def test_depth_zero_returns_counts(self):
+        results = self.get({'roots_only': '1', 'depth': '0'})
+        self.assertIsNone(results[0]['subtasks'])
+        self.assertEqual(results[0]['subtasks_count'], 2)
+
+    def test_depth_limits_queries(self):
+        with CaptureQueriesContext(connection) as shallow:
+            self.get({'roots_only': '1', 'depth': '1'})
+        for i in range(5):
+            self.create_task(self.project, self.profile, name=f'Глубже {i}', parent_task=self.leaf)
+            self.create_task(self.project, self.profile, name=f'Рядом {i}', parent_task=self.root)
+        with CaptureQueriesContext(connection) as wide:
+            results = self.get({'roots_only': '1', 'depth': '1'})
+        self.assertEqual(len(wide), len(shallow))
+        self.assertEqual(results[0]['subtasks_count'], 7)
+
+    def test_invalid_depth(self):
+        response = self.client.get('/api/tasks/', {'depth': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProjectBoardTest(PlanTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('curator')
+        self.client.force_authenticate(self.profile.user)
+        self.project = self.create_project()
+        self.todo, self.doing, self.done = self.project.stages.order_by('id')
+        self.tasks = [self.create_task(self.project, self.profile, name=f'Задача {i}', stage=self.todo)
+                      for i in range(5)]
+        self.create_task(self.project, self.profile, name='В работе', stage=self.doing)
+        checklist = Checklist.objects.create(task=self.tasks[0], name='Чек-лист', description='')
+        for completed in (True, True, False):
+            ChecklistItem.objects.create(checklist=checklist, description='Пункт', is_completed=completed)
+
+    def test_board(self):
+        # Проект, этапы с агрегатами, задачи с оконным отбором
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/project/{self.project.pk}/board/', {'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        todo, doing, done = response.data['stages']
+        self.assertEqual((todo['tasks_count'], doing['tasks_count'], done['tasks_count']), (5, 1, 0))
+        self.assertEqual([task['id'] for task in todo['tasks']], [task.pk for task in self.tasks[:3]])
+        self.assertEqual((todo['checklist_total'], todo['checklist_done']), (3, 2))
+        self.assertEqual((todo['tasks'][0]['checklist_total'], todo['tasks'][0]['checklist_done']), (3, 2))
+        self.assertEqual([task['name'] for task in doing['tasks']], ['В работе'])
+        self.assertEqual(done['tasks'], [])
+        self.assertTrue(todo['tasks_url'].endswith(
+            f'/api/tasks/?project={self.project.pk}&status={self.todo.pk}&ordering=rank'
+        ))
+
+    def test_invalid_limit(self):
+        self.assertEqual(self.client.get(f'/api/project/{self.project.pk}/board/', {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/project/100500/board/').status_code, 404)
+
+
+class TaskRankTest(PlanTestMixin, APITestCase):
+    def setUp(self):
+        self.profile = self.create_user('curator')
+        self.client.force_authenticate(self.profile.user)
+        self.project = self.create_project()
+        self.todo, self.doing, _ = self.project.stages.order_by('id')
+        self.tasks = [self.create_task(self.project, self.profile, name=f'Задача {i}', stage=self.todo)
+                      for i in range(4)]
+
+    def column(self, stage):
+        return list(Task.objects.filter(status=stage).order_by('rank', 'id').values_list('pk', flat=True))
+
+    def move(self, task, **data):
+        return self.client.post(f'/api/tasks/{task.pk}/move/', data, format='json')
+
+    def test_rank_between(self):
+        keys = [rank_between(None, None)]
+        for _ in range(200):
+            keys.append(rank_between(keys[-1], None))
+            keys.insert(0, rank_between(None, keys[0]))
+            keys.insert(len(keys) // 2, rank_between(keys[len(keys) // 2 - 1], keys[len(keys) // 2]))
+        self.assertEqual(keys, sorted(set(keys)))
+        self.assertLessEqual(len(keys[-1]), RANK_STEP_WIDTH)
+        self.assertEqual(spread_ranks(100), sorted(set(spread_ranks(100))))
+
+    def test_new_tasks_go_to_end(self):
+        self.assertEqual(self.column(self.todo), [task.pk for task in self.tasks])
+
+    def test_move_writes_one_row(self):
+        first, second, _, last = self.tasks
+        with CaptureQueriesContext(connection) as queries:
+            response = self.move(last, status=self.todo.pk, after=first.pk)
+        self.assertEqual(response.status_code, 200)
+        writes = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(self.column(self.todo), [first.pk, last.pk, second.pk, self.tasks[2].pk])
+
+        self.move(first, status=self.todo.pk, before=self.tasks[2].pk)
+        self.assertEqual(self.column(self.todo), [last.pk, second.pk, first.pk, self.tasks[2].pk])
+
+    def test_move_to_other_stage(self):
+        other = self.create_task(self.project, self.profile, stage=self.doing)
+        self.assertEqual(self.move(self.tasks[1], status=self.doing.pk).status_code, 200)
+        self.assertEqual(self.column(self.doing), [other.pk, self.tasks[1].pk])
+        self.move(self.tasks[2], status=self.doing.pk, before=other.pk)
+        self.assertEqual(self.column(self.doing), [self.tasks[2].pk, other.pk, self.tasks[1].pk])
+
+        board = self.client.get(f'/api/project/{self.project.pk}/board/').data['stages']
+        self.assertEqual([task['id'] for task in board[1]['tasks']], self.column(self.doing))
+
+    def test_invalid_move(self):
+        self.assertEqual(self.move(self.tasks[0], status=self.doing.pk, after=self.tasks[1].pk).status_code, 400)
+        self.assertEqual(self.move(self.tasks[0], status=self.todo.pk, after=self.tasks[0].pk).status_code, 400)
+        self.assertEqual(self.move(self.tasks[0], status=self.todo.pk, after=self.tasks[3].pk,
+                                   before=self.tasks[1].pk).status_code, 400)
+        foreign = self.create_project(name='Другой').stages.first()
+        self.assertEqual(self.move(self.tasks[0], status=foreign.pk).status_code, 400)
+
+        self.client.force_authenticate(self.create_user('student').user)
+        self.assertEqual(self.move(self.tasks[0], status=self.doing.pk).status_code, 403)
+
+    def test_stage_change_moves_task_to_end(self):
+        other = self.create_task(self.project, self.profile, stage=self.doing)
+        response = self.client.patch(f'/api/tasks/{self.tasks[0].pk}/', {'status': self.doing.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.column(self.doing), [other.pk, self.tasks[0].pk])
+        self.assertNotEqual(Task.objects.get(pk=self.tasks[0].pk).rank, other.rank)
+
+    def test_column_continuation_in_board_order(self):
+        self.move(self.tasks[3], status=self.todo.pk, before=self.tasks[0].pk)
+        board = self.client.get(f'/api/project/{self.project.pk}/board/').data['stages']
+        url = board[0]['tasks_url']
+        self.assertEqual([task['id'] for task in self.client.get(url).data['results']], self.column(self.todo))
+        keyset = self.client.get(f'{url}&pagination=keyset&page_size=2').data
+        ids = [task['id'] for task in keyset['results']]
+        ids += [task['id'] for task in self.client.get(keyset['next']).data['results']]
+        self.assertEqual(ids, self.column(self.todo))
+
+    def test_tied_neighbours_are_rebalanced(self):
+        # Ключи соседей могут совпасть при гонке параллельных перемещений
+        Task.objects.filter(pk__in=[task.pk for task in self.tasks]).update(rank='i')
+        self.assertEqual(self.move(self.tasks[3], status=self.todo.pk, after=self.tasks[0].pk).status_code, 200)
+        self.assertEqual(self.column(self.todo), [self.tasks[i].pk for i in (0, 3, 1, 2)])
+        ranks = list(Task.objects.filter(status=self.todo).order_by('rank').values_list('rank', flat=True))
+        self.assertEqual(len(set(ranks)), 4)
+
+    def test_long_rank_schedules_rebalance(self):
+        first = self.tasks[0]
+        # Каждая вставка между одними и теми же задачами делит интервал пополам
+        for _ in range(TASK_RANK_REBALANCE_LENGTH * 4):
+            self.move(self.tasks[3], status=self.todo.pk, after=first.pk)
+            self.move(self.tasks[2], status=self.todo.pk, after=first.pk)
+        order = self.column(self.todo)
+        self.assertEqual(Job.objects.filter(kind='rebalance_task_ranks', status=Job.PENDING).count(), 1)
+
+        run_pending_jobs()
+        self.assertEqual(self.column(self.todo), order)
+        ranks = Task.objects.filter(status=self.todo).values_list('rank', flat=True)
+        self.assertLessEqual(max(len(rank) for rank in ranks), RANK_STEP_WIDTH)
+
+
+class CommentUploadTest(PlanTestMixin, APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root, COMMENT_UPLOAD_CHUNK_SIZE=64 * 1024)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.profile = self.create_user('student')
+        self.client.force_authenticate(self.profile.user)
+        self.task = self.create_task(self.create_project(), self.profile)
+
+    def start(self, data, filename='photo.png'):
+        response = self.client.post(f'/api/tasks/{self.task.pk}/uploads/',
+                                    {'filename': filename, 'size': len(data), 'content': 'Вложение'})
+        self.assertEqual(response.status_code, 201)
+        return CommentUpload.objects.get(pk=response.data['id'])
+
+    def send(self, upload, offset, chunk):
+        return self.client.generic('PATCH', f'/api/uploads/{upload.pk}/', chunk,
+                                   content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def upload(self, data, filename='photo.png', chunk_size=50 * 1024):
+        upload = self.start(data, filename)
+        for offset in range(0, len(data), chunk_size):
+            response = self.send(upload, offset, data[offset:offset + chunk_size])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['offset'], min(offset + chunk_size, len(data)))
+        return response.data
+
+    def test_chunked_upload_creates_comment(self):
+        buffer = io.BytesIO()
+        Image.effect_noise((800, 400), 64).convert('RGB').save(buffer, 'PNG')
+        data = buffer.getvalue()
+        self.assertGreater(len(data), 2 * 50 * 1024)
+
+        result = self.upload(data)
+        comment = Comment.objects.get(pk=result['comment'])
+        self.assertEqual((comment.task, comment.author, comment.content), (self.task, self.profile, 'Вложение'))
+        with comment.file.open('rb') as stored:
+            self.assertEqual(stored.read(), data)
+        self.assertFalse(os.path.exists(upload_path(CommentUpload.objects.get(pk=result['id']))))
+
+        # Миниатюра и сведения об изображении — в фоновой задаче
+        self.assertFalse(comment.thumbnail)
+        run_pending_jobs()
+        comment.refresh_from_db()
+        self.assertEqual(comment.file_size, len(data))
+        self.assertEqual(comment.file_meta, {'content_type': 'image/png', 'format': 'PNG', 'width': 800, 'height': 400})
+        with comment.thumbnail.open('rb') as thumbnail, Image.open(thumbnail) as image:
+            self.assertEqual(image.size, (320, 160))
+
+        response = self.client.get(f'/api/tasks/{self.task.pk}/comments/', {'page_size': 10})
+        self.assertEqual(response.data['results'][0]['file_meta']['width'], 800)
+
+    def test_non_image_attachment(self):
+        result = self.upload(b'plain text' * 100, filename='../notes.txt')
+        run_pending_jobs()
+        comment = Comment.objects.get(pk=result['comment'])
+        self.assertEqual(os.path.basename(comment.file.name), 'notes.txt')
+        self.assertEqual(comment.file_meta, {'content_type': 'text/plain'})
+        self.assertFalse(comment.thumbnail)
+
+    def test_resume_after_conflict(self):
+        data = os.urandom(100 * 1024)
+        upload = self.start(data, 'archive.bin')
+        self.assertEqual(self.send(upload, 0, data[:30000]).status_code, 200)
+
+        # Повтор уже полученной части: клиент узнает смещение и продолжает с него
+        response = self.send(upload, 0, data[:30000])
+        self.assertEqual((response.status_code, response.data['offset']), (409, 30000))
+        self.assertEqual(self.client.get(f'/api/uploads/{upload.pk}/').data['offset'], 30000)
+        self.assertEqual(self.send(upload, 30000, data[30000:]).status_code, 413)
+        self.assertEqual(self.send(upload, 30000, data[30000:90000]).status_code, 200)
+        self.assertEqual(self.send(upload, 90000, data[90000:] + b'extra').status_code, 400)
+        response = self.send(upload, 90000, data[90000:])
+        with Comment.objects.get(pk=response.data['comment']).file.open('rb') as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_concurrent_chunks_at_same_offset(self):
+        data = os.urandom(60000)
+        upload = self.start(data, 'archive.bin')
+        # Второй запрос с тем же смещением прочитал загрузку до того, как первый записал часть
+        stale = CommentUpload.objects.get(pk=upload.pk)
+        self.assertEqual(self.send(upload, 0, data[:30000]).status_code, 200)
+        with self.assertRaises(UploadConflict):
+            write_chunk(stale, 0, io.BytesIO(b'x' * 30000), 30000)
+        self.assertEqual(stale.received, 30000)
+        with open(upload_path(upload), 'rb') as part:
+            self.assertEqual(part.read(), data[:30000])
+
+        response = self.send(upload, 30000, data[30000:])
+        with Comment.objects.get(pk=response.data['comment']).file.open('rb') as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_foreign_and_cancelled_uploads(self):
+        upload = self.start(b'data')
+        self.client.force_authenticate(self.create_user('other').user)
+        self.assertEqual(self.send(upload, 0, b'data').status_code, 404)
+
+        self.client.force_authenticate(self.profile.user)
+        self.assertEqual(self.client.delete(f'/api/uploads/{upload.pk}/').status_code, 204)
+        self.assertFalse(os.path.exists(upload_path(upload)))
+        self.assertEqual(self.client.post('/api/tasks/100500/uploads/', {'filename': 'a', 'size': 1}).status_code, 404)
+
+
+class SlowStream(io.BytesIO):
+    """Тело запроса, читаемое медленно: запись части заведомо пересекается с параллельной"""
+
+    def __init__(self, data, reading):
+        super().__init__(data)
+        self.reading = reading
+
+    def read(self, size=-1):
+        self.reading.set()
+        time.sleep(0.05)
+        return super().read(size)
+
+
+class CommentUploadConcurrencyTest(PlanTestMixin, TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        profile = self.create_user('student')
+        task = self.create_task(self.create_project(), profile)
+        self.upload = CommentUpload.objects.create(task=task, author=profile, filename='archive.bin',
+                                                   size=10 * UPLOAD_READ_SIZE)
+        start_upload(self.upload)
+
+    def write(self, stream, length, results):
+        try:
+            upload = CommentUpload.objects.get(pk=self.upload.pk)
+            results.append(write_chunk(upload, 0, stream, length))
+        except UploadConflict:
+            results.append('conflict')
+        finally:
+            connections.close_all()
+
+    def test_parallel_writers_at_same_offset(self):
+        length = 3 * UPLOAD_READ_SIZE
+        reading, results = threading.Event(), []
+        first = threading.Thread(target=self.write, args=(SlowStream(b'a' * length, reading), length, results))
+        second = threading.Thread(target=self.write, args=(io.BytesIO(b'b' * length), length, results))
+        first.start()
+        # Второй запрос приходит, пока первый еще пишет часть
+        reading.wait()
+        second.start()
+        first.join()
+        second.join()
+
+        self.assertCountEqual(results, [length, 'conflict'])
+        self.assertEqual(CommentUpload.objects.get(pk=self.upload.pk).received, length)
+        with open(upload_path(self.upload), 'rb') as part:
+            self.assertEqual(part.read(), b'a' * length)
+
+
+class TaskFilterTest(PlanTestMixin, APITestCase):
+    def setUp(self):
+        self.project = self.create_project()
+        self.profile = self.create_user('student')
+        self.task = self.create_task(self.project, self.profile)
+        Task.objects.filter(pk=self.task.pk).update(
+            start=datetime.datetime(2025, 3, 1, 10, tzinfo=datetime.timezone.utc),
+            end=datetime.datetime(2025, 3, 5, 23, 30, tzinfo=datetime.timezone.utc),
+        )
+
+    def filter(self, **params):
+        return set(TaskFilter(params, queryset=Task.objects.all()).qs.values_list('pk', flat=True))
+
+    def test_filters(self):
+        stage = self.task.status
+        self.assertEqual(self.filter(status=stage.pk), {self.task.pk})
+        self.assertEqual(self.filter(status=stage.name), {self.task.pk})
+        self.assertEqual(self.filter(author=self.profile.pk, responsible_users=self.profile.pk), {self.task.pk})
+        self.assertEqual(self.filter(deadline='2025-03-05'), {self.task.pk})
+        self.assertEqual(self.filter(deadline='2025-03-06'), set())
+        self.assertEqual(self.filter(created_after='2025-03-01', created_before='2025-03-01'), {self.task.pk})
+
+    def test_filters_use_indexes(self):
+        table = Task._meta.db_table
+        stage = self.task.status.pk
+        combinations = [
+            {'project': self.project.pk},
+            {'project': self.project.pk, 'status': stage},
+            {'project': self.project.pk, 'responsible_users': self.profile.pk},
+            {'project': self.project.pk, 'created_after': '2025-01-01'},
+            {'project': self.project.pk, 'roots_only': '1'},
+            {'responsible_users': self.profile.pk, 'status': stage},
+            {'author': self.profile.pk, 'status': stage},
+            {'deadline': '2025-03-05'},
+            {'created_after': '2025-01-01', 'created_before': '2025-03-31'},
+        ]
+        for params in combinations:
+            with self.subTest(params=params):
+                self.assert_filter_uses_index(TaskFilter, Task.objects.all(), params, table)
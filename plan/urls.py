@@ -6,9 +6,12 @@ urlpatterns = [
     path('tasks/create/', TaskAPICreate.as_view()),
     path('tasks/', TaskAPIList.as_view()),
     path('tasks/<int:pk>/', TaskAPIUpdate.as_view()),
+    path('tasks/<int:pk>/move/', TaskMoveAPI.as_view()),
 
     # 🔹 Комментарии
     path('tasks/<int:pk>/comments/', CommentAPIListCreate.as_view()),  # Список и создание
+    path('tasks/<int:pk>/uploads/', CommentUploadAPICreate.as_view()),  # Загрузка вложения частями
+    path('uploads/<int:pk>/', CommentUploadAPI.as_view()),  # Состояние, отправка части, отмена
     #path('comments/<int:pk>/', CommentAPIUpdate.as_view()),  # Редактирование и удаление
 
     # 🔹 Чек-листы
@@ -22,6 +25,7 @@ urlpatterns = [
     path('project/create/', ProjectAPICreate.as_view()),
     path('project/', ProjectAPIList.as_view()),
     path('project/<int:pk>', ProjectAPIUpdate.as_view()),
+    path('project/<int:pk>/board/', ProjectBoardAPI.as_view()),
     path('teams/', TeamAPIList.as_view()),
     path('teams/create/', TeamAPICreate.as_view()),
     path('teams/<int:pk>/', TeamAPIUpdate.as_view()),
@@ -1,14 +1,22 @@
+from django.conf import settings
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django_filters.rest_framework.backends import DjangoFilterBackend
 from rest_framework import generics, viewsets, pagination, status
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from crm.conditional import ConditionalGetMixin
+from crm.fieldsets import SparseFieldsViewMixin
+from crm.filters import DayEndFilter, DayFilter, DayStartFilter, filter_by_id_or_name
+from crm.pagination import KeysetPagination
 from crm.serializers import ProfileSerializer, Profile
 from .models import *
+from .attachments import UploadConflict, cancel_upload, schedule_attachment, start_upload, write_chunk
+from .board import BOARD_TASK_ORDERING, project_board
+from .ranking import move_task
 from .permissions import IsAuthorOrReadOnly
 from .serializers import *
 from django.db.models import Q
@@ -27,7 +35,17 @@ class TaskAPIListPagination(pagination.PageNumberPagination):
     max_page_size = 100
 
 
-class ProfileSearchAPIView(generics.ListAPIView):
+class TaskAPIKeysetPagination(KeysetPagination):
+    page_size = 10
+    legacy_pagination_class = TaskAPIListPagination
+
+
+class CommentAPIListPagination(KeysetPagination):
+    page_size = 10
+    legacy_pagination_class = pagination.LimitOffsetPagination
+
+
+class ProfileSearchAPIView(SparseFieldsViewMixin, generics.ListAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [IsAuthenticated]
@@ -35,17 +53,39 @@ class ProfileSearchAPIView(generics.ListAPIView):
     search_fields = ['name', 'surname']
 
 
+# Изменения подзадач и чек-листов поднимают updated_at родительской задачи,
+# изменения этапов — updated_at проекта (plan/signals.py)
+TASK_CONDITIONAL_MODELS = (Profile, Project, Direction)
+
+
 class TaskFilter(filters.FilterSet):
+    # Каждый фильтр опирается на индексы Task.Meta.indexes, кроме поиска по подстроке названия
     name = filters.CharFilter(field_name='name', lookup_expr='icontains')
-    status = filters.CharFilter(field_name='status', lookup_expr='iexact')
-    author = filters.NumberFilter(field_name='author__author__id')
-    responsible_users = filters.NumberFilter(field_name='responsible_users__author__id')
-    project = filters.NumberFilter(field_name='project__id')
-    deadline = filters.DateFilter(field_name='deadline')
-    created_after = filters.DateFilter(field_name='datetime', lookup_expr='gte')  # Начальная дата
-    created_before = filters.DateFilter(field_name='datetime', lookup_expr='lte')  # Конечная дата
+    status = filters.CharFilter(method='filter_status')  # id или название этапа
+    author = filters.NumberFilter(field_name='creator')
+    responsible_users = filters.NumberFilter(field_name='responsible_user')
+    project = filters.NumberFilter(field_name='project')
+    deadline = DayFilter(field_name='end')
+    created_after = DayStartFilter(field_name='start')  # Начальная дата
+    created_before = DayEndFilter(field_name='start')  # Конечная дата
     task_id = filters.NumberFilter(field_name='id')
     team = filters.NumberFilter(method='filter_by_team')
+    parent = filters.NumberFilter(field_name='parent_task')  # Раскрытие подзадач (TaskSerializer.subtasks_url)
+    roots_only = filters.CharFilter(method='filter_roots_only')  # 1 — только задачи верхнего уровня
+    ordering = filters.CharFilter(method='filter_ordering')  # rank — порядок колонки доски (BOARD_TASK_ORDERING)
+
+    def filter_ordering(self, queryset, name, value):
+        if value == 'rank':
+            return queryset.order_by(*BOARD_TASK_ORDERING)
+        return queryset
+
+    def filter_roots_only(self, queryset, name, value):
+        if value.lower() in ('1', 'true', 'yes'):
+            return queryset.filter(depth=0)
+        return queryset
+
+    def filter_status(self, queryset, name, value):
+        return filter_by_id_or_name(queryset, 'status', value)
 
     def filter_by_team(self, queryset, name, value):
         team = Team.objects.filter(id=value).first()
@@ -58,17 +98,34 @@ class TaskFilter(filters.FilterSet):
         fields = [
             'name', 'status', 'deadline', 'author',
             'responsible_users', 'project', 'created_after',
-            'created_before', 'task_id', 'team'
+            'created_before', 'task_id', 'team', 'parent', 'roots_only', 'ordering'
         ]
 
 
-class TaskAPIList(generics.ListAPIView):
+class TaskTreeDepthMixin:
+    """
+    ?depth=N — в ответ входят N уровней подзадач; у задач нижнего уровня вместо подзадач
+    возвращаются их количество (subtasks_count) и адрес для раскрытия (subtasks_url)
+    """
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        depth = self.request.query_params.get('depth')
+        if depth is not None:
+            if not depth.isdigit():
+                raise ValidationError({'depth': "Глубина должна быть неотрицательным целым числом"})
+            context['task_levels'] = int(depth)
+        return context
+
+
+class TaskAPIList(TaskTreeDepthMixin, ConditionalGetMixin, SparseFieldsViewMixin, generics.ListAPIView):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_class = TaskFilter
-    pagination_class = TaskAPIListPagination
+    pagination_class = TaskAPIKeysetPagination
+    conditional_models = TASK_CONDITIONAL_MODELS
 
 
 class TaskAPICreate(generics.CreateAPIView):
@@ -80,14 +137,37 @@ class TaskAPICreate(generics.CreateAPIView):
         serializer.save(creator=self.request.user.profile)
 
 
-class TaskAPIUpdate(generics.RetrieveUpdateDestroyAPIView):
+class TaskAPIUpdate(TaskTreeDepthMixin, ConditionalGetMixin, SparseFieldsViewMixin,
+                    generics.RetrieveUpdateDestroyAPIView):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
     permission_classes = (IsAuthorOrReadOnly,)
+    conditional_models = TASK_CONDITIONAL_MODELS
+
+
+class TaskMoveAPI(APIView):
+    """
+    Перемещение задачи между этапами и внутри колонки: меняется только строка самой задачи
+    POST /api/tasks/<pk>/move/ {"status": 3, "after": 12, "before": 15}
+    """
+    permission_classes = (IsAuthenticated, IsAuthorOrReadOnly)
+
+    def post(self, request, pk):
+        task = Task.objects.filter(pk=pk).first()
+        if task is None:
+            return Response({"error": "Task not found."}, status=status.HTTP_404_NOT_FOUND)
+        self.check_object_permissions(request, task)
+        serializer = TaskMoveSerializer(data=request.data, context={'task': task})
+        serializer.is_valid(raise_exception=True)
+        move_task(task, serializer.validated_data['status'], serializer.validated_data.get('after'),
+                  serializer.validated_data.get('before'))
+        return Response({"id": task.pk, "status": task.status_id, "rank": task.rank})
+
 
-class CommentAPIListCreate(generics.ListCreateAPIView):
+class CommentAPIListCreate(ConditionalGetMixin, SparseFieldsViewMixin, generics.ListCreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CommentAPIListPagination
 
     def get_queryset(self):
         task_id = self.kwargs.get('pk')
@@ -103,7 +183,61 @@ class CommentAPIListCreate(generics.ListCreateAPIView):
             task = Task.objects.get(pk=task_id)
         except Task.DoesNotExist:
             raise NotFound({"error": "Task not found."})
-        serializer.save(author=self.request.user.profile, task=task)
+        comment = serializer.save(author=self.request.user.profile, task=task)
+        if comment.file:
+            schedule_attachment(comment)
+
+
+class CommentUploadAPICreate(generics.CreateAPIView):
+    """
+    Начало загрузки вложения комментария частями
+    POST /api/tasks/<pk>/uploads/ {"filename": "plan.pdf", "size": 104857600, "content": "Текст"}
+    """
+    serializer_class = CommentUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        task = Task.objects.filter(pk=self.kwargs.get('pk')).first()
+        if task is None:
+            raise NotFound({"error": "Task not found."})
+        start_upload(serializer.save(author=self.request.user.profile, task=task))
+
+
+class CommentUploadAPI(generics.RetrieveDestroyAPIView):
+    """
+    Состояние загрузки (GET — смещение для продолжения), отправка части и отмена:
+    PATCH /api/uploads/<pk>/ с заголовком Upload-Offset и байтами части в теле запроса.
+    После последней части ответ содержит id созданного комментария.
+    """
+    serializer_class = CommentUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return CommentUpload.objects.filter(author=self.request.user.profile)
+
+    def patch(self, request, pk):
+        upload = self.get_object()
+        offset = request.headers.get('Upload-Offset', '')
+        length = request.META.get('CONTENT_LENGTH') or '0'
+        if not offset.isdigit() or not length.isdigit() or not int(length):
+            return Response({"error": "Нужны заголовок Upload-Offset и непустое тело запроса"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if int(length) > settings.COMMENT_UPLOAD_CHUNK_SIZE:
+            return Response({"error": f"Часть больше {settings.COMMENT_UPLOAD_CHUNK_SIZE} байт"},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            # Тело читается из потока запроса, минуя парсеры DRF
+            write_chunk(upload, int(offset), request.stream, int(length))
+        except UploadConflict:
+            upload.refresh_from_db()
+            return Response({"error": "Смещение не совпадает с полученными данными", "offset": upload.received},
+                            status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(upload).data)
+
+    def perform_destroy(self, instance):
+        cancel_upload(instance)
 
 
 class CommentAPIView(APIView):
@@ -132,7 +266,7 @@ class CommentAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ChecklistAPIListCreate(generics.ListCreateAPIView):
+class ChecklistAPIListCreate(SparseFieldsViewMixin, generics.ListCreateAPIView):
     serializer_class = CheckListSerializer
     permission_classes = (IsAuthenticated,)
 
@@ -159,7 +293,7 @@ class ChecklistAPIUpdate(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (IsAuthenticated,)
 
 
-class ChecklistItemAPIListCreate(generics.ListCreateAPIView):
+class ChecklistItemAPIListCreate(SparseFieldsViewMixin, generics.ListCreateAPIView):
     serializer_class = CheckListItemSerializer
     permission_classes = (IsAuthenticated,)
 
@@ -186,15 +320,41 @@ class ChecklistItemAPIUpdate(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (IsAuthenticated,)
 
 
-class ProjectAPIUpdate(generics.RetrieveUpdateDestroyAPIView):
+class ProjectAPIUpdate(SparseFieldsViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
 
 
-class ProjectAPIList(generics.ListAPIView):
+class ProjectBoardAPI(APIView):
+    """
+    Доска проекта за один запрос: этапы с числом задач, прогрессом чек-листов и первыми задачами
+    GET /api/project/<pk>/board/?limit=20
+    """
+    permission_classes = (IsAuthenticated,)
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request, pk):
+        project = Project.objects.filter(pk=pk).first()
+        if project is None:
+            return Response({"error": "Project not found."}, status=status.HTTP_404_NOT_FOUND)
+        limit = request.query_params.get('limit', str(self.default_limit))
+        if not limit.isdigit() or not 0 < int(limit) <= self.max_limit:
+            return Response({"error": f"limit должен быть от 1 до {self.max_limit}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        stages = project_board(project, int(limit))
+        return Response({
+            "project": {"id": project.pk, "name": project.name},
+            "stages": BoardStageSerializer(stages, many=True, context={'request': request}).data,
+        })
+
+
+class ProjectAPIList(ConditionalGetMixin, SparseFieldsViewMixin, generics.ListAPIView):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = (IsAuthenticated,)
+    conditional_models = (Direction,)
 
 
 class ProjectAPICreate(generics.CreateAPIView):
@@ -203,7 +363,7 @@ class ProjectAPICreate(generics.CreateAPIView):
     permission_classes = (IsAuthenticated,)
 
 
-class TeamAPIList(generics.ListAPIView):
+class TeamAPIList(SparseFieldsViewMixin, generics.ListAPIView):
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
     permission_classes = (IsAuthenticated,)
@@ -215,6 +375,6 @@ class TeamAPICreate(generics.CreateAPIView):
     permission_classes = (IsAuthenticated,)
 
 
-class TeamAPIUpdate(generics.RetrieveUpdateDestroyAPIView):
+class TeamAPIUpdate(SparseFieldsViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Team.objects.all()
     serializer_class = TeamSerializer